@@ -0,0 +1,252 @@
+"""Admission control: rate limits, bounded concurrency and load shedding.
+
+Without limits, a burst of weather or Wikipedia requests opens one upstream
+call per request thread. Latency then climbs for everyone until the upstream
+starts refusing. Three layers keep the load within what can be served:
+
+* ``ClientRateLimiter`` gives each client a token bucket. A client that
+  runs dry is refused straight away with the time until its next token.
+* ``AdmissionController`` caps the requests being worked on at once. Later
+  requests wait in a FIFO queue, but only while they can still finish by
+  their deadline. The expected wait comes from the queue length and recent
+  service times, so a request that would miss its deadline is refused at once
+  rather than after waiting.
+* ``UpstreamGate`` puts the same cap in front of each upstream service and adds
+  a quota budget (e.g. 60 calls a minute), waiting for the next call only
+  if it comes before the deadline.
+
+A refusal raises ``Overloaded`` with a ``retry_after`` in seconds, which the
+web app turns into a 429 or 503 response with a Retry-After header. Deadlines
+are per thread (``deadline_scope``), so an upstream call waits no longer than
+the request it serves has left.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+# Clients whose buckets are remembered before the least recently seen are forgotten
+MAX_TRACKED_CLIENTS = 10000
+# Service time assumed before any request has finished
+INITIAL_SERVICE_TIME = 0.1
+# Weight of the newest sample in the moving average of service time
+SERVICE_TIME_WEIGHT = 0.2
+
+_local = threading.local()
+
+
+class Overloaded(Exception):
+    """Work refused to protect latency; try again after ``retry_after`` seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def request_deadline() -> Optional[float]:
+    """The ``time.monotonic()`` by which this thread's current request should finish, if any"""
+    return getattr(_local, 'deadline', None)
+
+
+@contextmanager
+def deadline_scope(at: Optional[float]):
+    """Run the block under deadline ``at`` (monotonic seconds; None for no deadline)"""
+    outer = request_deadline()
+    _local.deadline = at
+    try:
+        yield at
+    finally:
+        _local.deadline = outer
+
+
+class TokenBucket:
+    """``rate`` tokens a second, holding at most ``burst``"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def available(self, now: Optional[float] = None) -> float:
+        """Tokens in the bucket now"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self, now: Optional[float] = None) -> float:
+        """Take a token; returns 0.0, or how many seconds until one is available (nothing taken)"""
+        if self.available(now) >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+
+class ClientRateLimiter:
+    """A token bucket per client key"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = MAX_TRACKED_CLIENTS, metrics=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.metrics = metrics
+        self.buckets: 'OrderedDict[str, TokenBucket]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, client: str) -> float:
+        """0.0 if the client may go ahead, else the seconds until it may"""
+        with self._lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                bucket = self.buckets[client] = TokenBucket(self.rate, self.burst)
+                if len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(client)
+            wait = bucket.take()
+        if wait and self.metrics:
+            self.metrics.increment('requests_rate_limited')
+        return wait
+
+
+class AdmissionController:
+    """At most ``limit`` holders at once; the rest queue FIFO while they can still meet their deadline"""
+
+    def __init__(self, name: str, limit: int, max_queue: int, default_wait: float = 5.0, metrics=None):
+        self.name = name
+        self.counter = f"{name.replace('-', '_')}_shed"
+        self.limit = limit
+        self.max_queue = max_queue
+        self.default_wait = default_wait
+        self.metrics = metrics
+        self.active = 0
+        self.service_time = INITIAL_SERVICE_TIME
+        self.admitted = 0
+        self.shed = 0
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    def expected_wait(self, position: int) -> float:
+        """Seconds until the request at queue ``position`` (1 = next) gets a slot, at recent service times"""
+        return math.ceil(position / self.limit) * self.service_time
+
+    def _refuse(self, reason: str, retry_after: float):
+        with self._cond:
+            self.shed += 1
+        if self.metrics:
+            self.metrics.increment(self.counter)
+        raise Overloaded(f"{self.name}: {reason}", retry_after)
+
+    def _acquire(self, deadline: Optional[float]):
+        now = time.monotonic()
+        deadline = now + self.default_wait if deadline is None else deadline
+        with self._cond:
+            if self.active < self.limit and not self._waiting:
+                self.active += 1
+                self.admitted += 1
+                return
+            expected = self.expected_wait(len(self._waiting) + 1)
+            if len(self._waiting) >= self.max_queue:
+                self._refuse("queue is full", expected)
+            if now + expected + self.service_time > deadline:
+                self._refuse("would miss its deadline", expected)
+            ticket = object()
+            self._waiting.append(ticket)
+            try:
+                while self.active >= self.limit or self._waiting[0] is not ticket:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._refuse("deadline passed while queued", self.expected_wait(len(self._waiting)))
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                # The next in line may be able to go now (or it just lost its place at the head)
+                self._cond.notify_all()
+            self.active += 1
+            self.admitted += 1
+
+    def _release(self, seconds: float):
+        with self._cond:
+            self.active -= 1
+            self.service_time += SERVICE_TIME_WEIGHT * (seconds - self.service_time)
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, deadline: Optional[float] = None) -> Iterator[None]:
+        """Hold a slot for the block; raises Overloaded instead of waiting past ``deadline``.
+
+        ``deadline`` defaults to the thread's request deadline, or ``default_wait`` from now.
+        """
+        start = time.monotonic()
+        self._acquire(request_deadline() if deadline is None else deadline)
+        if self.metrics:
+            self.metrics.observe('admission', time.monotonic() - start, self.name)
+        held = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - held)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'active': self.active,
+                'queued': len(self._waiting),
+                'admitted': self.admitted,
+                'shed': self.shed,
+                'service_ms': round(self.service_time * 1000, 1),
+            }
+
+
+class UpstreamGate(AdmissionController):
+    """Concurrency cap plus an optional quota of ``calls`` per ``period`` seconds for one upstream service"""
+
+    def __init__(self, name: str, limit: int, max_queue: int, quota: Optional[Tuple[int, float]] = None,
+                 default_wait: float = 5.0, metrics=None):
+        super().__init__(name, limit, max_queue, default_wait, metrics)
+        self.counter = f"upstream_{self.counter}"
+        self.quota = TokenBucket(quota[0] / quota[1], quota[0]) if quota else None
+        self._quota_lock = threading.Lock()
+
+    def _acquire(self, deadline: Optional[float]):
+        if self.quota:
+            now = time.monotonic()
+            with self._quota_lock:
+                wait = self.quota.take(now)
+            if wait:
+                if now + wait > (now + self.default_wait if deadline is None else deadline):
+                    self._refuse("quota used up", wait)
+                time.sleep(wait)
+                with self._quota_lock:
+                    # Others may have taken the new token while this thread slept
+                    if self.quota.take():
+                        self._refuse("quota used up", wait)
+        super()._acquire(deadline)
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        if self.quota:
+            with self._quota_lock:
+                stats['quota_left'] = int(self.quota.available())
+        return stats
+
+
+def parse_quotas(spec: str) -> Dict[str, Tuple[int, float]]:
+    """'openweathermap=60/60,newsapi=100/86400' -> {'openweathermap': (60, 60.0), ...}"""
+    quotas = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, budget = item.partition('=')
+        calls, _, seconds = budget.partition('/')
+        try:
+            quotas[name.strip()] = (int(calls), float(seconds or 1))
+        except ValueError:
+            raise ValueError(f"Invalid upstream quota {item!r}; expected name=calls/seconds")
+    return quotas
@@ -0,0 +1,256 @@
+"""Intent usage rolled up per hour and per day as turns are handled.
+
+Answering "which intents dominate, how confident is the matcher, how often
+does it fall back, how slow are the handlers" from raw turn logs means
+scanning every turn in the range, which gets slower as history grows.
+``IntentAnalytics`` instead keeps one row per (hour, intent) and one per
+(day, intent). Each row holds the turn count, the fallback count, a
+confidence histogram and a handler latency histogram. Recording a turn adds
+to an in-memory row. A background writer adds the pending rows to both tables
+with one upsert each, every ``flush_interval`` seconds.
+
+A query over any range reads whole days from the daily table and the partial
+days at either end from the hourly table. That is at most 46 hourly rows plus
+one daily row per day per intent, however many turns were logged.
+"""
+import logging
+import math
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+# Confidence histogram: ten buckets of 0.1 from 0.0 to 1.0
+CONFIDENCE_BUCKETS = 10
+# Upper bounds (ms) of the handler latency buckets; a last bucket takes everything slower
+LATENCY_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Most points a series query returns
+MAX_SERIES_POINTS = 5000
+
+HOUR = 3600
+DAY = 86400
+
+# Row layout: turns, fallbacks, confidence sum, latency sum and max, then the histogram counts
+SUMMED = (['turns', 'fallbacks', 'confidence_sum', 'latency_sum_ms']
+          + [f'confidence_{i}' for i in range(CONFIDENCE_BUCKETS)]
+          + [f'latency_{i}' for i in range(len(LATENCY_BOUNDS_MS) + 1)])
+COLUMNS = SUMMED[:4] + ['latency_max_ms'] + SUMMED[4:]
+TURNS, FALLBACKS, CONFIDENCE_SUM, LATENCY_SUM, LATENCY_MAX = range(5)
+CONFIDENCE_START = 5
+LATENCY_START = CONFIDENCE_START + CONFIDENCE_BUCKETS
+REAL_COLUMNS = ('confidence_sum', 'latency_sum_ms', 'latency_max_ms')
+TABLES = {'hour': 'intent_usage_hourly', 'day': 'intent_usage_daily'}
+
+
+def _upsert(table: str, key: str) -> str:
+    updates = [f"{column} = {column} + excluded.{column}" for column in SUMMED]
+    updates.append("latency_max_ms = MAX(latency_max_ms, excluded.latency_max_ms)")
+    return (f"INSERT INTO {table} ({key}, intent, {', '.join(COLUMNS)}) "
+            f"VALUES ({', '.join('?' * (len(COLUMNS) + 2))}) "
+            f"ON CONFLICT ({key}, intent) DO UPDATE SET {', '.join(updates)}")
+
+
+def _merge(total: List[float], row) -> List[float]:
+    for i, value in enumerate(row):
+        total[i] = max(total[i], value) if i == LATENCY_MAX else total[i] + value
+    return total
+
+
+def _latency_quantile(counts: List[int], quantile: float, maximum: float) -> float:
+    """Estimate from the latency histogram, interpolating inside the bucket the quantile falls in"""
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = quantile * total
+    seen, lower = 0, 0.0
+    for count, upper in zip(counts, LATENCY_BOUNDS_MS + (maximum,)):
+        if count and seen + count >= rank:
+            upper = min(upper, maximum)
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+        lower = upper
+    return maximum
+
+
+def iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+
+def parse_time(value: str) -> float:
+    """Epoch seconds from epoch seconds or an ISO 8601 time (UTC unless it says otherwise)"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"'{value}' is not a time; use epoch seconds or ISO 8601")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class IntentAnalytics:
+    """Hourly and daily per-intent rollups in SQLite, updated in the background"""
+
+    def __init__(self, connection: sqlite3.Connection, lock: Optional[threading.Lock] = None,
+                 flush_interval: float = 5.0):
+        self.connection = connection
+        self.lock = lock or threading.Lock()
+        self.flush_interval = flush_interval
+        # (hour, intent) -> row in COLUMNS order, not yet written
+        self.pending: Dict[Tuple[int, str], List[float]] = {}
+        self._pending_lock = threading.Lock()
+        # Held for a whole flush, so a query's own flush waits for one already under way
+        self._flush_lock = threading.Lock()
+        self._create_tables()
+        self._writer = threading.Thread(target=self._write_loop, name='analytics-writer', daemon=True)
+        self._writer.start()
+
+    def _create_tables(self):
+        columns = ', '.join(f"{column} {'REAL' if column in REAL_COLUMNS else 'INTEGER'} NOT NULL DEFAULT 0"
+                            for column in COLUMNS)
+        with self.lock:
+            for key, table in TABLES.items():
+                self.connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ({key} INTEGER NOT NULL, intent TEXT NOT NULL, "
+                    f"{columns}, PRIMARY KEY ({key}, intent)) WITHOUT ROWID"
+                )
+            self.connection.commit()
+
+    def record(self, intent: str, confidence: float, fallback: bool, seconds: float, when: Optional[float] = None):
+        """Count one handled intent"""
+        key = (int((time.time() if when is None else when) // HOUR), intent)
+        milliseconds = seconds * 1000
+        latency_bucket = next((i for i, bound in enumerate(LATENCY_BOUNDS_MS) if milliseconds <= bound),
+                              len(LATENCY_BOUNDS_MS))
+        confidence_bucket = min(CONFIDENCE_BUCKETS - 1, max(0, int(confidence * CONFIDENCE_BUCKETS)))
+        with self._pending_lock:
+            row = self.pending.get(key)
+            if row is None:
+                row = self.pending[key] = [0] * len(COLUMNS)
+            row[TURNS] += 1
+            row[FALLBACKS] += bool(fallback)
+            row[CONFIDENCE_SUM] += confidence
+            row[LATENCY_SUM] += milliseconds
+            row[LATENCY_MAX] = max(row[LATENCY_MAX], milliseconds)
+            row[CONFIDENCE_START + confidence_bucket] += 1
+            row[LATENCY_START + latency_bucket] += 1
+
+    def flush(self) -> int:
+        """Write the pending rows now; returns how many hourly rows were written"""
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return 0
+            days: Dict[Tuple[int, str], List[float]] = {}
+            for (hour, intent), row in pending.items():
+                key = (hour * HOUR // DAY, intent)
+                days[key] = _merge(days[key], row) if key in days else list(row)
+            try:
+                with self.lock:
+                    self.connection.executemany(_upsert(TABLES['hour'], 'hour'),
+                                                [(*key, *row) for key, row in pending.items()])
+                    self.connection.executemany(_upsert(TABLES['day'], 'day'),
+                                                [(*key, *row) for key, row in days.items()])
+                    self.connection.commit()
+            except Exception:
+                logging.exception(f"Could not save intent analytics for {len(pending)} hours")
+                with self._pending_lock:
+                    for key, row in pending.items():
+                        self.pending[key] = _merge(self.pending[key], row) if key in self.pending else row
+                return 0
+            return len(pending)
+
+    def _write_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _rows(self, start: float, end: float, intent: Optional[str]):
+        """(intent, summed row) for [start, end), with the ends widened to whole hours"""
+        first_hour, end_hour = int(start // HOUR), math.ceil(end / HOUR)
+        first_day, end_day = math.ceil(first_hour * HOUR / DAY), end_hour * HOUR // DAY
+        if first_day >= end_day:
+            ranges = [('hour', first_hour, end_hour)]
+        else:
+            ranges = [('hour', first_hour, first_day * DAY // HOUR), ('day', first_day, end_day),
+                      ('hour', end_day * DAY // HOUR, end_hour)]
+        selects, parameters = [], []
+        for key, low, high in ranges:
+            if low >= high:
+                continue
+            where = f"{key} >= ? AND {key} < ?" + (" AND intent = ?" if intent else "")
+            selects.append(f"SELECT intent, {', '.join(COLUMNS)} FROM {TABLES[key]} WHERE {where}")
+            parameters += [low, high] + ([intent] if intent else [])
+        if not selects:
+            return []
+        totals = ', '.join(f"MAX({column})" if column == 'latency_max_ms' else f"SUM({column})" for column in COLUMNS)
+        self.flush()
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT intent, {totals} FROM ({' UNION ALL '.join(selects)}) GROUP BY intent", parameters
+            ).fetchall()
+
+    def summary(self, start: float, end: float, intent: Optional[str] = None) -> Dict:
+        """Per-intent usage, fallback rate, confidence and handler latency over [start, end), busiest first"""
+        rows = self._rows(start, end, intent)
+        total_turns = sum(row[1 + TURNS] for row in rows)
+        intents = []
+        for name, *row in sorted(rows, key=lambda r: -r[1 + TURNS]):
+            turns = row[TURNS]
+            latency_counts = row[LATENCY_START:]
+            intents.append({
+                'intent': name,
+                'turns': turns,
+                'share': round(turns / total_turns, 4),
+                'fallbacks': row[FALLBACKS],
+                'fallback_rate': round(row[FALLBACKS] / turns, 4),
+                'confidence': {
+                    'mean': round(row[CONFIDENCE_SUM] / turns, 3),
+                    'histogram': row[CONFIDENCE_START:LATENCY_START],
+                },
+                'latency_ms': {
+                    'mean': round(row[LATENCY_SUM] / turns, 2),
+                    'p50': round(_latency_quantile(latency_counts, 0.5, row[LATENCY_MAX]), 2),
+                    'p95': round(_latency_quantile(latency_counts, 0.95, row[LATENCY_MAX]), 2),
+                    'max': round(row[LATENCY_MAX], 2),
+                    'histogram': latency_counts,
+                },
+            })
+        fallbacks = sum(entry['fallbacks'] for entry in intents)
+        return {
+            'start': iso(start),
+            'end': iso(end),
+            'turns': total_turns,
+            'fallbacks': fallbacks,
+            'fallback_rate': round(fallbacks / total_turns, 4) if total_turns else 0.0,
+            'confidence_buckets': [round(i / CONFIDENCE_BUCKETS, 1) for i in range(CONFIDENCE_BUCKETS + 1)],
+            'latency_bounds_ms': list(LATENCY_BOUNDS_MS),
+            'intents': intents,
+        }
+
+    def series(self, start: float, end: float, by: str = 'hour', intent: Optional[str] = None) -> List[Dict]:
+        """Turns, fallbacks and mean handler latency per hour or day of [start, end), oldest first"""
+        if by not in TABLES:
+            raise ValueError("by must be 'hour' or 'day'")
+        size = HOUR if by == 'hour' else DAY
+        low, high = int(start // size), math.ceil(end / size)
+        if high - low > MAX_SERIES_POINTS:
+            raise ValueError(f"That range has more than {MAX_SERIES_POINTS} {by}s; narrow it or use a longer step")
+        where = f"{by} >= ? AND {by} < ?" + (" AND intent = ?" if intent else "")
+        self.flush()
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {by}, SUM(turns), SUM(fallbacks), SUM(latency_sum_ms) FROM {TABLES[by]} "
+                f"WHERE {where} GROUP BY {by} ORDER BY {by}",
+                [low, high] + ([intent] if intent else [])
+            ).fetchall()
+        return [
+            {'start': iso(bucket * size), 'turns': turns, 'fallbacks': fallbacks,
+             'latency_ms_mean': round(latency / turns, 2)}
+            for bucket, turns, fallbacks, latency in rows
+        ]
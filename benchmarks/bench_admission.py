@@ -0,0 +1,164 @@
+"""Load test /api/text past what its upstream can serve, with and without admission control.
+
+Requests arrive open loop at ``--rate`` a second for ``--seconds``, each on
+its own thread, from ``--clients`` addresses; one of them is a hot client
+sending ``--hot-share`` of the traffic. Half the utterances ask for the
+weather. The stubbed weather service answers in ``--service-ms`` and serves
+``--upstream-capacity`` calls at once; more calls queue at the service,
+just as a real one slows down when overloaded. Other utterances need no
+upstream.
+
+The ``off`` run has no rate limits or admission. The ``on`` run has per-client
+token buckets, a bounded request queue and an upstream gate, so some requests
+are refused quickly with 429 or 503. The numbers to compare are the latency
+percentiles of the requests that were answered, and how many were refused.
+
+    python benchmarks/bench_admission.py --rate 60 --seconds 10 --service-ms 200
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'web_interface'))
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+os.environ.setdefault('LOG_CONSOLE_LEVEL', 'WARNING')
+from bench_suite import fake_get
+
+UPSTREAM_UTTERANCES = ("what's the weather in paris", "weather in tokyo", "how is the weather in lima")
+LOCAL_UTTERANCES = ("what time is it", "what is 17 times 23", "hello", "what's the date")
+
+
+@contextlib.contextmanager
+def limited_service(seconds, capacity):
+    """Offline weather that takes ``seconds`` per call and serves ``capacity`` calls at once"""
+    slots = threading.Semaphore(capacity)
+
+    def get(url, *args, **kwargs):
+        with slots:
+            time.sleep(seconds)
+        return fake_get(url, *args, **kwargs)
+
+    with mock.patch('requests.get', get):
+        yield
+
+
+def percentile(ordered, fraction):
+    return round(ordered[int(fraction * (len(ordered) - 1))] * 1000, 1) if ordered else None
+
+
+def load(app, args, seed):
+    """Send the open-loop load; returns [(kind, status, seconds)]"""
+    rng = random.Random(seed)
+    total = int(args.rate * args.seconds)
+    interval = 1 / args.rate
+    clients = [f'10.0.0.{n + 1}' for n in range(args.clients)]
+    results = []
+    lock = threading.Lock()
+
+    def send(due, address, kind, text):
+        client = app.test_client()
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        response = client.post('/api/text', json={'text': text}, environ_base={'REMOTE_ADDR': address})
+        # Latency counts from when the request was due, so time waiting for a thread counts too
+        with lock:
+            results.append((kind, response.status_code, time.perf_counter() - due))
+
+    start = time.perf_counter() + 0.1
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        for n in range(total):
+            address = clients[0] if rng.random() < args.hot_share else rng.choice(clients[1:] or clients)
+            kind = 'upstream' if rng.random() < 0.5 else 'local'
+            text = rng.choice(UPSTREAM_UTTERANCES if kind == 'upstream' else LOCAL_UTTERANCES)
+            executor.submit(send, start + n * interval, address, kind, text)
+    return results
+
+
+def summarize(results, elapsed):
+    summary = {'elapsed_s': round(elapsed, 2), 'status': {}}
+    for _, status, _ in results:
+        summary['status'][str(status)] = summary['status'].get(str(status), 0) + 1
+    for kind in ('local', 'upstream'):
+        ok = sorted(seconds for k, status, seconds in results if k == kind and status == 200)
+        refused = sorted(seconds for k, status, seconds in results if k == kind and status in (429, 503))
+        summary[kind] = {
+            'answered': len(ok),
+            'p50_ms': percentile(ok, 0.5),
+            'p99_ms': percentile(ok, 0.99),
+            'refused': len(refused),
+            'refusal_p99_ms': percentile(refused, 0.99),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=60, help='requests per second offered')
+    parser.add_argument('--seconds', type=float, default=10, help='how long the load lasts')
+    parser.add_argument('--clients', type=int, default=20, help='distinct client addresses')
+    parser.add_argument('--hot-share', type=float, default=0.2, help="fraction of requests from one hot client")
+    parser.add_argument('--service-ms', type=float, default=200, help='latency of one weather call')
+    parser.add_argument('--upstream-capacity', type=int, default=4, help='weather calls the service serves at once')
+    parser.add_argument('--client-rate', type=float, default=5, help='per-client requests per second when on')
+    parser.add_argument('--client-burst', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=16, help='requests worked on at once when on')
+    parser.add_argument('--queue', type=int, default=64, help='requests that may queue for a slot when on')
+    parser.add_argument('--upstream-limit', type=int, default=4, help='weather calls in flight when on')
+    parser.add_argument('--upstream-queue', type=int, default=8, help='weather calls that may wait when on')
+    parser.add_argument('--deadline', type=float, default=2, help='seconds each request has to finish')
+    parser.add_argument('--threads', type=int, default=256, help='request threads (the web server\'s pool)')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    import app as webapp
+    from admission import AdmissionController, ClientRateLimiter, UpstreamGate
+    assistant = webapp.assistant
+    webapp.REQUEST_DEADLINE = args.deadline
+    modes = {
+        'off': lambda: (None, None, {}),
+        'on': lambda: (
+            ClientRateLimiter(args.client_rate, args.client_burst, metrics=assistant.metrics),
+            AdmissionController('requests', args.concurrency, args.queue, metrics=assistant.metrics),
+            {'openweathermap': UpstreamGate('openweathermap', args.upstream_limit, args.upstream_queue,
+                                            metrics=assistant.metrics)},
+        ),
+    }
+
+    results = {}
+    with limited_service(args.service_ms / 1000, args.upstream_capacity), contextlib.redirect_stdout(io.StringIO()):
+        for mode, build in modes.items():
+            webapp.client_limiter, webapp.request_admission, assistant.upstreams = build()
+            start = time.perf_counter()
+            responses = load(webapp.app, args, args.seed)
+            results[mode] = summarize(responses, time.perf_counter() - start)
+            # Let the stubbed service drain before the next run
+            time.sleep(args.service_ms / 1000)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.rate:.0f} requests/s for {args.seconds:.0f} s, weather serves {args.upstream_capacity} calls "
+          f"at once in {args.service_ms:.0f} ms")
+    for mode, summary in results.items():
+        print(f"admission {mode:>3}: status {summary['status']}, {summary['elapsed_s']} s")
+        for kind in ('local', 'upstream'):
+            part = summary[kind]
+            refusals = f", {part['refused']} refused (p99 {part['refusal_p99_ms']} ms)" if part['refused'] else ''
+            print(f"{kind:>14}: {part['answered']} answered, p50 {part['p50_ms']} ms, p99 {part['p99_ms']} ms"
+                  f"{refusals}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Measure /api/analytics query time against history size: rollup tables versus scanning raw turns.
+
+For each size, that many turns are spread evenly over ``--days`` days and
+stored twice: as raw rows in a turn log (one row per turn, indexed by time,
+the way ``conversations`` stores them) and as ``IntentAnalytics`` rollups.
+Then the same question, per-intent turns, fallbacks, mean confidence and
+latency over the last 30 days and over all history, is answered both ways.
+The cost of recording one turn is reported as well.
+
+    python benchmarks/bench_analytics.py --turns 10000 100000 1000000 --days 365
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+INTENTS = ('weather', 'time', 'news', 'calculate', 'reminder', 'wiki', 'greet', 'smart_home', 'note', 'date')
+RAW_QUERY = (
+    "SELECT intent, COUNT(*), SUM(fallback), AVG(confidence), AVG(latency_ms), MAX(latency_ms) "
+    "FROM turns WHERE timestamp >= ? AND timestamp < ? GROUP BY intent"
+)
+
+
+def generate(count, days, now):
+    rng = random.Random(count)
+    step = days * 86400 / count
+    for i in range(count):
+        intent = rng.choice(INTENTS)
+        fallback = intent == 'greet' and rng.random() < 0.5
+        confidence = 0.1 if fallback else rng.uniform(0.7, 1.0)
+        yield now - days * 86400 + i * step, intent, confidence, fallback, rng.expovariate(1 / 0.05)
+
+
+def build(count, days, now, directory):
+    from analytics import IntentAnalytics
+    connection = sqlite3.connect(os.path.join(directory, f'analytics-{count}.db'), check_same_thread=False)
+    connection.execute("CREATE TABLE turns (timestamp REAL, intent TEXT, confidence REAL, fallback INTEGER, "
+                       "latency_ms REAL)")
+    connection.execute("CREATE INDEX turns_timestamp ON turns (timestamp)")
+    analytics = IntentAnalytics(connection, flush_interval=3600)
+    batch = []
+    for when, intent, confidence, fallback, seconds in generate(count, days, now):
+        batch.append((when, intent, confidence, int(fallback), seconds * 1000))
+        analytics.record(intent, confidence, fallback, seconds, when)
+        if len(batch) == 50000:
+            connection.executemany("INSERT INTO turns VALUES (?, ?, ?, ?, ?)", batch)
+            batch = []
+    connection.executemany("INSERT INTO turns VALUES (?, ?, ?, ?, ?)", batch)
+    connection.commit()
+    analytics.flush()
+    return connection, analytics
+
+
+def timed_median(call, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return round(statistics.median(samples) * 1000, 2)
+
+
+def record_cost(analytics, count=100000):
+    start = time.perf_counter()
+    for i in range(count):
+        analytics.record(INTENTS[i % len(INTENTS)], 0.9, False, 0.01)
+    seconds = time.perf_counter() - start
+    analytics.flush()
+    return round(seconds / count * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, nargs='+', default=[10000, 100000, 1000000], help='history sizes')
+    parser.add_argument('--days', type=int, default=365, help='days the history is spread over')
+    parser.add_argument('--repeats', type=int, default=5, help='runs per query; the median is reported')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    now = time.time()
+    ranges = {'last_30_days': (now - 30 * 86400, now), 'all': (now - args.days * 86400, now)}
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.turns:
+            connection, analytics = build(count, args.days, now, directory)
+            run = {'turns': count}
+            for name, (start, end) in ranges.items():
+                run[f'raw_{name}_ms'] = timed_median(
+                    lambda: connection.execute(RAW_QUERY, (start, end)).fetchall(), args.repeats)
+                run[f'rollup_{name}_ms'] = timed_median(lambda: analytics.summary(start, end), args.repeats)
+            run['record_us'] = record_cost(analytics)
+            connection.close()
+            results.append(run)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"History spread over {args.days} days; median of {args.repeats} queries")
+    for run in results:
+        print(f"{run['turns']:>9} turns: last 30 days raw {run['raw_last_30_days_ms']:>8.2f} ms, "
+              f"rollup {run['rollup_last_30_days_ms']:>6.2f} ms; all history raw {run['raw_all_ms']:>8.2f} ms, "
+              f"rollup {run['rollup_all_ms']:>6.2f} ms; recording a turn {run['record_us']} us")
+
+
+if __name__ == '__main__':
+    main()
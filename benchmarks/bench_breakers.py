@@ -0,0 +1,133 @@
+"""Measure turn latency while an upstream service stalls, with and without circuit breakers.
+
+A local fake server stands in for the weather and news services. It answers
+at once while healthy, after ``--stall-ms`` while stalled (``--fail`` makes it
+answer 503 instead), and at once again when it recovers. Weather and news
+requests are answered through the assistant in each phase, ``--interval-ms``
+apart. Without breakers every turn in the stalled phase waits for the
+service. With them, the breaker opens after a few slow calls and later turns
+get the last good reply. A probe after ``--reset-seconds`` closes it again
+once the service has recovered.
+
+    python benchmarks/bench_breakers.py --stall-ms 1500 --turns 20
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+os.environ.setdefault('LOG_CONSOLE_LEVEL', 'CRITICAL')
+
+UTTERANCES = ("what's the weather in paris", "latest news")
+PAYLOADS = {
+    '/weather': {'cod': 200, 'main': {'temp': 18.5, 'humidity': 60}, 'weather': [{'description': 'light rain'}]},
+    '/news': {'status': 'ok', 'articles': [{'title': f'Headline {i}'} for i in range(5)]},
+    '/geo': {'status': 'success', 'city': 'Paris'},
+}
+# Words that only appear in replies given while a service is down
+FALLBACK_MARKERS = ("isn't responding", "couldn't get")
+
+
+class FakeService(BaseHTTPRequestHandler):
+    """Canned weather, news and location replies, delayed or failed as the server's mode says"""
+
+    def do_GET(self):
+        mode, delay = self.server.mode
+        if mode == 'stalled':
+            time.sleep(delay)
+        path = self.path.split('?')[0]
+        status = 503 if mode == 'failing' or path not in PAYLOADS else 200
+        body = json.dumps(PAYLOADS.get(path, {})).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_phase(assistant, turns, interval):
+    latencies, fallbacks = [], 0
+    for n in range(turns):
+        start = time.perf_counter()
+        record = assistant.answer_request({'text': UTTERANCES[n % len(UTTERANCES)]})
+        latencies.append(time.perf_counter() - start)
+        reply = record.get('reply') or record.get('error', '')
+        fallbacks += any(marker in reply for marker in FALLBACK_MARKERS)
+        time.sleep(interval)
+    return {
+        'median_ms': round(statistics.median(latencies) * 1000, 1),
+        'max_ms': round(max(latencies) * 1000, 1),
+        'total_s': round(sum(latencies), 2),
+        'fallback_replies': fallbacks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, default=20, help='requests per phase')
+    parser.add_argument('--stall-ms', type=float, default=1500, help='how long the stalled service takes to answer')
+    parser.add_argument('--fail', action='store_true', help='stalled service answers 503 at once instead')
+    parser.add_argument('--interval-ms', type=float, default=200, help='pause between requests')
+    parser.add_argument('--slow-call', type=float, default=1.0, help='seconds after which a call counts as failed')
+    parser.add_argument('--reset-seconds', type=float, default=2.0, help='open time before a probe call')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeService)
+    server.mode = ('healthy', 0.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    os.environ.update({
+        'OPENWEATHER_URL': f'{base}/weather', 'NEWS_API_URL': f'{base}/news', 'GEOLOCATION_URL': f'{base}/geo',
+        'OPENWEATHER_API_KEY': 'bench', 'NEWS_API_KEY': 'bench', 'UPSTREAM_QUOTAS': '',
+        'BREAKER_SLOW_CALL': str(args.slow_call), 'BREAKER_RESET_TIMEOUT': str(args.reset_seconds),
+    })
+    from enhanced_voice_assistant import EnhancedVoiceAssistant
+
+    stalled = ('failing', 0.0) if args.fail else ('stalled', args.stall_ms / 1000)
+    phases = (('healthy', ('healthy', 0.0)), ('stalled', stalled), ('recovered', ('healthy', 0.0)))
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for mode in ('off', 'on'):
+            assistant = EnhancedVoiceAssistant()
+            assistant.disable_audio()
+            if mode == 'off':
+                assistant.breakers = {}
+            results[mode] = {}
+            for phase, server_mode in phases:
+                server.mode = server_mode
+                results[mode][phase] = run_phase(assistant, args.turns, args.interval_ms / 1000)
+            results[mode]['breakers'] = {name: breaker.stats() for name, breaker in assistant.breakers.items()
+                                         if breaker.opened}
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    service = '503 at once' if args.fail else f'{args.stall_ms:.0f} ms per call'
+    print(f"{args.turns} weather/news requests per phase; stalled service: {service}")
+    for mode, phases_run in results.items():
+        print(f"breakers {mode}:")
+        for phase, _ in phases:
+            run = phases_run[phase]
+            print(f"  {phase:>9}: median {run['median_ms']:>7.1f} ms, max {run['max_ms']:>7.1f} ms, "
+                  f"total {run['total_s']:>5.2f} s, {run['fallback_replies']} fallback replies")
+        for name, stats in phases_run['breakers'].items():
+            print(f"  {name}: opened {stats['opened']}x, {stats['rejected']} calls skipped, now {stats['state']}")
+
+
+if __name__ == '__main__':
+    main()
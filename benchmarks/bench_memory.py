@@ -0,0 +1,115 @@
+"""Measure the memory held by scheduled reminders and conversation history.
+
+Each structure is built with ``tracemalloc`` running, once in the old layout
+and once in the current one, and the bytes still allocated afterwards are
+reported:
+
+* reminders: a heap list of ``(due, text, uuid4 string)`` tuples versus
+  ``ReminderQueue`` (parallel arrays, integer ids);
+* history: a list of ``"User: ..."`` / ``"Assistant: ..."`` strings versus
+  ``ConversationHistory`` (one UTF-8 buffer, offsets and role codes).
+
+    python benchmarks/bench_memory.py --reminders 1000000 --history 1000000
+"""
+import argparse
+import gc
+import heapq
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+
+def reminder_items(count, start):
+    return ((start + i, f"reminder {i}") for i in range(count))
+
+
+def history_items(count):
+    for i in range(count // 2):
+        yield f"what is {i} times 7"
+        yield f"The result is {i * 7}"
+
+
+def legacy_reminders(count, start):
+    heap = [(due, text, str(uuid.uuid4())) for due, text in reminder_items(count, start)]
+    heapq.heapify(heap)
+    return heap
+
+
+def compact_reminders(count, start):
+    from reminder_queue import ReminderQueue
+    queue = ReminderQueue()
+    queue.extend((due, text, i + 1) for i, (due, text) in enumerate(reminder_items(count, start)))
+    return queue
+
+
+def legacy_history(count):
+    return [f"{'User' if i % 2 == 0 else 'Assistant'}: {text}" for i, text in enumerate(history_items(count))]
+
+
+def compact_history(count):
+    from history import ASSISTANT, USER, ConversationHistory
+    history = ConversationHistory(count)
+    for i, text in enumerate(history_items(count)):
+        history.add(USER if i % 2 == 0 else ASSISTANT, text)
+    return history
+
+
+def measure(build, *args):
+    """Bytes still allocated once ``build(*args)`` returns, while its result is alive"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = build(*args)
+    seconds = time.perf_counter() - start
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return held, seconds
+
+
+def compare(count, legacy, compact, *args):
+    old, old_seconds = measure(legacy, count, *args)
+    new, new_seconds = measure(compact, count, *args)
+    return {
+        'entries': count,
+        'legacy_mb': round(old / 2 ** 20, 1),
+        'compact_mb': round(new / 2 ** 20, 1),
+        'legacy_bytes_per_entry': round(old / count, 1),
+        'compact_bytes_per_entry': round(new / count, 1),
+        'reduction': round(old / new, 2),
+        # Build times run under tracemalloc, so compare them with each other only
+        'legacy_build_s': round(old_seconds, 2),
+        'compact_build_s': round(new_seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reminders', type=int, default=1_000_000)
+    parser.add_argument('--history', type=int, default=1_000_000)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = {
+        'reminders': compare(args.reminders, legacy_reminders, compact_reminders, time.time() + 86400),
+        'history': compare(args.history, legacy_history, compact_history),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, run in results.items():
+        print(f"{name:>9}: {run['entries']} entries, {run['legacy_mb']} MB -> {run['compact_mb']} MB "
+              f"({run['legacy_bytes_per_entry']} -> {run['compact_bytes_per_entry']} bytes each, "
+              f"{run['reduction']}x smaller)")
+
+
+if __name__ == '__main__':
+    main()
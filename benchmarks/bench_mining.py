@@ -0,0 +1,123 @@
+"""Measure offline utterance mining and pattern replay over a large synthetic conversation log.
+
+A JSON-lines log of ``--lines`` labelled utterances is written to a temporary
+file. Most lines repeat a few hundred phrasings; ``--unique`` of them get a
+random word appended, so they are all distinct, as in a real log. Some
+phrasings have no pattern yet ("is it going to rain in paris"), and some hit
+the "what is" overlap between WIKI and CALCULATE. Then the log is mined
+(read, classified, misses clustered), and replayed against the built-in
+patterns and a candidate set that adds the missing weather and alarm patterns.
+
+    python benchmarks/bench_mining.py --lines 2000000 --unique 0.1
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+os.environ.setdefault('LOG_CONSOLE_LEVEL', 'CRITICAL')
+
+# (template, expected intent)
+TEMPLATES = (
+    ("hello", 'greet'), ("what's the time", 'time'), ("what is the date", 'date'),
+    ("play {song} on youtube", 'play'), ("remind me to {task} in {n} minutes", 'reminder'),
+    ("tell me about {topic}", 'wiki'), ("what is {topic}", 'wiki'), ("what is {n} plus {m}", 'calculate'),
+    ("weather in {city}", 'weather'), ("latest news", 'news'), ("turn on the {device}", 'smart_home'),
+    ("take a note {task}", 'note'), ("calculate {n} times {m}", 'calculate'),
+    ("is it going to rain in {city}", 'weather'), ("how hot is it in {city}", 'weather'),
+    ("wake me up at {n} am", 'reminder'), ("set an alarm for {n} am", 'reminder'),
+)
+FILLERS = {
+    'song': ['bohemian rhapsody', 'lofi beats', 'the four seasons'],
+    'task': ['call mom', 'stretch', 'water the plants', 'check the oven'],
+    'topic': ['black holes', 'python programming', 'the roman empire', 'photosynthesis'],
+    'city': ['paris', 'london', 'tokyo', 'nairobi', 'lima'],
+    'device': ['lights', 'fan', 'heater'],
+}
+WORDS = ('please', 'now', 'quickly', 'thanks', 'again', 'today', 'okay')
+
+
+def write_log(path, lines, unique, seed=7):
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(lines):
+            template, label = rng.choice(TEMPLATES)
+            values = {key: rng.choice(options) for key, options in FILLERS.items()}
+            text = template.format(n=rng.randint(1, 12), m=rng.randint(1, 60), **values)
+            if rng.random() < unique:
+                text += f" {rng.choice(WORDS)} {i}"
+            f.write(json.dumps({'text': text, 'label': label}) + "\n")
+
+
+def candidate_patterns():
+    from enhanced_voice_assistant import INTENT_PATTERNS, IntentType
+    return 'candidate', INTENT_PATTERNS + [
+        (re.compile(r'\b(rain|snow|hot|cold|sunny)\b.*\bin (.+)'), IntentType.WEATHER, 0.85),
+        (re.compile(r'\b(wake me up|set an alarm)\b'), IntentType.REMINDER, 0.9),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    parser.add_argument('--unique', type=float, default=0.1, help='fraction of lines made distinct')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    import intent_mining
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'log.jsonl')
+        write_log(path, args.lines, args.unique)
+        timings = {}
+        start = time.perf_counter()
+        corpus = intent_mining.read_corpus([path])
+        timings['read_s'] = time.perf_counter() - start
+
+    _, current = intent_mining.load_patterns('current')
+    start = time.perf_counter()
+    misses = intent_mining.mine(corpus, current)
+    timings['classify_s'] = time.perf_counter() - start
+    start = time.perf_counter()
+    clusters = intent_mining.cluster(misses)
+    timings['cluster_s'] = time.perf_counter() - start
+    runs = []
+    for name, patterns in (('current', current), candidate_patterns()):
+        start = time.perf_counter()
+        runs.append(intent_mining.replay(corpus, name, patterns))
+        timings[f'replay_{name}_s'] = time.perf_counter() - start
+
+    mining_seconds = timings['read_s'] + timings['classify_s'] + timings['cluster_s']
+    results = {
+        'lines': args.lines,
+        'distinct': len(corpus),
+        'misses': len(misses),
+        'clusters': len(clusters),
+        **{name: round(seconds, 2) for name, seconds in timings.items()},
+        'mine_lines_per_second': round(args.lines / mining_seconds),
+        'replays': [{key: run[key] for key in ('name', 'utterances_per_second', 'fallback_rate', 'accuracy')}
+                    for run in runs],
+        'top_clusters': [{key: found[key] for key in ('leader', 'count', 'utterances')} for found in clusters[:5]],
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.lines} lines, {results['distinct']} distinct: read {results['read_s']} s, classified "
+          f"{results['classify_s']} s, clustered {results['misses']} misses into {results['clusters']} in "
+          f"{results['cluster_s']} s ({results['mine_lines_per_second']} lines/s)")
+    for run in results['replays']:
+        print(f"  replay {run['name']:>9}: {run['utterances_per_second']} utterances/s, "
+              f"fallback {run['fallback_rate']:.1%}, accuracy {run['accuracy']:.1%}")
+    for found in results['top_clusters']:
+        print(f"  cluster {found['count']:>8} lines, {found['utterances']:>6} distinct: {found['leader']!r}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""Measure how often the recognition cache saves a speech-service call, and how often it is wrong.
+
+Fixtures are WAV files grouped by what was said: ``<dir>/<label>/*.wav``.
+Without ``--fixtures`` a set is synthesized: each label is a fixed sequence
+of voiced (two-tone) and fricative (noise) syllables, recorded several times
+with different gain, background noise, silence padding and tempo. Clips
+are fed through the cache in a shuffled order; a miss stands for one call
+to the recognizer, whose answer (the label) is stored.
+
+``--minimal-pairs`` checks the threshold against utterances that differ in a
+single sound, the way "turn on the lights" and "turn off the lights" do. Each
+synthetic word gets a twin with one syllable changed (a vowel becomes a shorter
+vowel and a fricative, as "on" becomes "off"). The check reports the closest
+match between clips of different labels and exits with status 1 if any
+threshold gives a false hit. With ``--fixtures`` the same check runs on
+recordings, e.g. ``pairs/turn on the lights/*.wav`` and ``pairs/turn off the lights/*.wav``.
+
+    python benchmarks/bench_recognition_cache.py --labels 12 --takes 8
+    python benchmarks/bench_recognition_cache.py --fixtures recordings/ --threshold 0.85
+    python benchmarks/bench_recognition_cache.py --minimal-pairs --fixtures pairs/
+"""
+import argparse
+import array
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import wave
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+from recognition_cache import RecognitionCache, fingerprint, similarity
+
+SAMPLE_RATE = 16000
+
+
+def make_word(rng):
+    """Syllables of one synthetic word: (kind, f1, f2, seconds)"""
+    syllables = []
+    for _ in range(rng.randint(3, 6)):
+        if rng.random() < 0.3:
+            syllables.append(('noise', 0, 0, rng.uniform(0.06, 0.14)))
+        else:
+            syllables.append(('voiced', rng.uniform(250, 800), rng.uniform(900, 2500), rng.uniform(0.12, 0.3)))
+    return syllables
+
+
+def render(word, rng, gain=1.0, noise=0.0, pad=0.2, tempo=1.0):
+    """16-bit mono PCM of one take of a word"""
+    samples = [rng.gauss(0, noise) for _ in range(int(pad * SAMPLE_RATE))]
+    for kind, f1, f2, seconds in word:
+        count = int(seconds / tempo * SAMPLE_RATE)
+        for n in range(count):
+            # Short attack and release so syllables don't click
+            envelope = min(1.0, n / 160, (count - n) / 160)
+            if kind == 'noise':
+                value = rng.uniform(-0.3, 0.3)
+            else:
+                t = n / SAMPLE_RATE
+                value = 0.5 * math.sin(2 * math.pi * f1 * t) + 0.3 * math.sin(2 * math.pi * f2 * t)
+            samples.append(gain * envelope * value + rng.gauss(0, noise))
+    samples += [rng.gauss(0, noise) for _ in range(int(pad * SAMPLE_RATE * rng.uniform(0.5, 1.5)))]
+    return array.array('h', (max(-32768, min(32767, int(s * 20000))) for s in samples)).tobytes()
+
+
+def minimal_pair(word, rng):
+    """The word with one voiced syllable turned into a shorter vowel and a fricative ("on" -> "off")"""
+    voiced = [i for i, syllable in enumerate(word) if syllable[0] == 'voiced']
+    index = rng.choice(voiced[1:] or voiced)
+    _, f1, f2, seconds = word[index]
+    return word[:index] + [('voiced', f1, f2, seconds * 0.6), ('noise', 0, 0, seconds * 0.4)] + word[index + 1:]
+
+
+def synthesize(directory, labels, takes, seed, pairs=False):
+    rng = random.Random(seed)
+    for index in range(labels):
+        word = make_word(rng)
+        if pairs:
+            while not any(syllable[0] == 'voiced' for syllable in word):
+                word = make_word(rng)
+            words = {f'word_{index:02d}_a': word, f'word_{index:02d}_b': minimal_pair(word, rng)}
+        else:
+            words = {f'word_{index:02d}': word}
+        for label, spoken in words.items():
+            folder = os.path.join(directory, label)
+            os.makedirs(folder, exist_ok=True)
+            for take in range(takes):
+                if take == 0:
+                    pcm = render(spoken, rng)
+                else:
+                    pcm = render(spoken, rng, gain=rng.uniform(0.4, 1.4), noise=rng.uniform(0.0, 0.01),
+                                 pad=rng.uniform(0.05, 0.5), tempo=rng.uniform(0.95, 1.05))
+                with wave.open(os.path.join(folder, f'take_{take}.wav'), 'wb') as wav:
+                    wav.setnchannels(1)
+                    wav.setsampwidth(2)
+                    wav.setframerate(SAMPLE_RATE)
+                    wav.writeframes(pcm)
+
+
+def load_fixtures(directory):
+    clips = []
+    for label in sorted(os.listdir(directory)):
+        folder = os.path.join(directory, label)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.endswith('.wav'):
+                with wave.open(os.path.join(folder, name), 'rb') as wav:
+                    clips.append((label, wav.readframes(wav.getnframes()), wav.getframerate(),
+                                  wav.getsampwidth(), wav.getnchannels()))
+    return clips
+
+
+def closest_other(clips):
+    """Highest similarity between clips of different labels, with the two labels"""
+    prints = [(label, fingerprint(pcm, rate, width, channels)) for label, pcm, rate, width, channels in clips]
+    prints = [(label, print_) for label, print_ in prints if print_ is not None]
+    best = (0.0, None, None)
+    for i, (label, print_) in enumerate(prints):
+        for other_label, other in prints[i + 1:]:
+            if other_label != label:
+                score = similarity(print_, other)
+                if score > best[0]:
+                    best = (score, label, other_label)
+    return {'similarity': round(best[0], 3), 'labels': [best[1], best[2]]}
+
+
+def measure(clips, threshold, capacity, seed):
+    order = list(clips)
+    random.Random(seed).shuffle(order)
+    cache = RecognitionCache(capacity, threshold)
+    calls = false_hits = uncacheable = 0
+    fingerprint_time = lookup_time = 0.0
+    for label, pcm, rate, width, channels in order:
+        start = time.perf_counter()
+        print_ = fingerprint(pcm, rate, width, channels)
+        fingerprint_time += time.perf_counter() - start
+        if print_ is None:
+            uncacheable += 1
+            calls += 1
+            continue
+        start = time.perf_counter()
+        text = cache.lookup(print_)
+        lookup_time += time.perf_counter() - start
+        if text is None:
+            calls += 1
+            cache.store(print_, label)
+        elif text != label:
+            false_hits += 1
+    stats = cache.stats()
+    return {
+        'clips': len(order),
+        'labels': len({clip[0] for clip in order}),
+        'threshold': threshold,
+        'recognizer_calls': calls,
+        'calls_saved': len(order) - calls,
+        'hit_rate': stats['hit_rate'],
+        'false_hits': false_hits,
+        'uncacheable': uncacheable,
+        'fingerprint_ms': round(fingerprint_time / len(order) * 1000, 3),
+        'lookup_ms': round(lookup_time / max(1, len(order) - uncacheable) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fixtures', help='directory of <label>/*.wav clips (synthesized if omitted)')
+    parser.add_argument('--labels', type=int, default=12, help='synthetic words')
+    parser.add_argument('--takes', type=int, default=8, help='synthetic takes per word')
+    parser.add_argument('--threshold', type=float, nargs='+', default=[0.9, 0.95, 0.96])
+    parser.add_argument('--capacity', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--minimal-pairs', action='store_true',
+                        help='check for false hits between utterances that differ in one sound')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    if args.fixtures:
+        clips = load_fixtures(args.fixtures)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            synthesize(directory, args.labels, args.takes, args.seed, args.minimal_pairs)
+            clips = load_fixtures(directory)
+    if not clips:
+        parser.error('no WAV fixtures found')
+
+    results = [measure(clips, threshold, args.capacity, args.seed) for threshold in args.threshold]
+    closest = closest_other(clips) if args.minimal_pairs else None
+    if args.json:
+        print(json.dumps({'results': results, **({'closest_other_label': closest} if closest else {})}, indent=2))
+    else:
+        print(f"{results[0]['clips']} clips of {results[0]['labels']} utterances")
+        for row in results:
+            print(f"threshold {row['threshold']:.2f}: {row['recognizer_calls']:>4} recognizer calls "
+                  f"({row['calls_saved']} saved, hit rate {row['hit_rate']:.0%}), {row['false_hits']} false hits, "
+                  f"fingerprint {row['fingerprint_ms']:.2f} ms, lookup {row['lookup_ms']:.3f} ms")
+        if closest:
+            print(f"closest different utterances: {closest['similarity']} ({' / '.join(closest['labels'])})")
+    if args.minimal_pairs and any(row['false_hits'] for row in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
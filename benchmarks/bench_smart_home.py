@@ -0,0 +1,75 @@
+"""Measure group command latency against the simulated smart home hub.
+
+Every simulated device answers after ``--latency`` seconds. A group command
+fans out concurrently, so it should take about one device latency however
+many devices it covers; the sequential column shows what a loop would cost.
+
+    python benchmarks/bench_smart_home.py --devices 4 16 64 --latency 0.05
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+import smart_home_integration as shi
+
+
+def make_devices(count):
+    return [{'id': f'light_{i}', 'name': f'light {i}', 'type': 'light', 'room': f'room {i % 8}'}
+            for i in range(count)]
+
+
+def measure(count, latency, runs):
+    controller, server = shi.simulated_controller(make_devices(count), latency=latency)
+    devices = list(controller.registry.devices.values())
+    try:
+        controller.set_power(devices, True)  # open connections outside the timed runs
+        group = []
+        for run in range(runs):
+            start = time.perf_counter()
+            result = controller.set_power(devices, run % 2 == 0)
+            group.append(time.perf_counter() - start)
+            if result.failed:
+                raise RuntimeError(f"{len(result.failed)} devices failed: {result.failed[0][1]}")
+        start = time.perf_counter()
+        for device in devices:
+            controller.set_power([device], True)
+        sequential = time.perf_counter() - start
+        start = time.perf_counter()
+        controller.describe_status(devices)
+        status = time.perf_counter() - start
+    finally:
+        controller.shutdown()
+        server.stop()
+    return {
+        'devices': count,
+        'group_ms': round(statistics.median(group) * 1000, 1),
+        'sequential_ms': round(sequential * 1000, 1),
+        'status_ms': round(status * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per device request')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = [measure(count, args.latency, args.runs) for count in args.devices]
+    if args.json:
+        print(json.dumps({'latency_ms': args.latency * 1000, 'results': results}, indent=2))
+        return
+    print(f"Device latency {args.latency * 1000:.0f} ms")
+    for row in results:
+        print(f"{row['devices']:>4} devices: group {row['group_ms']:>7.1f} ms, "
+              f"sequential {row['sequential_ms']:>8.1f} ms, cached status {row['status_ms']:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Measure end-of-speech to reply time with and without speculative fetches.
+
+Each utterance is "spoken" word by word: after every ``--word-ms`` the growing
+transcript is posted to /api/partial, as the browser does with interim
+results. The final transcript goes to /api/text ``--endpoint-ms`` after the
+last word (the recognizer deciding the speaker is done). Weather, news and
+Wikipedia answer after ``--service-ms``. The baseline run sends no partials.
+
+    python benchmarks/bench_speculation.py --service-ms 400 --endpoint-ms 600
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'web_interface'))
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+from bench_suite import fake_get, fake_summary
+
+UTTERANCES = (
+    "what's the weather in paris", "tell me about black holes", "latest news",
+    "weather in tokyo", "what time is it", "who is ada lovelace",
+)
+
+
+@contextlib.contextmanager
+def slow_services(seconds):
+    """Offline weather, news and Wikipedia that each take ``seconds`` to answer"""
+    def get(url, *args, **kwargs):
+        time.sleep(seconds)
+        return fake_get(url, *args, **kwargs)
+
+    def summary(topic, *args, **kwargs):
+        time.sleep(seconds)
+        return fake_summary(topic, *args, **kwargs)
+
+    with mock.patch('requests.get', get), mock.patch('wikipedia.summary', summary):
+        yield
+
+
+def speak(client, text, word_seconds, endpoint_seconds, speculate):
+    """Send one utterance; returns seconds from end of speech to the reply"""
+    words = text.split()
+    utterance_id = str(uuid.uuid4()) if speculate else None
+    for count in range(1, len(words) + 1):
+        time.sleep(word_seconds)
+        if speculate:
+            client.post('/api/partial', json={'text': ' '.join(words[:count]), 'utterance_id': utterance_id})
+    end_of_speech = time.perf_counter()
+    time.sleep(endpoint_seconds)
+    payload = {'text': text, 'utterance_id': utterance_id} if speculate else {'text': text}
+    response = client.post('/api/text', json=payload)
+    if response.status_code != 200:
+        raise RuntimeError(f"/api/text failed for {text!r}: {response.get_json()}")
+    return time.perf_counter() - end_of_speech
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--word-ms', type=float, default=250)
+    parser.add_argument('--endpoint-ms', type=float, default=600, help='final transcript delay after speech')
+    parser.add_argument('--service-ms', type=float, default=400, help='latency of weather/news/Wikipedia')
+    parser.add_argument('--rounds', type=int, default=2)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    import app as webapp
+    import enhanced_voice_assistant
+    enhanced_voice_assistant.NEWS_API_KEY = 'bench'
+    client = webapp.app.test_client()
+    assistant = webapp.assistant
+
+    results = {}
+    with slow_services(args.service_ms / 1000), contextlib.redirect_stdout(io.StringIO()):
+        for mode in ('serial', 'speculative'):
+            before = dict(assistant.metrics.snapshot()['counters'])
+            per_utterance = {text: [] for text in UTTERANCES}
+            for _ in range(args.rounds):
+                for text in UTTERANCES:
+                    per_utterance[text].append(speak(client, text, args.word_ms / 1000, args.endpoint_ms / 1000,
+                                                     mode == 'speculative'))
+            counters = assistant.metrics.snapshot()['counters']
+            results[mode] = {
+                'median_ms': round(statistics.median(t for times in per_utterance.values() for t in times) * 1000),
+                'utterances': {text: round(statistics.median(times) * 1000) for text, times in per_utterance.items()},
+                **{name: counters.get(f'speculation_{name}', 0) - before.get(f'speculation_{name}', 0)
+                   for name in ('started', 'committed', 'discarded')},
+            }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"End of speech to reply, service {args.service_ms:.0f} ms, final transcript after {args.endpoint_ms:.0f} ms")
+    for text in UTTERANCES:
+        print(f"{text:>30}: serial {results['serial']['utterances'][text]:>5} ms, "
+              f"speculative {results['speculative']['utterances'][text]:>5} ms")
+    spec = results['speculative']
+    print(f"{'median':>30}: serial {results['serial']['median_ms']:>5} ms, speculative {spec['median_ms']:>5} ms "
+          f"({spec['started']} started, {spec['committed']} committed, {spec['discarded']} discarded)")
+
+
+if __name__ == '__main__':
+    main()
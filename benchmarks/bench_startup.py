@@ -0,0 +1,103 @@
+"""Measure cold-start time of the assistant and the web app.
+
+Each measurement runs in a fresh interpreter so nothing is already imported.
+Reports the time to import, construct the assistant and answer the first text
+intent, plus per-subsystem readiness right after that first answer.
+
+    python benchmarks/bench_startup.py
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CLI_PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, ROOT)
+import enhanced_voice_assistant as eva
+imported = time.perf_counter()
+assistant = eva.EnhancedVoiceAssistant()
+constructed = time.perf_counter()
+intent = assistant.process_natural_language("what is 12 times 4")
+answered = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "construct_ms": (constructed - imported) * 1000,
+    "first_intent_ms": (answered - constructed) * 1000,
+    "total_ms": (answered - start) * 1000,
+    "intent": intent.type.value,
+    "readiness": assistant.readiness(),
+}))
+'''
+
+WEB_PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, ROOT)
+sys.path.insert(0, ROOT + "/web_interface")
+import app as webapp
+imported = time.perf_counter()
+client = webapp.app.test_client()
+response = client.post("/api/text", json={"text": "what is the date"})
+answered = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_text_ms": (answered - imported) * 1000,
+    "total_ms": (answered - start) * 1000,
+    "status_code": response.status_code,
+    "readiness": webapp.assistant.readiness(),
+}))
+'''
+
+
+def run_probe(probe, workdir):
+    env = dict(os.environ, DATABASE_PATH=os.path.join(workdir, 'bench.db'))
+    code = f"ROOT = {ROOT!r}\n" + probe
+    output = subprocess.run([sys.executable, '-c', code], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(runs, keys):
+    return {key: round(statistics.median(run[key] for run in runs), 2) for key in keys}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cli_runs = [run_probe(CLI_PROBE, workdir) for _ in range(args.runs)]
+        web_runs = []
+        try:
+            web_runs = [run_probe(WEB_PROBE, workdir) for _ in range(args.runs)]
+        except subprocess.CalledProcessError as e:
+            print(f"Skipping web app startup: {e.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+
+    results = {'cli': summarize(cli_runs, ['import_ms', 'construct_ms', 'first_intent_ms', 'total_ms']),
+               'cli_readiness': cli_runs[-1]['readiness']}
+    if web_runs:
+        results['web'] = summarize(web_runs, ['import_ms', 'first_text_ms', 'total_ms'])
+        results['web_readiness'] = web_runs[-1]['readiness']
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name in ('cli', 'web'):
+        if name in results:
+            timings = ', '.join(f"{k} {v:.1f}" for k, v in results[name].items())
+            print(f"{name:>4}: {timings} (median of {args.runs})")
+            states = ', '.join(f"{k}={v['state']}" for k, v in results[f'{name}_readiness'].items())
+            print(f"      subsystems after first answer: {states}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""Offline benchmark suite for the assistant's hot paths.
+
+Needs no microphone, speaker or network. Every benchmark runs against a
+temporary database, HTTP services are replaced with canned responses and the
+TTS engine with a no-op stub. Results are printed (or written) as JSON and can
+be compared against a stored baseline:
+
+    python benchmarks/bench_suite.py                        # run everything, compare with baseline.json
+    python benchmarks/bench_suite.py --only nlp api_text    # run a subset
+    python benchmarks/bench_suite.py --save-baseline        # record this machine's numbers
+    python benchmarks/bench_suite.py --output results.json --tolerance 0.2
+
+Exits with status 1 when a throughput drops more than ``--tolerance`` below the baseline.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# One test client sends every request, far beyond one user's rate and the upstream quotas
+os.environ.setdefault('RATE_LIMIT_PER_CLIENT', '0')
+os.environ.setdefault('UPSTREAM_QUOTAS', '')
+
+DEFAULT_REMINDER_SIZES = (10_000, 100_000, 1_000_000)
+DEFAULT_TOLERANCE = 0.3
+DEFAULT_REPEAT = 3
+
+# Utterance templates for the synthetic NLP corpus; {x} slots are filled from FILLERS
+UTTERANCE_TEMPLATES = (
+    "hello", "good morning", "what's the time", "what is the date", "help",
+    "open {app}", "play {song} on youtube", "send an email",
+    "remind me to {task} in {n} minutes", "remind me to {task} every weekday at 8 am",
+    "search for {topic}", "tell me about {topic}", "who is {person}",
+    "weather in {city}", "what's the weather", "latest news", "turn on the {device}",
+    "take a note {task}", "calculate {n} times {m}", "what is {n} plus {m}",
+    "how do you say hello in french", "goodbye", "mumble something unclear {n}",
+)
+FILLERS = {
+    'app': ['notepad', 'calculator', 'youtube', 'chrome'],
+    'song': ['bohemian rhapsody', 'lofi beats', 'the four seasons'],
+    'task': ['call mom', 'stretch', 'water the plants', 'check the oven'],
+    'topic': ['black holes', 'python programming', 'the roman empire'],
+    'person': ['ada lovelace', 'alan turing', 'grace hopper'],
+    'city': ['paris', 'london', 'tokyo', 'nairobi'],
+    'device': ['lights', 'fan', 'heater'],
+}
+
+# Requests sent through /api/text; external services they reach are stubbed
+API_TEXT_REQUESTS = (
+    "what time is it", "what is the date", "what is 12 times 7",
+    "remind me to stretch in 10 minutes", "tell me about black holes",
+    "weather in paris", "hello", "help",
+)
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark function under ``name``"""
+    def decorator(function):
+        BENCHMARKS[name] = function
+        return function
+    return decorator
+
+
+def throughput(operations, seconds):
+    return {'operations': operations, 'seconds': round(seconds, 6),
+            'ops_per_second': round(operations / seconds, 2) if seconds else None}
+
+
+def synthetic_corpus(size, seed=1234):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        template = rng.choice(UTTERANCE_TEMPLATES)
+        values = {key: rng.choice(options) for key, options in FILLERS.items()}
+        corpus.append(template.format(n=rng.randint(1, 60), m=rng.randint(1, 60), **values))
+    return corpus
+
+
+class StubResponse:
+    """Canned reply for requests.get"""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.status_code = 200
+
+    def json(self):
+        return self.payload
+
+
+WEATHER_PAYLOAD = {'cod': 200, 'main': {'temp': 18.5, 'humidity': 60}, 'weather': [{'description': 'light rain'}]}
+NEWS_PAYLOAD = {'status': 'ok', 'articles': [{'title': f'Headline {i}'} for i in range(5)]}
+LOCATION_PAYLOAD = {'status': 'success', 'city': 'Paris'}
+
+
+def fake_get(url, *args, **kwargs):
+    if 'openweathermap' in url:
+        return StubResponse(WEATHER_PAYLOAD)
+    if 'newsapi' in url:
+        return StubResponse(NEWS_PAYLOAD)
+    return StubResponse(LOCATION_PAYLOAD)
+
+
+def fake_summary(topic, *args, **kwargs):
+    return f"{topic.capitalize()} is a subject with a short canned summary."
+
+
+class StubEngine:
+    """pyttsx3-compatible engine that does no audio work"""
+
+    def __init__(self):
+        self.properties = {}
+        self.spoken = 0
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+    def getProperty(self, name):
+        return self.properties.get(name)
+
+    def say(self, text):
+        self.spoken += 1
+
+    def runAndWait(self):
+        pass
+
+
+@contextlib.contextmanager
+def offline_services():
+    """Replace network calls made by the assistant and the web app"""
+    with mock.patch('requests.get', fake_get), mock.patch('wikipedia.summary', fake_summary), \
+            mock.patch('webbrowser.open', lambda *args, **kwargs: True):
+        yield
+
+
+def new_assistant():
+    import enhanced_voice_assistant
+    return enhanced_voice_assistant.EnhancedVoiceAssistant()
+
+
+@benchmark('nlp')
+def bench_nlp(args):
+    """process_natural_language over a synthetic utterance corpus"""
+    assistant = new_assistant()
+    corpus = synthetic_corpus(args.corpus_size)
+    for text in corpus[:100]:
+        assistant.process_natural_language(text)
+    start = time.perf_counter()
+    for text in corpus:
+        assistant.process_natural_language(text)
+    return throughput(len(corpus), time.perf_counter() - start)
+
+
+@benchmark('api_text')
+def bench_api_text(args):
+    """/api/text end to end through the Flask test client"""
+    sys.path.insert(0, os.path.join(ROOT, 'web_interface'))
+    import app as webapp
+    client = webapp.app.test_client()
+    requests_sent = [API_TEXT_REQUESTS[i % len(API_TEXT_REQUESTS)] for i in range(args.api_requests)]
+    with offline_services(), contextlib.redirect_stdout(io.StringIO()):
+        for text in API_TEXT_REQUESTS:
+            client.post('/api/text', json={'text': text})
+        start = time.perf_counter()
+        for text in requests_sent:
+            response = client.post('/api/text', json={'text': text})
+            if response.status_code != 200:
+                raise RuntimeError(f"/api/text failed for {text!r}: {response.get_json()}")
+        elapsed = time.perf_counter() - start
+    return throughput(len(requests_sent), elapsed)
+
+
+@benchmark('reminders')
+def bench_reminders(args):
+    """Bulk scheduling at several queue sizes, plus one-at-a-time scheduling"""
+    assistant = new_assistant()
+    far_future = time.time() + 365 * 86400
+    results = {}
+    for size in args.reminder_sizes:
+        items = [(far_future + i, f"reminder {i}", None) for i in range(size)]
+        with assistant.reminder_lock:
+            assistant.reminders.clear()
+        start = time.perf_counter()
+        assistant.schedule_reminders(items)
+        results[f'bulk_{size}'] = throughput(size, time.perf_counter() - start)
+        del items
+
+    single = min(args.reminder_sizes)
+    with assistant.reminder_lock:
+        assistant.reminders.clear()
+    start = time.perf_counter()
+    for i in range(single):
+        assistant.schedule_reminder(far_future + i, f"reminder {i}")
+    results[f'single_{single}'] = throughput(single, time.perf_counter() - start)
+    with assistant.reminder_lock:
+        assistant.reminders.clear()
+    return results
+
+
+@benchmark('history_writes')
+def bench_history_writes(args):
+    """Conversation rows written to SQLite via save_note"""
+    assistant = new_assistant()
+    assistant.db_connection  # open the database outside the timed region
+    start = time.perf_counter()
+    for i in range(args.history_writes):
+        assistant.save_note(f"benchmark note {i}")
+    return throughput(args.history_writes, time.perf_counter() - start)
+
+
+@benchmark('tts')
+def bench_tts(args):
+    """speak() once the TTS engine is initialized (the cached-engine path)"""
+    assistant = new_assistant()
+    engine = StubEngine()
+    assistant.subsystems['tts'].set(engine)
+    phrases = ["Okay.", "The current time is 10:30 AM",
+               "According to Wikipedia: " + "a longer answer that switches the speech rate " * 3]
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for i in range(args.tts_calls):
+            assistant.speak(phrases[i % len(phrases)])
+        elapsed = time.perf_counter() - start
+    assert engine.spoken == args.tts_calls
+    return throughput(args.tts_calls, elapsed)
+
+
+def best_of(runs):
+    """Merge repeated runs of one benchmark, keeping the fastest result for each case"""
+    first = runs[0]
+    if 'ops_per_second' in first:
+        return max(runs, key=lambda run: run['ops_per_second'] or 0)
+    return {case: best_of([run[case] for run in runs]) for case in first}
+
+
+def flatten(results, prefix=''):
+    """Map 'bench.case' paths to their ops_per_second"""
+    rates = {}
+    for name, value in results.items():
+        path = f"{prefix}{name}"
+        if isinstance(value, dict) and 'ops_per_second' in value:
+            rates[path] = value['ops_per_second']
+        elif isinstance(value, dict):
+            rates.update(flatten(value, path + '.'))
+    return rates
+
+
+def compare(results, baseline, tolerance):
+    """Return (path, baseline, current, change) for every throughput below tolerance"""
+    current = flatten(results)
+    regressions = []
+    for path, expected in flatten(baseline).items():
+        actual = current.get(path)
+        if not actual or not expected:
+            continue
+        change = actual / expected - 1
+        if change < -tolerance:
+            regressions.append((path, expected, actual, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='benchmarks to run')
+    parser.add_argument('--corpus-size', type=int, default=20_000)
+    parser.add_argument('--api-requests', type=int, default=2_000)
+    parser.add_argument('--reminder-sizes', type=lambda v: [int(n) for n in v.split(',')],
+                        default=list(DEFAULT_REMINDER_SIZES), help='comma-separated queue sizes')
+    parser.add_argument('--history-writes', type=int, default=2_000)
+    parser.add_argument('--tts-calls', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='run each benchmark this many times and keep the best')
+    parser.add_argument('--output', help='write results JSON here instead of stdout')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='overwrite the baseline with these results')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed fractional throughput drop before failing')
+    args = parser.parse_args()
+    args.baseline = os.path.abspath(args.baseline)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    workdir = tempfile.mkdtemp(prefix='assistant-bench-')
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'bench.db')
+    os.chdir(workdir)  # keep assistant.log out of the repository
+    sys.path.insert(0, ROOT)
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        print(f"Running {name}...", file=sys.stderr)
+        results[name] = best_of([BENCHMARKS[name](args) for _ in range(max(1, args.repeat))])
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'repeat': args.repeat,
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+    status = 0
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        report['regressions'] = [
+            {'benchmark': path, 'baseline': expected, 'current': actual, 'change': round(change, 3)}
+            for path, expected, actual, change in regressions
+        ]
+        for path, expected, actual, change in regressions:
+            print(f"REGRESSION {path}: {actual:,.0f}/s vs baseline {expected:,.0f}/s ({change:+.0%})",
+                  file=sys.stderr)
+        status = 1 if regressions else 0
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
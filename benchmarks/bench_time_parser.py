@@ -0,0 +1,67 @@
+"""Check the time expression corpus and measure parser throughput.
+
+Run from the repository root:
+
+    python benchmarks/bench_time_parser.py
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+from time_parser import parse_time_expression
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'time_parser_corpus.json')
+
+
+def load_corpus(path=CORPUS_PATH):
+    with open(path) as f:
+        data = json.load(f)
+    return datetime.datetime.fromisoformat(data['now']), data['cases']
+
+
+def check_corpus(now, cases):
+    """Return a list of (text, expected, actual) for every case that disagrees"""
+    failures = []
+    for case in cases:
+        result = parse_time_expression(case['text'], now, default_unit=case.get('default_unit'))
+        actual = None if result is None else result.due.isoformat()
+        remainder = None if result is None else result.remainder
+        if actual != case['due'] or (case['due'] and remainder != case.get('remainder', '')):
+            failures.append((case['text'], (case['due'], case.get('remainder')), (actual, remainder)))
+    return failures
+
+
+def measure(now, cases, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for case in cases:
+            parse_time_expression(case['text'], now, default_unit=case.get('default_unit'))
+    elapsed = time.perf_counter() - start
+    parses = iterations * len(cases)
+    return {'parses': parses, 'seconds': elapsed, 'parses_per_second': parses / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    now, cases = load_corpus()
+    failures = check_corpus(now, cases)
+    for text, expected, actual in failures:
+        print(f"FAIL {text!r}: expected {expected}, got {actual}")
+    print(f"Corpus: {len(cases) - len(failures)}/{len(cases)} expressions parsed as expected")
+
+    stats = measure(now, cases, args.iterations)
+    print(f"Throughput: {stats['parses_per_second']:,.0f} parses/s "
+          f"({stats['seconds'] * 1e6 / stats['parses']:.1f} µs per expression)")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
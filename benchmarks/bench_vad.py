@@ -0,0 +1,189 @@
+"""Compare end-of-speech to result latency with and without the voice activity detector.
+
+Each fixture is played through a fake microphone stream twice: once into
+speech_recognition's ``Recognizer.listen`` the way ``listen()`` used to call
+it (0.5 s ambient calibration, ``pause_threshold = 1``), and once into
+``vad.capture``. For both it reports how long after the speech ended capture
+stopped, how much audio and FLAC data would be uploaded, and an estimated
+end-of-speech to result time: capture delay + upload at ``--uplink-kbps`` +
+``--service-ms`` + ``--service-rtf`` seconds per second of audio. Clips that
+capture cut off before the speech ended are counted as clipped instead.
+
+Without ``--fixtures`` phrases of one to three synthetic words (see
+bench_recognition_cache.py) are generated at 48 kHz with background noise,
+leading silence and pauses between words. With ``--fixtures DIR`` every WAV
+in DIR is used; its speech end is found offline with ``vad.voiced_range``.
+
+    python benchmarks/bench_vad.py --clips 20
+"""
+import argparse
+import array
+import audioop
+import json
+import os
+import random
+import statistics
+import sys
+import wave
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+import speech_recognition as sr
+import vad
+from bench_recognition_cache import SAMPLE_RATE as WORD_RATE, make_word, render
+
+MIC_RATE = 48000
+
+
+class ClipStream:
+    def __init__(self, pcm, sample_width):
+        self.pcm = pcm
+        self.sample_width = sample_width
+        self.position = 0
+
+    def read(self, frames):
+        chunk = self.pcm[self.position:self.position + frames * self.sample_width]
+        self.position += len(chunk)
+        return chunk
+
+
+class ClipSource(sr.AudioSource):
+    """A WAV clip standing in for the microphone"""
+    CHUNK = 1024
+
+    def __init__(self, pcm, sample_rate, sample_width):
+        self.SAMPLE_RATE = sample_rate
+        self.SAMPLE_WIDTH = sample_width
+        self.stream = ClipStream(pcm, sample_width)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    @property
+    def seconds_read(self):
+        return self.stream.position / (self.SAMPLE_RATE * self.SAMPLE_WIDTH)
+
+
+def silence(seconds):
+    return b'\0\0' * int(seconds * WORD_RATE)
+
+
+def synthesize(count, seed):
+    """(name, pcm, sample_rate, sample_width, speech_end_seconds) for synthetic phrases"""
+    rng = random.Random(seed)
+    clips = []
+    for index in range(count):
+        pcm = silence(rng.uniform(0.6, 1.5))
+        for word in range(rng.randint(1, 3)):
+            if word:
+                pcm += silence(rng.uniform(0.08, 0.3))
+            pcm += render(make_word(rng), rng, gain=rng.uniform(0.5, 1.2), pad=0)
+        speech_end = len(pcm) / (2 * WORD_RATE)
+        pcm += silence(2.0)
+        level = rng.uniform(0.002, 0.01) * 20000
+        noise = array.array('h', (int(rng.gauss(0, level)) for _ in range(len(pcm) // 2))).tobytes()
+        pcm, _ = audioop.ratecv(audioop.add(pcm, noise, 2), 2, 1, WORD_RATE, MIC_RATE, None)
+        clips.append((f'phrase_{index:02d}', pcm, MIC_RATE, 2, speech_end))
+    return clips
+
+
+def load_fixtures(directory):
+    clips = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.wav'):
+            continue
+        with wave.open(os.path.join(directory, name), 'rb') as wav:
+            rate, width, channels = wav.getframerate(), wav.getsampwidth(), wav.getnchannels()
+            pcm = wav.readframes(wav.getnframes())
+        if channels == 2:
+            pcm = audioop.tomono(pcm, width, 0.5, 0.5)
+        frame_bytes = int(rate * vad.FRAME_SECONDS) * width
+        span = vad.voiced_range([audioop.rms(pcm[i:i + frame_bytes], width)
+                                 for i in range(0, len(pcm) - frame_bytes + 1, frame_bytes)])
+        if span:
+            clips.append((name, pcm, rate, width, span[1] * vad.FRAME_SECONDS))
+    return clips
+
+
+def baseline(pcm, rate, width):
+    source = ClipSource(pcm, rate, width)
+    recognizer = sr.Recognizer()
+    recognizer.pause_threshold = 1
+    recognizer.adjust_for_ambient_noise(source, duration=0.5)
+    audio = recognizer.listen(source, timeout=5, phrase_time_limit=10)
+    return source.seconds_read, audio
+
+
+def detector(pcm, rate, width):
+    source = ClipSource(pcm, rate, width)
+    utterance = vad.capture(vad.VoiceActivityDetector(rate, width), lambda: source.stream.read(source.CHUNK),
+                            source.CHUNK / rate, timeout=5)
+    if utterance is None:
+        return source.seconds_read, None
+    return source.seconds_read, sr.AudioData(*vad.prepare_upload(utterance.pcm, rate, width))
+
+
+def measure(clips, capture, uplink_kbps, service_ms, service_rtf):
+    delays, seconds, sizes, totals = [], [], [], []
+    clipped = missed = 0
+    for name, pcm, rate, width, speech_end in clips:
+        stopped, audio = capture(pcm, rate, width)
+        if audio is None:
+            missed += 1
+            continue
+        if stopped < speech_end:
+            # Cut off mid-phrase: the transcript would be wrong, so its latency doesn't count
+            clipped += 1
+            continue
+        flac = len(audio.get_flac_data())
+        audio_seconds = len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+        delay = stopped - speech_end
+        delays.append(delay)
+        seconds.append(audio_seconds)
+        sizes.append(flac)
+        totals.append(delay + flac * 8 / (uplink_kbps * 1000) + service_ms / 1000 + audio_seconds * service_rtf)
+    median = lambda values: statistics.median(values) if values else 0.0
+    return {
+        'capture_delay_ms': round(median(delays) * 1000),
+        'audio_seconds': round(median(seconds), 2),
+        'flac_kb': round(median(sizes) / 1024, 1),
+        'end_to_result_ms': round(median(totals) * 1000),
+        'clipped': clipped,
+        'missed': missed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fixtures', help='directory of WAV clips (synthesized if omitted)')
+    parser.add_argument('--clips', type=int, default=20, help='synthetic phrases')
+    parser.add_argument('--uplink-kbps', type=float, default=1000)
+    parser.add_argument('--service-ms', type=float, default=300, help='fixed recognition service time')
+    parser.add_argument('--service-rtf', type=float, default=0.1, help='service seconds per second of audio')
+    parser.add_argument('--seed', type=int, default=11)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    clips = load_fixtures(args.fixtures) if args.fixtures else synthesize(args.clips, args.seed)
+    if not clips:
+        parser.error('no WAV fixtures found')
+    results = {
+        name: measure(clips, capture, args.uplink_kbps, args.service_ms, args.service_rtf)
+        for name, capture in (('recognizer_listen', baseline), ('vad', detector))
+    }
+    if args.json:
+        print(json.dumps({'clips': len(clips), 'results': results}, indent=2))
+        return
+    print(f"{len(clips)} clips, uplink {args.uplink_kbps:.0f} kbps, service {args.service_ms:.0f} ms "
+          f"+ {args.service_rtf} s per audio second (medians)")
+    for name, row in results.items():
+        print(f"{name:>17}: capture ends {row['capture_delay_ms']:>5} ms after speech, "
+              f"{row['audio_seconds']:.2f} s / {row['flac_kb']:.1f} KB uploaded, "
+              f"end-to-result {row['end_to_result_ms']:>5} ms, {row['clipped']} clipped, {row['missed']} missed")
+
+
+if __name__ == '__main__':
+    main()
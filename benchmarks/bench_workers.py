@@ -0,0 +1,153 @@
+"""Measure how batch replay scales with worker processes, and what it does to other requests.
+
+``--utterances`` requests are answered as /api/batch answers them: in the
+front end's process, then on pools of ``--processes`` workers (started and
+warmed before timing). While each replay runs, a probe thread standing in
+for a Flask request thread classifies an utterance every ``--probe-ms`` and
+records how long it took.
+
+The corpus only uses requests answered without network or database writes
+(greetings, time, help, arithmetic, unconfigured smart home), so the numbers
+measure CPU work and its transfer between processes. Near-linear scaling
+needs as many free cores as workers; ``cpus`` in the output is what this
+machine has.
+
+    python benchmarks/bench_workers.py --processes 1 2 4 --utterances 4000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+# Set before the assistant is imported so the worker processes see the same settings
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+os.environ.setdefault('LOG_CONSOLE_LEVEL', 'WARNING')
+
+TEMPLATES = (
+    "hello", "good evening", "what's the time", "what is the date", "help", "what can you do",
+    "what is {n} times {m}", "calculate {n} plus {m} squared", "what's {n} percent of {m}",
+    "how much is {n} divided by {m}", "turn on the {device}", "is the {device} on",
+    "mumble something unclear {n}", "what's the time and what is {n} minus {m}",
+)
+DEVICES = ('lights', 'fan', 'heater', 'kitchen lamp')
+
+
+def corpus(size, seed):
+    rng = random.Random(seed)
+    return [rng.choice(TEMPLATES).format(n=rng.randint(1, 999), m=rng.randint(1, 99), device=rng.choice(DEVICES))
+            for _ in range(size)]
+
+
+def rate(count, seconds):
+    return round(count / seconds, 1) if seconds else None
+
+
+def replay(answer, utterances):
+    """Requests per second for answer(list of requests) -> list of records"""
+    messages = [{'text': text} for text in utterances]
+    start = time.perf_counter()
+    records = answer(messages)
+    elapsed = time.perf_counter() - start
+    failed = [record for record in records if 'error' in record]
+    if failed:
+        raise RuntimeError(f"{len(failed)} requests failed, e.g. {failed[0]}")
+    return rate(len(records), elapsed)
+
+
+@contextlib.contextmanager
+def probe(parse, utterances, interval):
+    """Call parse(text) every ``interval`` seconds on another thread; yields the list of latencies.
+
+    Latency runs from when the call was due, so time spent waiting for the GIL counts.
+    """
+    latencies = []
+    done = threading.Event()
+
+    def run():
+        index = 0
+        due = time.perf_counter() + interval
+        while not done.wait(max(0.0, due - time.perf_counter())):
+            parse(utterances[index % len(utterances)])
+            latencies.append(time.perf_counter() - due)
+            index += 1
+            due += interval
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        yield latencies
+    finally:
+        done.set()
+        thread.join()
+
+
+def measure(answer, parse, utterances, interval):
+    with probe(parse, utterances, interval) as latencies:
+        per_second = replay(answer, utterances)
+    ordered = sorted(latencies) or [0.0]
+    return {
+        'replay_per_second': per_second,
+        'probe_median_ms': round(statistics.median(ordered) * 1000, 3),
+        'probe_p95_ms': round(ordered[int(0.95 * (len(ordered) - 1))] * 1000, 3),
+    }
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, nargs='+',
+                        default=sorted({1, 2, 4, cpus}), help='worker pool sizes to try')
+    parser.add_argument('--utterances', type=int, default=4000, help='requests per replay')
+    parser.add_argument('--probe-ms', type=float, default=5, help='interval between probe classifications')
+    parser.add_argument('--seed', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    from enhanced_voice_assistant import EnhancedVoiceAssistant
+    from workers import WorkerPool
+
+    utterances = corpus(args.utterances, args.seed)
+    assistant = EnhancedVoiceAssistant()
+    assistant.disable_audio()
+    results = {'cpus': cpus, 'runs': []}
+    with contextlib.redirect_stdout(io.StringIO()):
+        in_process = lambda messages: [assistant.answer_request(message) for message in messages]
+        replay(in_process, utterances[:200])
+        results['runs'].append({'processes': 0, **measure(in_process, assistant.parse_intents, utterances,
+                                                          args.probe_ms / 1000)})
+        for processes in args.processes:
+            pool = WorkerPool(processes)
+            try:
+                pool.wait_ready()
+                answer = lambda messages: pool.replay(messages, assistant.schedule_reminders)
+                replay(answer, utterances[:200 * processes])
+                results['runs'].append({'processes': processes, **measure(answer, assistant.parse_intents, utterances,
+                                                                          args.probe_ms / 1000)})
+            finally:
+                pool.close()
+
+    base = results['runs'][0]
+    for run in results['runs']:
+        run['speedup'] = round(run['replay_per_second'] / base['replay_per_second'], 2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.utterances} replayed requests, {cpus} CPUs")
+    for run in results['runs']:
+        label = 'in process' if not run['processes'] else f"{run['processes']} workers"
+        print(f"{label:>11}: {run['replay_per_second']:>8.0f} requests/s ({run['speedup']:.2f}x), "
+              f"front-end classification meanwhile {run['probe_median_ms']:.2f} ms median, "
+              f"{run['probe_p95_ms']:.2f} ms p95")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""Safe evaluator for spoken arithmetic used by the CALCULATE intent.
+
+Spoken math such as "twenty percent of eighty" or "5 squared" is tokenized into
+a plain arithmetic expression, parsed once with ``ast`` and evaluated by walking
+the tree with an allow-listed set of operators. Parsed expressions are kept in an
+LRU cache so repeated questions skip the parse entirely.
+"""
+import ast
+import math
+import operator
+import re
+from functools import lru_cache
+
+# Limits that keep a single request from pinning a CPU
+MAX_EXPRESSION_LENGTH = 200
+MAX_EXPONENT = 1000
+MAX_RESULT_BITS = 4096
+
+UNITS = {
+    'zero': 0, 'oh': 0, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11,
+    'twelve': 12, 'thirteen': 13, 'fourteen': 14, 'fifteen': 15, 'sixteen': 16,
+    'seventeen': 17, 'eighteen': 18, 'nineteen': 19,
+}
+TENS = {
+    'twenty': 20, 'thirty': 30, 'forty': 40, 'fifty': 50,
+    'sixty': 60, 'seventy': 70, 'eighty': 80, 'ninety': 90,
+}
+SCALES = {'thousand': 10 ** 3, 'million': 10 ** 6, 'billion': 10 ** 9}
+NUMBER_WORDS = set(UNITS) | set(TENS) | set(SCALES) | {'hundred', 'point', 'and'}
+
+# Spoken operators, longest phrases first so "divided by" wins over "by"
+OPERATOR_PHRASES = {
+    'to the power of': ' ** ',
+    'raised to the power of': ' ** ',
+    'raised to': ' ** ',
+    'power of': ' ** ',
+    'power': ' ** ',
+    'squared': ' ** 2 ',
+    'cubed': ' ** 3 ',
+    'square root of': ' sqrt ',
+    'square root': ' sqrt ',
+    'percent of': ' / 100 * ',
+    'percent': ' / 100 ',
+    'divided by': ' / ',
+    'multiplied by': ' * ',
+    'times': ' * ',
+    'into': ' * ',
+    'x': ' * ',
+    'over': ' / ',
+    'plus': ' + ',
+    'add': ' + ',
+    'minus': ' - ',
+    'negative': ' - ',
+    'subtract': ' - ',
+    'modulo': ' % ',
+    'mod': ' % ',
+    'open bracket': ' ( ',
+    'close bracket': ' ) ',
+}
+_PHRASE_RE = re.compile(
+    r'\b(' + '|'.join(re.escape(p) for p in sorted(OPERATOR_PHRASES, key=len, reverse=True)) + r')\b'
+)
+_FILLER_RE = re.compile(
+    r"^\s*(?:please\s+)?(?:calculate|compute|what is|what's|whats|how much is|tell me)?\s*(?:the\s+)?|[?!,]|\bequals?\b"
+)
+_TOKEN_RE = re.compile(r'\d+(?:\.\d+)?|\*\*|[-+*/%()^]|[a-z]+|\S')
+
+_BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+_UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+_FUNCTIONS = {
+    'sqrt': math.sqrt,
+}
+
+
+class CalculationError(ValueError):
+    """Raised when spoken text is not a supported or safe arithmetic expression"""
+
+
+def _words_to_number(words):
+    """Convert a run of number words ("one hundred and five point two") to a number"""
+    total = 0
+    current = 0
+    decimals = None
+    for word in words:
+        if decimals is not None:
+            if word not in UNITS or UNITS[word] > 9:
+                raise CalculationError(f"Unexpected word after 'point': {word}")
+            decimals += str(UNITS[word])
+        elif word == 'point':
+            decimals = ''
+        elif word == 'and':
+            continue
+        elif word in UNITS:
+            current += UNITS[word]
+        elif word in TENS:
+            current += TENS[word]
+        elif word == 'hundred':
+            current = (current or 1) * 100
+        elif word in SCALES:
+            total += (current or 1) * SCALES[word]
+            current = 0
+    value = total + current
+    if decimals:
+        return float(f"{value}.{decimals}")
+    return value
+
+
+def tokenize(text: str) -> str:
+    """Translate spoken math into a plain arithmetic expression string"""
+    text = text.lower().strip()
+    if len(text) > MAX_EXPRESSION_LENGTH:
+        raise CalculationError("Expression is too long")
+
+    text = _FILLER_RE.sub(' ', text)
+    text = _PHRASE_RE.sub(lambda m: OPERATOR_PHRASES[m.group(1)], text)
+
+    output = []
+    number_words = []
+    pending_sqrt = False
+
+    def flush_number():
+        nonlocal pending_sqrt
+        if number_words:
+            # A trailing "and" belongs to the sentence, not the number
+            while number_words and number_words[-1] == 'and':
+                number_words.pop()
+            output.append(str(_words_to_number(number_words)))
+            number_words.clear()
+            if pending_sqrt:
+                output.append(')')
+                pending_sqrt = False
+
+    tokens = _TOKEN_RE.findall(text)
+    for index, token in enumerate(tokens):
+        if token in NUMBER_WORDS and (token != 'and' or number_words):
+            number_words.append(token)
+            continue
+        flush_number()
+
+        if token[0].isdigit():
+            output.append(token)
+            if pending_sqrt:
+                output.append(')')
+                pending_sqrt = False
+        elif token == '^':
+            output.append('**')
+        elif token in ('+', '-', '*', '/', '%', '**', '(', ')'):
+            output.append(token)
+        elif token == 'sqrt':
+            if index + 1 < len(tokens) and tokens[index + 1] == '(':
+                output.append('sqrt')
+            else:
+                output.append('sqrt(')
+                pending_sqrt = True
+        elif token in ('of', 'by', 'a', 'the'):
+            continue
+        else:
+            raise CalculationError(f"Unsupported word in expression: {token}")
+    flush_number()
+
+    if pending_sqrt:
+        raise CalculationError("Square root is missing its operand")
+    expression = ' '.join(output)
+    if not expression:
+        raise CalculationError("Empty expression")
+    return expression
+
+
+def _check_node(node):
+    """Reject any syntax outside the allow-listed arithmetic subset"""
+    for child in ast.walk(node):
+        if isinstance(child, (ast.Expression, ast.Load)):
+            continue
+        if isinstance(child, ast.BinOp) and type(child.op) in _BIN_OPS:
+            continue
+        if isinstance(child, ast.UnaryOp) and type(child.op) in _UNARY_OPS:
+            continue
+        if isinstance(child, tuple(_BIN_OPS) + tuple(_UNARY_OPS)):
+            continue
+        if isinstance(child, ast.Constant) and isinstance(child.value, (int, float)):
+            continue
+        if (isinstance(child, ast.Call) and isinstance(child.func, ast.Name)
+                and child.func.id in _FUNCTIONS and len(child.args) == 1 and not child.keywords):
+            continue
+        if isinstance(child, ast.Name) and child.id in _FUNCTIONS:
+            continue
+        raise CalculationError(f"Unsupported syntax: {type(child).__name__}")
+
+
+@lru_cache(maxsize=512)
+def parse_expression(text: str) -> ast.Expression:
+    """Tokenize and parse spoken math once; repeated questions hit the cache"""
+    expression = tokenize(text)
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError:
+        raise CalculationError(f"Malformed expression: {expression}")
+    _check_node(tree)
+    return tree
+
+
+def _safe_pow(base, exponent):
+    if abs(exponent) > MAX_EXPONENT:
+        raise CalculationError("Exponent is too large")
+    if abs(base) > 1 and exponent > 0 and exponent * math.log2(abs(base)) > MAX_RESULT_BITS:
+        raise CalculationError("Result is too large")
+    try:
+        return operator.pow(base, exponent)
+    except ZeroDivisionError:
+        raise CalculationError("Division by zero")
+    except OverflowError:
+        raise CalculationError("Result is too large")
+
+
+def _finite(value):
+    """Float arithmetic overflows to inf (and inf - inf to nan) instead of raising"""
+    if isinstance(value, (float, complex)) and not math.isfinite(abs(value)):
+        raise CalculationError("Result is too large")
+    return value
+
+
+def _evaluate(node):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body)
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.UnaryOp):
+        return _UNARY_OPS[type(node.op)](_evaluate(node.operand))
+    if isinstance(node, ast.BinOp):
+        left = _evaluate(node.left)
+        right = _evaluate(node.right)
+        if isinstance(node.op, ast.Pow):
+            return _finite(_safe_pow(left, right))
+        try:
+            return _finite(_BIN_OPS[type(node.op)](left, right))
+        except ZeroDivisionError:
+            raise CalculationError("Division by zero")
+        except OverflowError:
+            raise CalculationError("Result is too large")
+    if isinstance(node, ast.Call):
+        argument = _evaluate(node.args[0])
+        try:
+            return _FUNCTIONS[node.func.id](argument)
+        except ValueError:
+            raise CalculationError(f"Invalid argument for {node.func.id}")
+    raise CalculationError(f"Unsupported syntax: {type(node).__name__}")
+
+
+def evaluate(text: str):
+    """Evaluate a spoken arithmetic expression, raising CalculationError if it can't"""
+    result = _evaluate(parse_expression(text.lower().strip()))
+    if isinstance(result, complex):
+        raise CalculationError("Result is not a real number")
+    return result
+
+
+def is_expression(text: str) -> bool:
+    """Whether the text parses as spoken arithmetic"""
+    try:
+        parse_expression(text.lower().strip())
+        return True
+    except CalculationError:
+        return False
+
+
+def format_result(value) -> str:
+    """Render a result the way it should be spoken"""
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return str(round(value, 6))
+    return str(value)
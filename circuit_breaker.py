@@ -0,0 +1,203 @@
+"""Circuit breakers and fallback replies for upstream services.
+
+When weather, news, Wikipedia, IP geolocation or speech recognition is down
+or stalling, every call to it waits out its full timeout. A ``CircuitBreaker``
+watches the calls to one service. After ``failure_threshold`` failures in a
+row it opens. A call that raises one of the ``failures`` exceptions counts
+as a failure, and so does a call slower than ``slow_call`` seconds. While the
+breaker is open, calls fail at once with ``CircuitOpen``. After
+``reset_timeout`` seconds it lets a single probe call through (half open).
+If the probe succeeds the breaker closes; if it fails the breaker opens again.
+
+Handlers answer a ``CircuitOpen`` (or a failed call) from a ``StaleCache`` of
+the last good replies when there is one, and with a short spoken apology
+otherwise.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterator, Optional, Tuple
+
+from admission import Overloaded
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Weight of the newest sample in the moving average of call latency
+LATENCY_WEIGHT = 0.2
+
+
+class CircuitOpen(Exception):
+    """The service has been failing; it is not called again for ``retry_after`` seconds"""
+
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"{service} is not responding")
+        self.service = service
+        self.retry_after = retry_after
+
+
+def check_upstream_status(response):
+    """Raise requests.HTTPError for replies that mean the service failed (5xx, 429), not the request"""
+    if response.status_code >= 500 or response.status_code == 429:
+        response.raise_for_status()
+
+
+def describe_age(seconds: float) -> str:
+    """'a minute', '12 minutes', '3 hours' for a spoken note about stale data"""
+    minutes = max(1, round(seconds / 60))
+    if minutes < 60:
+        return "a minute" if minutes == 1 else f"{minutes} minutes"
+    hours = round(minutes / 60)
+    return "an hour" if hours == 1 else f"{hours} hours"
+
+
+class CircuitBreaker:
+    """Closed, open or half open for one upstream service"""
+
+    def __init__(self, name: str, failure_threshold: int = 3, slow_call: float = 3.0,
+                 reset_timeout: float = 30.0, failures: Tuple = (OSError,), metrics=None):
+        self.name = name
+        self.counter = f"breaker_{name.replace('-', '_')}"
+        self.failure_threshold = failure_threshold
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.failures = failures
+        self.metrics = metrics
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.latency = None
+        self.opened = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _count(self, name: str):
+        if self.metrics:
+            self.metrics.increment(f'{self.counter}_{name}')
+
+    def _reject(self, retry_after: float):
+        self.rejected += 1
+        self._count('rejected')
+        raise CircuitOpen(self.name, retry_after)
+
+    def check(self):
+        """Raise CircuitOpen if a call now would be refused (changes nothing)"""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self._reject(remaining)
+            elif self.state == HALF_OPEN and self._probing:
+                self._reject(self.slow_call)
+
+    def timeout(self, seconds: float) -> float:
+        """Timeout for the next call: ``seconds``, or the slow-call limit once calls have started failing.
+
+        A call slower than that counts as failed anyway, so there is no point waiting longer.
+        """
+        with self._lock:
+            return min(seconds, self.slow_call) if self.consecutive_failures or self.state != CLOSED else seconds
+
+    def _allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self._reject(remaining)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self._reject(self.slow_call)
+                self._probing = True
+
+    def _record(self, seconds: float, failed: bool):
+        with self._lock:
+            self.latency = seconds if self.latency is None else self.latency + LATENCY_WEIGHT * (seconds - self.latency)
+            self._probing = False
+            if failed or seconds > self.slow_call:
+                self.consecutive_failures += 1
+                if self.state == HALF_OPEN or (self.state == CLOSED and
+                                               self.consecutive_failures >= self.failure_threshold):
+                    self.state = OPEN
+                    self.opened_at = time.monotonic()
+                    self.opened += 1
+                    self._count('opened')
+                    logging.warning(f"Circuit for {self.name} opened after {self.consecutive_failures} "
+                                    f"failed or slow calls")
+            else:
+                self.consecutive_failures = 0
+                if self.state != CLOSED:
+                    self.state = CLOSED
+                    logging.info(f"Circuit for {self.name} closed")
+
+    def _release(self):
+        # The call never reached the service (refused by admission control): no verdict on its health
+        with self._lock:
+            self._probing = False
+
+    @contextmanager
+    def guard(self, failures: Optional[Tuple] = None) -> Iterator[None]:
+        """Time one call to the service; raises CircuitOpen instead of calling while open.
+
+        Exceptions of ``failures`` (default: the breaker's) count against the
+        service. Any other exception means it answered, e.g. "page not found".
+        """
+        self._allow()
+        start = time.monotonic()
+        try:
+            yield
+        except Overloaded:
+            self._release()
+            raise
+        except failures or self.failures:
+            self._record(time.monotonic() - start, True)
+            raise
+        except BaseException:
+            self._record(time.monotonic() - start, False)
+            raise
+        self._record(time.monotonic() - start, False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            retry_in = self.opened_at + self.reset_timeout - time.monotonic() if self.state == OPEN else 0.0
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'latency_ms': None if self.latency is None else round(self.latency * 1000, 1),
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'retry_in': round(max(0.0, retry_in), 1),
+            }
+
+
+class StaleCache:
+    """The last good reply per key, kept up to ``max_age`` seconds to answer with while a service is down"""
+
+    def __init__(self, max_entries: int = 256, max_age: float = 6 * 3600):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.entries: 'OrderedDict[Hashable, Tuple[float, object]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key: Hashable, value):
+        with self._lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, key: Hashable, max_age: float = math.inf) -> Optional[Tuple[object, float]]:
+        """(value, age in seconds), or None if there is none younger than ``max_age`` and the cache's limit"""
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        age = time.time() - entry[0]
+        if age > min(max_age, self.max_age):
+            return None
+        return entry[1], age
@@ -0,0 +1,328 @@
+"""Email contacts backed by the ``contacts`` table, with fuzzy name matching.
+
+Contacts are read from SQLite once into an in-memory index. Each contact is
+reachable through three kinds of keys: its exact normalized name, Soundex and
+Metaphone codes of each name word, and character trigrams of the full name.
+A lookup ranks names by how many trigrams and phonetic codes they share with
+what was heard, and only the top few are scored by edit distance. A misheard
+"arathya" still finds "aradhya", and lookups stay fast with tens of thousands
+of contacts.
+"""
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# A name must score at least this to be used without asking, and beat the runner-up by MATCH_MARGIN
+MATCH_THRESHOLD = 0.8
+MATCH_MARGIN = 0.05
+# Weaker matches are offered back as "did you mean ...?"
+SUGGEST_THRESHOLD = 0.55
+
+# Score bonus when the spoken words sound like the contact's name words
+PHONETIC_BONUS = 0.1
+# Most a single spoken word can score against a longer name ("aradhya" for "aradhya sharma"), so a
+# contact whose whole name is that word wins by more than MATCH_MARGIN
+PARTIAL_MATCH_CAP = 0.9
+
+# Candidates kept per lookup for edit-distance scoring; a shared phonetic key
+# counts as this many shared trigrams when ranking them
+MAX_CANDIDATES = 64
+PHONETIC_VOTES = 3
+
+_EMAIL_RE = re.compile(r'^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$')
+_NAME_RE = re.compile(r"[a-z0-9']+")
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'), **dict.fromkeys('cgjkqsxz', '2'), **dict.fromkeys('dt', '3'),
+    'l': '4', **dict.fromkeys('mn', '5'), 'r': '6',
+}
+_VOWELS = set('aeiou')
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase words of a name, ignoring punctuation and extra spaces"""
+    return ' '.join(_NAME_RE.findall(name.lower()))
+
+
+def soundex(word: str) -> str:
+    """American Soundex code, e.g. "robert" -> "R163" """
+    letters = [c for c in word.lower() if c.isalpha()]
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    previous = _SOUNDEX_CODES.get(letters[0], '')
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if letter not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+def metaphone(word: str) -> str:
+    """Original Metaphone code of a word, e.g. "knight" -> "NT", "philip" -> "FLP" """
+    word = ''.join(c for c in word.lower() if c.isalpha())
+    if not word:
+        return ''
+    if word[:2] in ('kn', 'gn', 'pn', 'ae', 'wr'):
+        word = word[1:]
+    elif word[0] == 'x':
+        word = 's' + word[1:]
+    elif word[:2] == 'wh':
+        word = 'w' + word[2:]
+
+    code = []
+    length = len(word)
+    for i, c in enumerate(word):
+        prev = word[i - 1] if i else ''
+        nxt = word[i + 1] if i + 1 < length else ''
+        after = word[i + 2] if i + 2 < length else ''
+        if c == prev and c != 'c':
+            continue
+        if c in _VOWELS:
+            if i == 0:
+                code.append(c.upper())
+        elif c == 'b':
+            if not (prev == 'm' and i == length - 1):
+                code.append('B')
+        elif c == 'c':
+            if nxt == 'i' and after == 'a' or nxt == 'h':
+                code.append('K' if prev == 's' else 'X')
+            elif nxt in 'iey' and nxt:
+                if prev != 's':
+                    code.append('S')
+            else:
+                code.append('K')
+        elif c == 'd':
+            code.append('J' if nxt == 'g' and after in 'eiy' and after else 'T')
+        elif c == 'g':
+            if nxt == 'h' and after and after not in _VOWELS:
+                continue
+            if nxt == 'n' and (i + 2 == length or word[i + 2:] == 'ed'):
+                continue
+            if prev == 'd' and nxt in 'eiy' and nxt:
+                continue
+            code.append('J' if nxt in 'eiy' and nxt and prev != 'g' else 'K')
+        elif c == 'h':
+            if prev in 'csptg' and prev:
+                continue
+            if prev in _VOWELS and nxt not in _VOWELS:
+                continue
+            code.append('H')
+        elif c == 'k':
+            if prev != 'c':
+                code.append('K')
+        elif c == 'p':
+            code.append('F' if nxt == 'h' else 'P')
+        elif c == 'q':
+            code.append('K')
+        elif c == 's':
+            if nxt == 'h' or (nxt == 'i' and after in ('o', 'a')):
+                code.append('X')
+            else:
+                code.append('S')
+        elif c == 't':
+            if nxt == 'i' and after in ('o', 'a'):
+                code.append('X')
+            elif nxt == 'h':
+                code.append('0')
+            elif not (nxt == 'c' and after == 'h'):
+                code.append('T')
+        elif c == 'v':
+            code.append('F')
+        elif c in 'wy':
+            if nxt in _VOWELS and nxt:
+                code.append(c.upper())
+        elif c == 'x':
+            code.append('KS')
+        elif c == 'z':
+            code.append('S')
+        else:
+            code.append(c.upper())
+    return ''.join(code)
+
+
+def phonetic_keys(name: str) -> set:
+    """Soundex and Metaphone codes of every word in a normalized name"""
+    keys = set()
+    for word in name.split():
+        keys.add('S' + soundex(word))
+        keys.add('M' + metaphone(word))
+    keys.discard('S')
+    keys.discard('M')
+    return keys
+
+
+def trigrams(name: str) -> List[str]:
+    padded = f"${name}$"
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance between two strings"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def similarity(a: str, b: str) -> float:
+    if not a or not b:
+        return 0.0
+    return 1.0 - edit_distance(a, b) / max(len(a), len(b))
+
+
+@dataclass
+class Contact:
+    id: int
+    name: str
+    email: str
+
+    def to_dict(self) -> Dict:
+        return {'id': self.id, 'name': self.name, 'email': self.email}
+
+
+def validate_contact(name: str, email: str):
+    """Raise ValueError unless the name and email form a usable contact"""
+    if not normalize_name(name or ''):
+        raise ValueError('Contact name must contain at least one word')
+    if not _EMAIL_RE.match(email or ''):
+        raise ValueError(f"Invalid email address: {email!r}")
+
+
+class ContactIndex:
+    """Exact, phonetic and trigram lookups over a fixed set of contacts"""
+
+    def __init__(self, contacts: Iterable[Contact] = ()):
+        self.contacts: Dict[int, Contact] = {}
+        self.by_name: Dict[str, Contact] = {}
+        self.keys: Dict[int, set] = {}
+        self.by_phonetic = defaultdict(set)
+        self.by_trigram = defaultdict(set)
+        for contact in contacts:
+            self.add(contact)
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def add(self, contact: Contact):
+        self.contacts[contact.id] = contact
+        self.by_name[contact.name] = contact
+        keys = phonetic_keys(contact.name)
+        self.keys[contact.id] = keys
+        for key in keys:
+            self.by_phonetic[key].add(contact.id)
+        for gram in set(trigrams(contact.name)):
+            self.by_trigram[gram].add(contact.id)
+
+    def _candidates(self, query: str, query_keys: set) -> List[int]:
+        votes = Counter()
+        for gram in set(trigrams(query)):
+            votes.update(self.by_trigram.get(gram, ()))
+        for key in query_keys:
+            for _ in range(PHONETIC_VOTES):
+                votes.update(self.by_phonetic.get(key, ()))
+        return [contact_id for contact_id, _ in votes.most_common(MAX_CANDIDATES)]
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[Contact, float]]:
+        """Contacts ranked by how well their name matches ``query`` (best first)"""
+        query = normalize_name(query)
+        if not query:
+            return []
+        exact = self.by_name.get(query)
+        query_keys = phonetic_keys(query)
+        query_words = query.split()
+        scored = []
+        for contact_id in self._candidates(query, query_keys):
+            contact = self.contacts[contact_id]
+            if contact is exact:
+                continue
+            words = contact.name.split()
+            bonus = PHONETIC_BONUS if query_keys and query_keys & self.keys[contact_id] else 0.0
+            score = min(similarity(query, contact.name) + bonus, 0.99)
+            if len(query_words) == 1 and len(words) > 1:
+                # A single spoken word may be just the first or last name
+                partial = max(similarity(query, word) for word in words) - MATCH_MARGIN + bonus
+                score = max(score, min(partial, PARTIAL_MATCH_CAP))
+            scored.append((contact, round(score, 3)))
+        scored.sort(key=lambda item: (-item[1], item[0].name))
+        if exact:
+            scored.insert(0, (exact, 1.0))
+        return scored[:limit]
+
+
+class ContactStore:
+    """Contact index written through to SQLite"""
+
+    def __init__(self, connection: sqlite3.Connection, lock: Optional[threading.Lock] = None):
+        self.connection = connection
+        self.lock = lock or threading.Lock()
+        self.index = ContactIndex()
+        self.load()
+
+    def load(self):
+        """Read every contact and swap in a freshly built index"""
+        with self.lock:
+            rows = self.connection.execute("SELECT id, name, email FROM contacts ORDER BY id").fetchall()
+        self.index = ContactIndex(Contact(*row) for row in rows)
+
+    def __len__(self):
+        return len(self.index)
+
+    def list(self, limit: Optional[int] = None) -> List[Contact]:
+        contacts = list(self.index.contacts.values())
+        return contacts[:limit] if limit else contacts
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[Contact, float]]:
+        return self.index.search(query, limit)
+
+    def resolve(self, query: str) -> Tuple[Optional[Contact], List[Tuple[Contact, float]]]:
+        """Best contact if the match is confident, plus the ranked candidates either way"""
+        ranked = self.search(query)
+        if not ranked:
+            return None, []
+        exact = self.index.by_name.get(normalize_name(query))
+        if exact:
+            return exact, ranked
+        best, score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if score >= MATCH_THRESHOLD and score - runner_up >= MATCH_MARGIN:
+            return best, ranked
+        return None, ranked
+
+    def import_contacts(self, entries: Iterable[Tuple[str, str]], user_id: Optional[str] = None):
+        """Insert or update (name, email) pairs in one transaction.
+
+        Returns (imported, errors) where errors lists (position, message) for
+        entries that were skipped.
+        """
+        rows = []
+        errors = []
+        for position, (name, email) in enumerate(entries):
+            try:
+                validate_contact(name, email)
+            except ValueError as e:
+                errors.append((position, str(e)))
+                continue
+            rows.append((user_id, normalize_name(name), email.strip()))
+        if rows:
+            with self.lock:
+                self.connection.executemany(
+                    "INSERT INTO contacts (user_id, name, email) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET email = excluded.email",
+                    rows
+                )
+                self.connection.commit()
+            self.load()
+        return len(rows), errors
@@ -0,0 +1,227 @@
+"""User-defined voice commands backed by the ``custom_commands`` table.
+
+Commands are loaded from SQLite once into a word-level trie. Matching walks the
+trie from the first word of the utterance, so its cost depends on the longest
+trigger, not on how many commands exist. A trigger must be the whole utterance,
+or start it with at most ``MAX_TRIGGER_TAIL`` words after it ("news please"), so
+a "news" command does not take over "remind me to read the news in 5 minutes".
+Edits update the trie in place instead of reloading the table.
+"""
+import json
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import Collection, Dict, List, Optional
+
+# Supported actions and the parameter each one requires
+ACTIONS = {
+    'speak': 'text',
+    'open_url': 'url',
+    'macro': 'steps',
+}
+
+# Macros may run other custom commands, but never deeper than this
+MAX_MACRO_DEPTH = 3
+# Words an utterance may add after a trigger and still run it
+MAX_TRIGGER_TAIL = 2
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+def normalize_phrase(text: str) -> List[str]:
+    """Lowercase words of a trigger or utterance, ignoring punctuation"""
+    return _WORD_RE.findall(text.lower())
+
+
+@dataclass
+class CustomCommand:
+    id: int
+    trigger: str
+    action: str
+    parameters: Dict = field(default_factory=dict)
+
+    def to_dict(self) -> Dict:
+        return {'id': self.id, 'trigger': self.trigger, 'action': self.action, 'parameters': self.parameters}
+
+
+def validate_command(trigger: str, action: str, parameters: Dict, intents: Collection[str] = ()):
+    """Raise ValueError unless the trigger/action/parameters form a runnable command.
+
+    ``intents`` are the intent names a macro's intent steps may use; empty skips that check.
+    """
+    if not normalize_phrase(trigger or ''):
+        raise ValueError('Trigger phrase must contain at least one word')
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action '{action}'. Choose one of: {', '.join(ACTIONS)}")
+    if not isinstance(parameters, dict):
+        raise ValueError('Parameters must be an object')
+    required = ACTIONS[action]
+    if not parameters.get(required):
+        raise ValueError(f"Action '{action}' needs a '{required}' parameter")
+    if action == 'macro':
+        steps = parameters['steps']
+        if not isinstance(steps, list) or not all(isinstance(step, (str, dict)) for step in steps):
+            raise ValueError("Macro 'steps' must be a list of utterances or intent objects")
+        for index, step in enumerate(steps):
+            if isinstance(step, dict) and intents and step.get('intent') not in intents:
+                raise ValueError(f"Macro step {index + 1} has an unknown intent {step.get('intent')!r}. "
+                                 f"Choose one of: {', '.join(sorted(intents))}")
+
+
+class _TrieNode:
+    __slots__ = ('children', 'command')
+
+    def __init__(self):
+        self.children = {}
+        self.command = None
+
+
+class CommandTrie:
+    """Word-level trie mapping trigger phrases to commands"""
+
+    def __init__(self):
+        self.root = _TrieNode()
+        self.size = 0
+
+    def insert(self, words: List[str], command: CustomCommand):
+        node = self.root
+        for word in words:
+            node = node.children.setdefault(word, _TrieNode())
+        if node.command is None:
+            self.size += 1
+        node.command = command
+
+    def remove(self, words: List[str]):
+        # Walk down remembering the path so empty branches can be pruned
+        path = [(None, self.root)]
+        node = self.root
+        for word in words:
+            node = node.children.get(word)
+            if node is None:
+                return
+            path.append((word, node))
+        if node.command is None:
+            return
+        node.command = None
+        self.size -= 1
+        for index in range(len(path) - 1, 0, -1):
+            word, current = path[index]
+            if current.children or current.command is not None:
+                break
+            del path[index - 1][1].children[word]
+
+    def get(self, words: List[str]) -> Optional[CustomCommand]:
+        """Command whose trigger is exactly these words"""
+        node = self.root
+        for word in words:
+            node = node.children.get(word)
+            if node is None:
+                return None
+        return node.command
+
+    def prefix_match(self, words: List[str], max_tail: int = MAX_TRIGGER_TAIL) -> Optional[CustomCommand]:
+        """Longest trigger that starts the utterance and leaves at most ``max_tail`` words after it"""
+        best = None
+        node = self.root
+        for length, word in enumerate(words, 1):
+            node = node.children.get(word)
+            if node is None:
+                break
+            if node.command is not None and len(words) - length <= max_tail:
+                best = node.command
+        return best
+
+
+class CustomCommandStore:
+    """In-memory index of custom commands, written through to SQLite"""
+
+    def __init__(self, connection: sqlite3.Connection, lock: Optional[threading.Lock] = None,
+                 intents: Collection[str] = ()):
+        self.connection = connection
+        self.lock = lock or threading.Lock()
+        # Intent names macro steps may run, checked on create and update
+        self.intents = frozenset(intents)
+        self.commands: Dict[int, CustomCommand] = {}
+        self.trie = CommandTrie()
+        self.load()
+
+    def load(self):
+        """Read every command from the table and rebuild the index"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, command, action, parameters FROM custom_commands ORDER BY id"
+            ).fetchall()
+        self.commands = {}
+        self.trie = CommandTrie()
+        for command_id, trigger, action, parameters in rows:
+            try:
+                command = CustomCommand(command_id, trigger, action, json.loads(parameters or '{}'))
+            except ValueError:
+                continue
+            self.commands[command_id] = command
+            self.trie.insert(normalize_phrase(trigger), command)
+
+    def match(self, text: str) -> Optional[CustomCommand]:
+        if not self.trie.size:
+            return None
+        return self.trie.prefix_match(normalize_phrase(text))
+
+    def get(self, command_id: int) -> Optional[CustomCommand]:
+        return self.commands.get(command_id)
+
+    def list(self) -> List[CustomCommand]:
+        return list(self.commands.values())
+
+    def _check_trigger_free(self, trigger: str, command_id: Optional[int] = None):
+        owner = self.trie.get(normalize_phrase(trigger))
+        if owner is not None and owner.id != command_id:
+            raise ValueError(f"A command with the trigger '{trigger}' already exists")
+
+    def create(self, user_id: Optional[str], trigger: str, action: str, parameters: Dict) -> CustomCommand:
+        validate_command(trigger, action, parameters, self.intents)
+        trigger = ' '.join(normalize_phrase(trigger))
+        self._check_trigger_free(trigger)
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO custom_commands (user_id, command, action, parameters) VALUES (?, ?, ?, ?)",
+                (user_id, trigger, action, json.dumps(parameters))
+            )
+            self.connection.commit()
+        command = CustomCommand(cursor.lastrowid, trigger, action, parameters)
+        self.commands[command.id] = command
+        self.trie.insert(normalize_phrase(trigger), command)
+        return command
+
+    def update(self, command_id: int, trigger: Optional[str] = None, action: Optional[str] = None,
+               parameters: Optional[Dict] = None) -> Optional[CustomCommand]:
+        existing = self.commands.get(command_id)
+        if existing is None:
+            return None
+        trigger = ' '.join(normalize_phrase(trigger)) if trigger is not None else existing.trigger
+        action = action if action is not None else existing.action
+        parameters = parameters if parameters is not None else existing.parameters
+        validate_command(trigger, action, parameters, self.intents)
+        self._check_trigger_free(trigger, command_id)
+
+        with self.lock:
+            self.connection.execute(
+                "UPDATE custom_commands SET command = ?, action = ?, parameters = ? WHERE id = ?",
+                (trigger, action, json.dumps(parameters), command_id)
+            )
+            self.connection.commit()
+        command = CustomCommand(command_id, trigger, action, parameters)
+        self.trie.remove(normalize_phrase(existing.trigger))
+        self.trie.insert(normalize_phrase(trigger), command)
+        self.commands[command_id] = command
+        return command
+
+    def delete(self, command_id: int) -> bool:
+        existing = self.commands.pop(command_id, None)
+        if existing is None:
+            return False
+        with self.lock:
+            self.connection.execute("DELETE FROM custom_commands WHERE id = ?", (command_id,))
+            self.connection.commit()
+        self.trie.remove(normalize_phrase(existing.trigger))
+        return True
@@ -0,0 +1,171 @@
+"""Multi-turn slot filling that never blocks on the user.
+
+A handler that needs more information (who to email, when to remind) starts a
+dialog and replies with the first question. The user's answer then arrives as
+an ordinary turn: the CLI loop and ``/api/text`` offer each utterance to
+``DialogManager.handle`` first, which fills the pending slot and either asks
+the next question or completes the form. State is kept per session id and
+expires if the user walks away.
+"""
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+# Pending dialogs are dropped after this many seconds without an answer
+DIALOG_TIMEOUT = 120.0
+# Unusable answers to one question before the dialog gives up
+MAX_ATTEMPTS = 3
+
+CANCEL_RE = re.compile(r"^\s*(?:cancel|never ?mind|forget it|stop|abort|no thanks)\b", re.IGNORECASE)
+
+
+class Reprompt(Exception):
+    """Raised by a slot parser to ask the question again with a different message"""
+
+
+@dataclass
+class Slot:
+    name: str
+    prompt: str
+    # parse(text, slots) returns the slot value; None or Reprompt means ask again
+    parse: Optional[Callable[[str, Dict], Any]] = None
+
+
+@dataclass
+class Form:
+    name: str
+    slots: List[Slot]
+    # complete(slots) performs the action and returns the reply
+    complete: Callable[[Dict], str]
+    cancelled: str = "Okay, I've cancelled that."
+
+
+@dataclass
+class DialogState:
+    form: Form
+    slots: Dict = field(default_factory=dict)
+    pending: Optional[Slot] = None
+    attempts: int = 0
+    updated_at: float = field(default_factory=time.monotonic)
+
+
+class DialogManager:
+    """Pending slot-filling dialogs, one per session"""
+
+    def __init__(self, timeout: float = DIALOG_TIMEOUT, max_attempts: int = MAX_ATTEMPTS):
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.forms: Dict[str, Form] = {}
+        self.sessions: Dict[str, DialogState] = {}
+        self._lock = threading.Lock()
+
+    def register(self, form: Form):
+        self.forms[form.name] = form
+
+    def active(self, session_id: str) -> Optional[DialogState]:
+        """The session's dialog, unless it has expired"""
+        with self._lock:
+            state = self.sessions.get(session_id)
+            if state and time.monotonic() - state.updated_at > self.timeout:
+                del self.sessions[session_id]
+                return None
+            return state
+
+    def pending_slot(self, session_id: str) -> Optional[str]:
+        state = self.active(session_id)
+        return state.pending.name if state and state.pending else None
+
+    def cancel(self, session_id: str) -> bool:
+        with self._lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def start(self, session_id: str, form_name: str, slots: Optional[Dict] = None,
+              answers: Optional[Dict[str, str]] = None) -> str:
+        """Begin a form and return the first question (or the result if nothing is missing).
+
+        ``slots`` are final values; ``answers`` are raw text for slots that still
+        need parsing, e.g. a recipient name from the original sentence.
+        """
+        form = self.forms[form_name]
+        state = DialogState(form, dict(slots or {}))
+        question = None
+        for slot in form.slots:
+            text = (answers or {}).get(slot.name)
+            if not text or slot.name in state.slots:
+                continue
+            try:
+                value = self._parse(slot, text, state.slots)
+            except Reprompt as e:
+                # Ask about the first doubtful slot with the parser's question
+                if question is None:
+                    state.pending, question = slot, str(e)
+                continue
+            if value is not None:
+                state.slots[slot.name] = value
+        self._prune()
+        if question is not None:
+            return self._save(session_id, state, question)
+        return self._advance(session_id, state)
+
+    def handle(self, session_id: str, text: str,
+               interrupts: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """Feed a user turn to the session's dialog.
+
+        Returns the reply, or None when there is no dialog (or the user changed
+        the subject, as judged by ``interrupts``) so the turn is handled normally.
+        """
+        state = self.active(session_id)
+        if state is None or state.pending is None:
+            return None
+        if CANCEL_RE.match(text):
+            self.cancel(session_id)
+            return state.form.cancelled
+
+        slot = state.pending
+        try:
+            value = self._parse(slot, text, state.slots)
+            message = slot.prompt
+        except Reprompt as e:
+            value, message = None, str(e)
+        if value is None:
+            if interrupts and interrupts(text):
+                self.cancel(session_id)
+                return None
+            state.attempts += 1
+            if state.attempts >= self.max_attempts:
+                self.cancel(session_id)
+                return f"Sorry, I still didn't get that. {state.form.cancelled}"
+            return self._save(session_id, state, message)
+
+        state.slots[slot.name] = value
+        state.attempts = 0
+        return self._advance(session_id, state)
+
+    @staticmethod
+    def _parse(slot: Slot, text: str, slots: Dict):
+        if slot.parse:
+            return slot.parse(text, slots)
+        return text.strip() or None
+
+    def _advance(self, session_id: str, state: DialogState) -> str:
+        for slot in state.form.slots:
+            if slot.name not in state.slots:
+                state.pending = slot
+                return self._save(session_id, state, slot.prompt)
+        self.cancel(session_id)
+        return state.form.complete(state.slots)
+
+    def _save(self, session_id: str, state: DialogState, reply: str) -> str:
+        state.updated_at = time.monotonic()
+        with self._lock:
+            self.sessions[session_id] = state
+        return reply
+
+    def _prune(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [sid for sid, state in self.sessions.items() if now - state.updated_at > self.timeout]
+            for session_id in expired:
+                del self.sessions[session_id]
@@ -1,12 +1,9 @@
-import speech_recognition as sr
-import pyttsx3
+import argparse
 import datetime
 import webbrowser
-import wikipedia
-import requests
 import json
+import sys
 import time
-import smtplib
 import threading
 import os
 import re
@@ -15,29 +12,44 @@ import subprocess
 import logging
 import hashlib
 import sqlite3
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 import uuid
+import contextlib
+import contextvars
+from contextlib import contextmanager
 from dataclasses import dataclass
 from enum import Enum
-import asyncio
-# Optional imports for enhanced features
-try:
-    import aiohttp
-    AIOHTTP_AVAILABLE = True
-except ImportError:
-    AIOHTTP_AVAILABLE = False
-    print("Warning: aiohttp not available. Some async features will be disabled.")
-
-try:
-    import pyaudio
-    PYAUDIO_AVAILABLE = True
-except ImportError:
-    PYAUDIO_AVAILABLE = False
-    print("Warning: pyaudio not available. Audio recording features will be limited.")
+import importlib.util
+# Optional packages are only probed here; speech, TTS and service client
+# libraries are imported where they are first used to keep startup fast
+AIOHTTP_AVAILABLE = importlib.util.find_spec("aiohttp") is not None
+PYAUDIO_AVAILABLE = importlib.util.find_spec("pyaudio") is not None
 
 from concurrent.futures import ThreadPoolExecutor
+import itertools
 import queue
 import wave
+import calculator
+import time_parser
+from recurrence import RecurrenceError, RecurrenceRule, parse_recurrence
+from custom_commands import CustomCommandStore, MAX_MACRO_DEPTH
+from routines import RoutineScheduler, RoutineStore
+from preferences import PreferenceStore
+from contacts import ContactStore, SUGGEST_THRESHOLD
+import smart_home_integration
+from dialog import DialogManager, Form, Reprompt, Slot
+from subsystems import READY, SubsystemRegistry
+from instrumentation import Metrics, timed
+from recognition_cache import RecognitionCache, fingerprint
+from vad import AUDIOOP_AVAILABLE, VoiceActivityDetector, capture, prepare_upload, to_mono
+from speculation import SpeculationManager
+from admission import Overloaded, UpstreamGate, deadline_scope, parse_quotas, request_deadline
+from reminder_queue import ReminderQueue
+from history import ASSISTANT, USER, ConversationHistory
+from analytics import IntentAnalytics
+from intent_mining import MissedUtteranceStore, miss_reason
+from circuit_breaker import CLOSED, CircuitBreaker, CircuitOpen, StaleCache, check_upstream_status, describe_age
+from structured_logging import configure_logging, set_log_context
 
 load_dotenv()
 
@@ -48,20 +60,116 @@ SENDER_EMAIL = os.getenv("SENDER_EMAIL", "aradhyapendurkar192003@gmail.com")
 SENDER_PASSWORD = os.getenv("SENDER_APP_PASSWORD", "")
 WAKE_WORD = os.getenv("WAKE_WORD", f"hey {ASSISTANT_NAME.lower()}")
 WAKE_MODE_ENABLED = os.getenv("WAKE_MODE_ENABLED", "true").lower() == "true"
+# Preferences are stored per user; without sign-in everything runs as this user
+USER_ID = os.getenv("USER_ID", "local")
+TTS_VOICE = os.getenv("TTS_VOICE", "")
+SPEECH_RATE = int(os.getenv("SPEECH_RATE", "180"))
+DEFAULT_CITY = os.getenv("DEFAULT_CITY", "")
 TEXT_FALLBACK_ENABLED = os.getenv("TEXT_FALLBACK_ENABLED", "true").lower() == "true"
 CONTACTS_JSON = os.getenv("CONTACTS_JSON", "")
 SMART_HOME_API_KEY = os.getenv("SMART_HOME_API_KEY", "")
+# JSON file describing smart home adapters and devices (see smart_home_integration.load_controller)
+SMART_HOME_CONFIG = os.getenv("SMART_HOME_CONFIG", "")
+# Without a config, optionally drive a set of simulated demo devices
+SMART_HOME_SIMULATE = os.getenv("SMART_HOME_SIMULATE", "false").lower() == "true"
 NEWS_API_KEY = os.getenv("NEWS_API_KEY", "")
+# Service endpoints, overridable to point at a local fake server
+OPENWEATHER_URL = os.getenv("OPENWEATHER_URL", "http://api.openweathermap.org/data/2.5/weather")
+NEWS_API_URL = os.getenv("NEWS_API_URL", "https://newsapi.org/v2/top-headlines")
+GEOLOCATION_URL = os.getenv("GEOLOCATION_URL", "http://ip-api.com/json/")
 DATABASE_PATH = os.getenv("DATABASE_PATH", "assistant_data.db")
+# Transcripts of recently recognized clips reused for near-identical audio (0, the default, disables).
+# Near matches can confuse commands that differ in one sound, so it is off until tuned for a room
+RECOGNITION_CACHE_SIZE = int(os.getenv("RECOGNITION_CACHE_SIZE", "0"))
+RECOGNITION_CACHE_THRESHOLD = float(os.getenv("RECOGNITION_CACHE_THRESHOLD", "0.96"))
+# Keep recent pipeline spans for JSON trace export (see /api/metrics/trace)
+METRICS_TRACE_ENABLED = os.getenv("METRICS_TRACE_ENABLED", "true").lower() == "true"
 
-# Enhanced logging setup
-logging.basicConfig(
-    level=logging.INFO, 
-    format='[%(asctime)s] %(levelname)s: %(message)s',
-    handlers=[
-        logging.FileHandler('assistant.log'),
-        logging.StreamHandler()
-    ]
+# Logging: JSON lines rotated by size, with repetitive INFO messages rate limited
+LOG_FILE = os.getenv("LOG_FILE", "assistant.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_CONSOLE_LEVEL = os.getenv("LOG_CONSOLE_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "3"))
+LOG_RATE_LIMIT_BURST = int(os.getenv("LOG_RATE_LIMIT_BURST", "5"))
+LOG_RATE_LIMIT_INTERVAL = float(os.getenv("LOG_RATE_LIMIT_INTERVAL", "10"))
+
+# Uploaded audio is recognized in windows of this many seconds so memory stays bounded
+AUDIO_SEGMENT_SECONDS = int(os.getenv("AUDIO_SEGMENT_SECONDS", "10"))
+# Find speech in the microphone stream ourselves: trim silence and stop as soon as the speaker is done.
+# Needs audioop (audioop-lts on Python 3.13+); without it the recognizer's own listen() is used
+VAD_ENABLED = os.getenv("VAD_ENABLED", "true").lower() == "true" and AUDIOOP_AVAILABLE
+# Bounds, in seconds, of the silence that ends an utterance (it adapts to the speaker's pauses)
+VAD_MIN_SILENCE = float(os.getenv("VAD_MIN_SILENCE", "0.3"))
+VAD_MAX_SILENCE = float(os.getenv("VAD_MAX_SILENCE", "0.8"))
+# Start weather/news/Wikipedia fetches from partial transcripts that classify at least this confidently
+SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "true").lower() == "true"
+SPECULATION_THRESHOLD = float(os.getenv("SPECULATION_THRESHOLD", "0.8"))
+# Per-client token bucket on the web app's request routes: requests per second and burst (0 turns it off)
+RATE_LIMIT_PER_CLIENT = float(os.getenv("RATE_LIMIT_PER_CLIENT", "5"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "20"))
+# Web requests worked on at once, how many may queue for a slot, and the seconds each has to finish
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "16"))
+MAX_QUEUED_REQUESTS = int(os.getenv("MAX_QUEUED_REQUESTS", "64"))
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "10"))
+# Calls in flight per upstream service (0 turns upstream admission off), how many may wait for one,
+# and their quotas as name=calls/seconds. Callers waiting here hold a request slot, so keep the queue short
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "4"))
+UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", "8"))
+UPSTREAM_QUOTAS = os.getenv("UPSTREAM_QUOTAS", "openweathermap=60/60,newsapi=100/86400,ip-api=45/60")
+# Circuit breakers: failed or slow calls in a row that open one (0 turns them off), seconds that count as
+# slow, and seconds before a single probe call is let through
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", "3"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+# Oldest last-good reply given while a service is down, and how long a looked-up location is reused
+FALLBACK_MAX_AGE = float(os.getenv("FALLBACK_MAX_AGE", "21600"))
+LOCATION_MAX_AGE = float(os.getenv("LOCATION_MAX_AGE", "3600"))
+# Conversation entries kept in memory (the newest; older ones are dropped)
+HISTORY_MAX_ENTRIES = int(os.getenv("HISTORY_MAX_ENTRIES", "10000"))
+# Per-intent usage rollups for /api/analytics, and how often pending counts are written to the database
+ANALYTICS_ENABLED = os.getenv("ANALYTICS_ENABLED", "true").lower() == "true"
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "5"))
+# Utterances kept for tuning the intent patterns (see intent_mining): fallbacks, best matches below
+# MINING_MIN_CONFIDENCE, and matches with another intent within MINING_AMBIGUITY_MARGIN; at most MINING_MAX_UTTERANCES
+MINING_ENABLED = os.getenv("MINING_ENABLED", "true").lower() == "true"
+MINING_MIN_CONFIDENCE = float(os.getenv("MINING_MIN_CONFIDENCE", "0.75"))
+MINING_AMBIGUITY_MARGIN = float(os.getenv("MINING_AMBIGUITY_MARGIN", "0.1"))
+MINING_MAX_UTTERANCES = int(os.getenv("MINING_MAX_UTTERANCES", "50000"))
+# Worker processes that answer batch replays (/api/batch) in parallel; 0 answers them in the front end
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+
+# Enhanced logging setup: records are queued and written as JSON lines by a background thread (see structured_logging)
+configure_logging(LOG_FILE, LOG_LEVEL, LOG_CONSOLE_LEVEL, LOG_MAX_BYTES, LOG_BACKUP_COUNT,
+                  LOG_RATE_LIMIT_BURST, LOG_RATE_LIMIT_INTERVAL)
+
+# Starting values of the per-user settings; /api/settings changes override them
+DEFAULT_PREFERENCES = {
+    'voice': TTS_VOICE,
+    'speech_rate': SPEECH_RATE,
+    'volume': 1.0,
+    'default_city': DEFAULT_CITY,
+    'wake_word': WAKE_WORD,
+    'wake_mode': WAKE_MODE_ENABLED,
+}
+
+# Scheduled routines fetch weather, news and the like this many seconds early;
+# fetched replies older than the max age are fetched again when the routine runs
+ROUTINE_PREFETCH_LEAD = float(os.getenv("ROUTINE_PREFETCH_LEAD", "300"))
+ROUTINE_PREFETCH_MAX_AGE = float(os.getenv("ROUTINE_PREFETCH_MAX_AGE", "900"))
+
+# Follow-up questions are dropped if unanswered for this long
+DIALOG_TIMEOUT = float(os.getenv("DIALOG_TIMEOUT", "120"))
+
+# Trigger words stripped from a note request, leaving what to write down
+NOTE_PREFIX_RE = re.compile(r'^.*?\b(?:take a note|make a note|note down|note|remember|write down)\b\s*(?:that\s+)?')
+
+YES_WORDS = ("yes", "yeah", "yep", "correct", "right", "sure")
+NO_WORDS = ("no", "nope", "wrong")
+
+# Trigger words stripped from a reminder request before parsing the task and time
+REMINDER_PREFIX_RE = re.compile(
+    r'^.*?\b(?:remind me(?: to| about)?|(?:set|create) (?:a )?reminder(?: to| for| about)?|reminder(?: to| for)?)\b\s*'
 )
 
 class IntentType(Enum):
@@ -82,85 +190,440 @@ class IntentType(Enum):
     NOTE = "note"
     CALCULATE = "calculate"
     TRANSLATE = "translate"
+    CUSTOM = "custom"
+    ROUTINE = "routine"
     EXIT = "exit"
 
+# Compound utterances ("what's the time and weather in delhi") are split on these joiners;
+# the capture group keeps them so unsplittable parts can be glued back together
+COMPOUND_SPLIT_RE = re.compile(r'(\s*[,;]\s*(?:and\s+)?(?:then\s+|also\s+)?|\s+and then\s+|\s+and also\s+|\s+and\s+|\s+then\s+)')
+# A part must be at least this clearly a request of its own to be split off
+MIN_SEGMENT_CONFIDENCE = 0.7
+# Requests whose free text may itself contain "and" ("remind me to buy eggs and milk")
+FREE_TEXT_INTENTS = {
+    IntentType.EMAIL, IntentType.REMINDER, IntentType.NOTE, IntentType.SEARCH,
+    IntentType.PLAY, IntentType.TRANSLATE, IntentType.CUSTOM,
+}
+# Requests that mostly wait on the network; in a compound utterance they run side by side
+CONCURRENT_INTENTS = {IntentType.WEATHER, IntentType.NEWS, IntentType.WIKI, IntentType.SMART_HOME}
+# Read-only online requests whose replies a scheduled routine may fetch ahead of time
+PREFETCH_INTENTS = {IntentType.WEATHER, IntentType.NEWS, IntentType.WIKI}
+MAX_INTENT_WORKERS = int(os.getenv("MAX_INTENT_WORKERS", "4"))
+# Upstream services that calls are admitted to, and those guarded by circuit breakers
+UPSTREAM_SERVICES = ('openweathermap', 'newsapi', 'wikipedia', 'ip-api')
+BREAKER_SERVICES = UPSTREAM_SERVICES + ('google-speech',)
+# Subsystems every text request goes through; /api/readiness reports ready once all enabled ones are
+TEXT_PATH_SUBSYSTEMS = ('database', 'custom_commands', 'routines', 'analytics', 'missed_utterances')
+# Confidence of the greeting given when no pattern matches; analytics counts these turns as fallbacks
+FALLBACK_CONFIDENCE = 0.1
+
+# Built-in intent patterns with the confidence a match gives; the most confident match wins
+INTENT_PATTERNS = [
+    # Greetings with variations
+    (re.compile(r'\b(hello|hi|hey|good morning|good afternoon|good evening)\b'), IntentType.GREET, 0.9),
+
+    # Time and date - more flexible patterns
+    (re.compile(r'\b(what\'s|what is|whats|what\'s the|what is the|tell me the)\s*(the\s*)?(time|current time)\b'), IntentType.TIME, 0.95),
+    (re.compile(r'\b(time|current time)\??\b'), IntentType.TIME, 0.8),
+    (re.compile(r'\b(what\'s|what is|whats|what\'s the|what is the|tell me the)\s*(the\s*)?(date|today\'s date)\b'), IntentType.DATE, 0.95),
+    (re.compile(r'\b(date|what date|today)\s*(is it|it is)?\??\b'), IntentType.DATE, 0.85),
+
+    # Help and capabilities
+    (re.compile(r'\b(help|what can you do|capabilities)\b'), IntentType.HELP, 0.9),
+
+    # Opening applications/websites
+    (re.compile(r'\bopen (.+)\b'), IntentType.OPEN, 0.8),
+    (re.compile(r'\blaunch (.+)\b'), IntentType.OPEN, 0.8),
+
+    # Media and entertainment
+    (re.compile(r'\bplay (.+) on youtube\b'), IntentType.PLAY, 0.9),
+    (re.compile(r'\bplay (.+)\b'), IntentType.PLAY, 0.7),
+
+    # Communication
+    (re.compile(r'\b(send|write) (an )?email\b'), IntentType.EMAIL, 0.9),
+    (re.compile(r'\bemail (.+)\b'), IntentType.EMAIL, 0.8),
+
+    # Reminders and tasks
+    (re.compile(r'\b(my|due|upcoming|pending) reminders\b'), IntentType.REMINDER, 0.95),
+    (re.compile(r'\b(remind me to|set a reminder for|create a reminder for)\b'), IntentType.REMINDER, 0.9),
+    (re.compile(r'\b(remind me|set reminder|set a reminder|create reminder|create a reminder|reminder)\b'), IntentType.REMINDER, 0.85),
+
+    # Search and information
+    (re.compile(r'\bsearch for (.+)\b'), IntentType.SEARCH, 0.9),
+    (re.compile(r'\b(tell me about|tell me more about|what are|what is) (.+)\b'), IntentType.WIKI, 0.95),
+    (re.compile(r'\b(who is|who are) (.+)\b'), IntentType.WIKI, 0.95),
+    (re.compile(r'\bweather in (.+)\b'), IntentType.WEATHER, 0.9),
+    (re.compile(r'\bweather\b'), IntentType.WEATHER, 0.7),
+
+    # News
+    (re.compile(r'\b(news|latest news|current events)\b'), IntentType.NEWS, 0.9),
+
+    # Smart home
+    (re.compile(r'\b(turn on|turn off|switch) (.+)\b'), IntentType.SMART_HOME, 0.8),
+    (re.compile(r'^(is|are) (?:the )?(.+?) (?:on|off|running)\??$'), IntentType.SMART_HOME, 0.85),
+    (re.compile(r'\b(control|manage) (.+)\b'), IntentType.SMART_HOME, 0.7),
+
+    # Calendar
+    (re.compile(r'\b(schedule|add to calendar|calendar)\b'), IntentType.CALENDAR, 0.8),
+
+    # Notes
+    (re.compile(r'\b(note|remember|write down)\b'), IntentType.NOTE, 0.8),
+
+    # Calculations
+    (re.compile(r'\b(calculate|compute|what is|what\'s|how much is) (.+)\b'), IntentType.CALCULATE, 0.9),
+
+    # Translation
+    (re.compile(r'\b(translate|how do you say)\b'), IntentType.TRANSLATE, 0.8),
+
+    # Exit
+    (re.compile(r'\b(goodbye|exit|stop|quit)\b'), IntentType.EXIT, 0.9),
+]
+
+
+def best_pattern(text: str, patterns=INTENT_PATTERNS):
+    """(index, match, confidence) of the pattern that wins for lowercased ``text``, or None; and each intent's best confidence.
+
+    The first of equally confident matches wins. Spoken math outranks the
+    generic "what is" Wikipedia lookup.
+    """
+    best = None
+    scores = {}
+    for index, (pattern, intent_type, confidence) in enumerate(patterns):
+        match = pattern.search(text)
+        if match:
+            if (intent_type == IntentType.CALCULATE and pattern.groups >= 2
+                    and calculator.is_expression(match.group(2))):
+                confidence = 0.97
+            if confidence > scores.get(intent_type, 0.0):
+                scores[intent_type] = confidence
+            if confidence > (best[2] if best else 0.0):
+                best = (index, match, confidence)
+    return best, scores
+
+
+def second_best(scores: Dict, winner) -> Optional[Tuple[IntentType, float]]:
+    """The most confident intent other than ``winner`` that also matched, as (type, confidence)"""
+    others = [(confidence, intent_type) for intent_type, confidence in scores.items() if intent_type != winner]
+    if not others:
+        return None
+    confidence, intent_type = max(others, key=lambda other: other[0])
+    return intent_type, confidence
+
 @dataclass
 class Intent:
     type: IntentType
     confidence: float
     entities: Dict[str, str]
     raw_text: str
+    # Next most confident intent whose patterns also matched, for spotting ambiguous utterances
+    runner_up: Optional[Tuple[IntentType, float]] = None
 
 @dataclass
 class UserContext:
     user_id: str
     session_id: str
     preferences: Dict
-    conversation_history: List[str]
+    conversation_history: ConversationHistory
     current_location: Optional[str] = None
 
 class EnhancedVoiceAssistant:
     def __init__(self):
-        self.recognizer = sr.Recognizer()
-        self.engine = None
         self.user_context = None
-        self.db_connection = None
-        self.smart_home_devices = {}
-        self.custom_commands = {}
+        # Serializes use of the shared SQLite connection across threads
+        self.db_lock = threading.Lock()
+        self._smart_home_simulator = None
+        # Background level learned by the voice activity detector, carried between utterances
+        self._noise_floor = None
+        # Nesting of custom command macros on the current thread; web requests run macros concurrently
+        self._macro = threading.local()
         self.conversation_queue = queue.Queue()
         self.is_listening = False
         # Lock to protect TTS usage from multiple threads
         self.speak_lock = threading.Lock()
-        # In-memory scheduled reminders: list of tuples (due_timestamp, text, id)
-        self.reminders = []
+        # In-memory scheduled reminders in due order, with integer ids
+        self.reminders = ReminderQueue()
+        self._reminder_ids = itertools.count(1)
+        # Recurrence rules of repeating reminders, keyed by reminder id
+        self.reminder_series = {}
+        self.reminder_lock = threading.Lock()
         self._reminder_thread = None
+        # Per-stage latency histograms and trace spans
+        self.metrics = Metrics(tracing=METRICS_TRACE_ENABLED)
+        # Repeated short commands skip the speech service when they sound like a cached clip
+        self.recognition_cache = (
+            RecognitionCache(RECOGNITION_CACHE_SIZE, RECOGNITION_CACHE_THRESHOLD, self.metrics)
+            if RECOGNITION_CACHE_SIZE > 0 and AUDIOOP_AVAILABLE else None
+        )
+        if not AUDIOOP_AVAILABLE:
+            logging.warning("audioop not available (install audioop-lts on Python 3.13+); "
+                            "voice activity detection and the recognition cache are off")
+        # Bounded concurrency and quota budgets in front of each upstream service
+        quotas = parse_quotas(UPSTREAM_QUOTAS)
+        self.upstreams = {
+            name: UpstreamGate(name, UPSTREAM_MAX_CONCURRENCY, UPSTREAM_MAX_QUEUE, quotas.get(name), metrics=self.metrics)
+            for name in UPSTREAM_SERVICES
+        } if UPSTREAM_MAX_CONCURRENCY > 0 else {}
+        # Stop calling services that keep failing, answering from their last good replies meanwhile
+        self.breakers = {
+            name: CircuitBreaker(name, BREAKER_FAILURE_THRESHOLD, BREAKER_SLOW_CALL, BREAKER_RESET_TIMEOUT,
+                                 metrics=self.metrics)
+            for name in BREAKER_SERVICES
+        } if BREAKER_FAILURE_THRESHOLD > 0 else {}
+        self.fallbacks = StaleCache(max_age=FALLBACK_MAX_AGE)
+        # Follow-up questions wait here for the next turn instead of blocking in listen()
+        self.dialogs = DialogManager(timeout=DIALOG_TIMEOUT)
+        self._register_dialogs()
+        # Runs the network-bound parts of compound requests concurrently
+        self.intent_executor = ThreadPoolExecutor(max_workers=MAX_INTENT_WORKERS, thread_name_prefix='intent')
+        # Fetches started from partial transcripts, taken up or thrown away when the final one arrives
+        self.speculation = (
+            SpeculationManager(self.intent_executor, self.process_natural_language, self.can_speculate,
+                               SPECULATION_THRESHOLD, self.metrics)
+            if SPECULATION_ENABLED else None
+        )
+        # Per-thread list that captures speak() output while a compound request is handled
+        self._speech = threading.local()
+        # Replies fetched ahead of scheduled routines: routine id -> (fetched_at, {step index: reply})
+        self._routine_prefetch = {}
+        self._routine_prefetch_lock = threading.Lock()
+        self.routine_scheduler = None
+        # Wake-word matcher state, kept in step with the preferences store
+        self.wake_word = WAKE_WORD.lower()
+        self.wake_mode = WAKE_MODE_ENABLED
+        
+        # Everything expensive comes up on first use; see readiness()
+        self.subsystems = SubsystemRegistry()
+        self.subsystems.register('tts', self._initialize_components)
+        self.subsystems.register('recognizer', self._create_recognizer)
+        self.subsystems.register('database', self._setup_database)
+        self.subsystems.register('preferences', self._load_preferences)
+        self.subsystems.register('custom_commands', self._load_custom_commands)
+        self.subsystems.register('routines', self._load_routines)
+        self.subsystems.register('contacts', self._load_contacts)
+        self.subsystems.register('smart_home', self._setup_smart_home)
+        self.subsystems.register('reminder_monitor', self._start_reminder_monitor)
+        self.subsystems.register('analytics', self._load_analytics)
+        self.subsystems.register('missed_utterances', self._load_missed_utterances)
         
-        self._initialize_components()
-        self._setup_database()
         self._load_user_preferences()
-        # Start background monitor for reminders
-        self._start_reminder_monitor()
+
+    @property
+    def engine(self):
+        return self.subsystems.get('tts')
+
+    @property
+    def recognizer(self):
+        return self.subsystems.get('recognizer')
+
+    @property
+    def db_connection(self):
+        return self.subsystems.get('database')
+
+    @property
+    def analytics(self):
+        """Per-intent usage rollups, or None when disabled"""
+        return self.subsystems.get('analytics') if ANALYTICS_ENABLED else None
+
+    @property
+    def missed_utterances(self):
+        """Captured fallback, ambiguous and low-confidence utterances, or None when disabled"""
+        return self.subsystems.get('missed_utterances') if MINING_ENABLED else None
+
+    @property
+    def smart_home(self):
+        return self.subsystems.get('smart_home')
+
+    @property
+    def contacts(self):
+        return self.subsystems.get('contacts')
+
+    @property
+    def preferences(self):
+        """The current user's settings (in memory, saved in the background)"""
+        return self.subsystems.get('preferences')
+
+    def preference(self, key: str):
+        """A user setting, falling back to its configured default"""
+        store = self.preferences
+        return store.get(key) if store else DEFAULT_PREFERENCES[key]
+
+    @property
+    def custom_commands(self):
+        """User-defined commands, indexed once the database is ready"""
+        return self.subsystems.get('custom_commands')
+
+    @property
+    def routines(self):
+        """Named routines; loading them also starts the schedule timer"""
+        return self.subsystems.get('routines')
+
+    @contextmanager
+    def recorded(self, intent: Intent):
+        """Count the intent handled in the block, with its handler time, in the usage analytics.
+
+        Fallback, ambiguous and low-confidence utterances are also kept for mining.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            fallback = intent.type == IntentType.GREET and intent.confidence == FALLBACK_CONFIDENCE
+            analytics = self.analytics
+            if analytics:
+                analytics.record(intent.type.value, intent.confidence, fallback, time.perf_counter() - start)
+            rival_type, rival_confidence = intent.runner_up or (None, None)
+            reason = miss_reason(intent.confidence, rival_confidence, fallback,
+                                 MINING_MIN_CONFIDENCE, MINING_AMBIGUITY_MARGIN)
+            if reason and self.missed_utterances:
+                self.missed_utterances.capture(intent.raw_text, reason, intent.type.value, intent.confidence,
+                                               rival_type.value if rival_type else None, rival_confidence)
+
+    def save_counts(self):
+        """Write pending usage counts and captured utterances now instead of waiting for their writers"""
+        for name in ('analytics', 'missed_utterances'):
+            subsystem = self.subsystems[name]
+            if subsystem.state == READY and subsystem.value is not None:
+                subsystem.value.flush()
+
+    @contextmanager
+    def upstream(self, service: str, failures: Tuple = (OSError,)):
+        """Admission and circuit breaking for one call to an upstream service.
+
+        Raises CircuitOpen at once while the service is failing, and Overloaded
+        rather than wait past the deadline. Exceptions of ``failures`` raised in
+        the block count against the service.
+        """
+        breaker = self.breakers.get(service)
+        gate = self.upstreams.get(service)
+        if breaker:
+            # Fail fast before queueing for a slot
+            breaker.check()
+        with gate.admit() if gate else contextlib.nullcontext():
+            with breaker.guard(failures) if breaker else contextlib.nullcontext():
+                yield
+
+    def upstream_timeout(self, service: str, seconds: float) -> float:
+        """Timeout for a call to ``service``: shorter while it is failing, and never past the request's deadline"""
+        breaker = self.breakers.get(service)
+        if breaker:
+            seconds = breaker.timeout(seconds)
+        deadline = request_deadline()
+        if deadline is not None:
+            seconds = max(0.1, min(seconds, deadline - time.monotonic()))
+        return seconds
+
+    def service_available(self, service: str) -> bool:
+        """False while the service's circuit is open or being probed"""
+        breaker = self.breakers.get(service)
+        return breaker is None or breaker.state == CLOSED
+
+    def remember(self, service: str, key: str, reply):
+        """Keep a good reply to answer with while the service is down"""
+        self.fallbacks.put((service, key.lower()), reply)
+
+    def recall(self, service: str, key: str, max_age: float = FALLBACK_MAX_AGE):
+        """The last good reply for ``key`` and its age in seconds, or None"""
+        found = self.fallbacks.get((service, key.lower()), max_age)
+        if found:
+            self.metrics.increment('fallbacks_served')
+        return found
+
+    def readiness(self) -> Dict[str, Dict]:
+        """Per-subsystem initialization state, e.g. {'tts': {'state': 'ready', 'init_ms': 41.2}}"""
+        return self.subsystems.readiness()
+
+    def text_ready(self) -> bool:
+        """Whether every enabled subsystem a text request goes through has come up"""
+        # Turned-off features fail to load by design; they must not hold readiness back
+        enabled = {'analytics': ANALYTICS_ENABLED, 'missed_utterances': MINING_ENABLED}
+        return all(self.subsystems[name].state == READY
+                   for name in TEXT_PATH_SUBSYSTEMS if enabled.get(name, True))
+
+    def warm_up(self, names=None, background: bool = True):
+        """Bring subsystems up ahead of first use (all of them by default)"""
+        return self.subsystems.warm_up(names, background)
         
     def _initialize_components(self):
-        """Initialize TTS engine and other components"""
+        """Initialize the TTS engine; called on first use of self.engine"""
+        engine = None
         try:
+            import pyttsx3
+            
             # Try to initialize with different drivers
             driver_names = ['sapi5', 'nsss', 'espeak']
             
             for driver in driver_names:
                 try:
-                    self.engine = pyttsx3.init(driver)
+                    engine = pyttsx3.init(driver)
                     logging.info(f"TTS initialized with driver: {driver}")
                     break
                 except Exception:
                     continue
             
-            if not self.engine:
+            if not engine:
                 # Last resort: try default initialization
-                self.engine = pyttsx3.init()
+                engine = pyttsx3.init()
             
             # Try to set voice properties
             try:
-                voices = self.engine.getProperty('voices')
-                # Set a more natural voice if available
-                for voice in voices:
-                    if 'female' in voice.name.lower() or 'zira' in voice.name.lower():
-                        self.engine.setProperty('voice', voice.id)
-                        break
+                self._select_voice(engine, self.preference('voice'))
+                engine.setProperty('volume', self.preference('volume'))
             except Exception as e:
                 logging.warning(f"Could not set voice properties: {e}")
                 
         except Exception as e:
-            logging.error(f"Error initializing TTS engine: {e}")
-            # Don't raise - allow assistant to work without TTS
-            self.engine = None
+            # Re-raise so the subsystem is marked failed - the assistant keeps working without TTS
             logging.warning("Assistant will run without text-to-speech")
+            raise RuntimeError(f"Error initializing TTS engine: {e}")
+        return engine
+
+    def _select_voice(self, engine, wanted: str = ""):
+        """Use the voice whose name or id contains ``wanted``, else a more natural default"""
+        voices = engine.getProperty('voices')
+        if wanted:
+            for voice in voices:
+                if wanted.lower() in voice.name.lower() or wanted.lower() in voice.id.lower():
+                    engine.setProperty('voice', voice.id)
+                    return
+            logging.warning(f"No TTS voice matches '{wanted}'; using the default")
+        # Set a more natural voice if available
+        for voice in voices:
+            if 'female' in voice.name.lower() or 'zira' in voice.name.lower():
+                engine.setProperty('voice', voice.id)
+                break
+
+    def _apply_voice_preferences(self, changes: Dict):
+        """Retune a running TTS engine; one that hasn't started yet reads the store when it does"""
+        tts = self.subsystems['tts']
+        if tts.state != READY or tts.value is None:
+            return
+        try:
+            if 'voice' in changes:
+                self._select_voice(tts.value, changes['voice'])
+            if 'volume' in changes:
+                tts.value.setProperty('volume', changes['volume'])
+        except Exception as e:
+            logging.warning(f"Could not update voice properties: {e}")
+
+    def _apply_wake_preferences(self, changes: Dict):
+        if 'wake_word' in changes:
+            self.wake_word = changes['wake_word'].lower()
+        if 'wake_mode' in changes:
+            self.wake_mode = changes['wake_mode']
+        logging.info(f"Wake word is now '{self.wake_word}' ({'on' if self.wake_mode else 'off'})")
+
+    def _create_recognizer(self):
+        """Create the speech recognizer; called on first use of self.recognizer"""
+        import speech_recognition as sr
+        if not PYAUDIO_AVAILABLE:
+            logging.warning("pyaudio not available. Audio recording features will be limited.")
+        return sr.Recognizer()
 
     def _setup_database(self):
         """Setup SQLite database for user data and conversation history"""
+        connection = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
         try:
-            self.db_connection = sqlite3.connect(DATABASE_PATH)
-            cursor = self.db_connection.cursor()
+            cursor = connection.cursor()
             
             # Create tables
             cursor.execute('''
@@ -196,67 +659,276 @@ class EnhancedVoiceAssistant:
                 )
             ''')
             
-            self.db_connection.commit()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS routines (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT,
+                    name TEXT UNIQUE,
+                    trigger TEXT,
+                    steps TEXT,
+                    schedule TEXT,
+                    enabled INTEGER DEFAULT 1,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS routine_runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    routine_id INTEGER,
+                    started_at REAL,
+                    duration_ms REAL,
+                    source TEXT,
+                    prefetched INTEGER,
+                    errors INTEGER,
+                    FOREIGN KEY (routine_id) REFERENCES routines (id)
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS contacts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT,
+                    name TEXT UNIQUE,
+                    email TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            
+            connection.commit()
         except Exception as e:
             logging.error(f"Database setup error: {e}")
+        return connection
 
     def _load_user_preferences(self):
-        """Load user preferences and create default context"""
-        user_id = str(uuid.uuid4())  # In a real app, this would be from authentication
+        """Create the user context; the settings themselves load with the preferences subsystem"""
+        user_id = USER_ID
         session_id = str(uuid.uuid4())
         
         self.user_context = UserContext(
             user_id=user_id,
             session_id=session_id,
             preferences={},
-            conversation_history=[]
+            conversation_history=ConversationHistory(HISTORY_MAX_ENTRIES)
         )
+        set_log_context(session_id=session_id, turn_source=lambda: self.metrics.current_turn)
+
+    def _load_preferences(self):
+        """Read the user's settings into memory and follow changes to them"""
+        if not self.db_connection:
+            raise RuntimeError("Database is not available")
+        store = PreferenceStore(self.db_connection, self.user_context.user_id, DEFAULT_PREFERENCES, self.db_lock)
+        store.subscribe(self._apply_voice_preferences, ('voice', 'volume'))
+        store.subscribe(self._apply_wake_preferences, ('wake_word', 'wake_mode'))
+        self.wake_word = store.get('wake_word').lower()
+        self.wake_mode = store.get('wake_mode')
+        return store
+
+    def _load_custom_commands(self):
+        """Index the user-defined commands stored in the database"""
+        if not self.db_connection:
+            raise RuntimeError("Database is not available")
+        store = CustomCommandStore(self.db_connection, self.db_lock, [intent.value for intent in IntentType])
+        logging.info(f"Loaded {len(store.commands)} custom commands")
+        return store
+
+    def _load_routines(self):
+        """Index stored routines and start timers for the scheduled ones"""
+        if not self.db_connection:
+            raise RuntimeError("Database is not available")
+        store = RoutineStore(self.db_connection, self.db_lock)
+        scheduler = RoutineScheduler(store, self.prefetch_routine, self._run_scheduled_routine, ROUTINE_PREFETCH_LEAD)
+        store.on_change = scheduler.reschedule
+        self.routine_scheduler = scheduler
+        scheduler.reschedule()
+        logging.info(f"Loaded {len(store.routines)} routines ({len(store.scheduled())} scheduled)")
+        return store
+
+    def _load_analytics(self):
+        """Open the per-intent usage rollups and start their background writer"""
+        if not ANALYTICS_ENABLED:
+            raise RuntimeError("Analytics is disabled; set ANALYTICS_ENABLED=true")
+        if not self.db_connection:
+            raise RuntimeError("Database is not available")
+        return IntentAnalytics(self.db_connection, self.db_lock, ANALYTICS_FLUSH_INTERVAL)
+
+    def _load_missed_utterances(self):
+        """Open the store of fallback, ambiguous and low-confidence utterances"""
+        if not MINING_ENABLED:
+            raise RuntimeError("Utterance mining is disabled; set MINING_ENABLED=true")
+        if not self.db_connection:
+            raise RuntimeError("Database is not available")
+        return MissedUtteranceStore(self.db_connection, self.db_lock, MINING_MAX_UTTERANCES, ANALYTICS_FLUSH_INTERVAL)
+
+    def _setup_smart_home(self):
+        """Build the device controller from SMART_HOME_CONFIG, or a simulator if enabled"""
+        if SMART_HOME_CONFIG:
+            with open(SMART_HOME_CONFIG) as f:
+                config = json.load(f)
+            controller = smart_home_integration.load_controller(config, SMART_HOME_API_KEY, self.metrics)
+        elif SMART_HOME_SIMULATE:
+            controller, self._smart_home_simulator = smart_home_integration.simulated_controller(metrics=self.metrics)
+        else:
+            raise RuntimeError("Smart home is not configured; set SMART_HOME_CONFIG or SMART_HOME_SIMULATE")
+        # Fill the state cache in the background so status questions never wait on devices
+        threading.Thread(target=controller.refresh, name="smart-home-refresh", daemon=True).start()
+        logging.info(f"Smart home ready with {len(controller.registry.devices)} devices")
+        return controller
+
+    def _load_contacts(self):
+        """Index the contacts table, seeding it from CONTACTS_JSON on first run"""
+        if not self.db_connection:
+            raise RuntimeError("Database is not available")
+        store = ContactStore(self.db_connection, self.db_lock)
+        if not len(store):
+            store.import_contacts(self.load_contacts().items())
+        logging.info(f"Loaded {len(store)} contacts")
+        return store
+
+    def _register_dialogs(self):
+        """Forms for handlers that need follow-up answers"""
+        self.dialogs.register(Form('email', [
+            Slot('recipient', "To whom should I send the email?", self.resolve_recipient),
+            Slot('subject', "What should be the subject?",
+                 lambda text, slots: "No Subject" if text.strip().lower() in ("none", "no subject", "skip") else text.strip()),
+            Slot('body', "What's the message?"),
+        ], self._complete_email, cancelled="Okay, I've cancelled the email."))
+        self.dialogs.register(Form('reminder', [
+            Slot('task', "What should I remind you about?", self._parse_reminder_task),
+            Slot('when', "When should I remind you?", self._parse_reminder_time),
+        ], self._complete_reminder, cancelled="Okay, no reminder."))
+        self.dialogs.register(Form('weather', [
+            Slot('city', "Which city's weather would you like to know?"),
+        ], lambda slots: self.weather_report(slots['city'])))
+        self.dialogs.register(Form('note', [
+            Slot('text', "What would you like me to remember?"),
+        ], self._complete_note))
+        self.dialogs.register(Form('device', [
+            Slot('device', "Which device?", self._parse_device_choice),
+        ], self._complete_device, cancelled="Okay, I'll leave it."))
+
+    def start_dialog(self, form: str, session_id: Optional[str] = None, slots: Optional[Dict] = None,
+                     answers: Optional[Dict[str, str]] = None) -> str:
+        """Begin asking for a form's missing slots and return the first question"""
+        return self.dialogs.start(session_id or self.user_context.session_id, form, slots, answers)
+
+    def continue_dialog(self, text: str, session_id: Optional[str] = None) -> Optional[str]:
+        """Answer a pending follow-up question, or None if ``text`` is a new request"""
+        return self.dialogs.handle(session_id or self.user_context.session_id, text, self._interrupts_dialog)
+
+    def _interrupts_dialog(self, text: str) -> bool:
+        """An answer that fails to parse but is clearly another request abandons the dialog"""
+        intent = self.process_natural_language(text)
+        return intent.confidence >= 0.8 and intent.type not in (IntentType.GREET, IntentType.CUSTOM)
+
+    @contextmanager
+    def collect_speech(self):
+        """Capture what handlers on this thread would say instead of speaking it"""
+        outer = getattr(self._speech, 'lines', None)
+        lines = []
+        self._speech.lines = lines
+        try:
+            yield lines
+        finally:
+            self._speech.lines = outer
 
     def speak(self, text: str, priority: str = "normal"):
         """Enhanced text-to-speech with priority handling"""
+        lines = getattr(self._speech, 'lines', None)
+        if lines is not None:
+            lines.append(text)
+            return
+        
+        self.metrics.first_audio()
         print(f"{ASSISTANT_NAME}: {text}")
         
         # Add to conversation history
         if self.user_context:
-            self.user_context.conversation_history.append(f"Assistant: {text}")
+            self.user_context.conversation_history.add(ASSISTANT, text)
         
         # Skip TTS if engine not available
         if not self.engine:
             return
             
         try:
-            # Adjust speech rate based on text length
-            if len(text) > 100:
-                self.engine.setProperty('rate', 150)
-            else:
-                self.engine.setProperty('rate', 180)
-                
-            self.engine.say(text)
-            self.engine.runAndWait()
+            with self.metrics.span('tts'):
+                # Adjust speech rate based on text length
+                rate = self.preference('speech_rate')
+                if len(text) > 100:
+                    self.engine.setProperty('rate', rate - 30)
+                else:
+                    self.engine.setProperty('rate', rate)
+                    
+                self.engine.say(text)
+                self.engine.runAndWait()
         except Exception as e:
             logging.exception("Error in speech synthesis")
 
     def listen(self, timeout: int = 5) -> str:
         """Enhanced speech recognition with better error handling"""
+        import speech_recognition as sr
+        mic_start = time.perf_counter()
         with sr.Microphone() as source:
+            self.metrics.observe('mic_open', time.perf_counter() - mic_start, start=mic_start)
             print("\n🎤 Listening...")
+            if VAD_ENABLED:
+                utterance = self.capture_utterance(source, timeout)
+                if utterance is None:
+                    return "none"
+                self.metrics.mark_end_of_speech(time.perf_counter() - utterance.waited_seconds)
+                audio = sr.AudioData(*prepare_upload(utterance.pcm, utterance.sample_rate, utterance.sample_width))
+                return self.recognize_audio(audio)
+
             self.recognizer.pause_threshold = 1
-            self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
+            with self.metrics.span('ambient_calibration'):
+                self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
             
             try:
-                audio = self.recognizer.listen(source, timeout=timeout, phrase_time_limit=10)
+                with self.metrics.span('capture'):
+                    audio = self.recognizer.listen(source, timeout=timeout, phrase_time_limit=10)
+                self.metrics.mark_end_of_speech(time.perf_counter() - self.recognizer.pause_threshold)
             except sr.WaitTimeoutError:
                 return "none"
                 
+        return self.recognize_audio(audio)
+
+    def capture_utterance(self, source, timeout: Optional[float] = None):
+        """Read one utterance from an audio source with the voice activity detector"""
+        detector = VoiceActivityDetector(source.SAMPLE_RATE, source.SAMPLE_WIDTH, self._noise_floor,
+                                         VAD_MIN_SILENCE, VAD_MAX_SILENCE)
+        with self.metrics.span('capture'):
+            utterance = capture(detector, lambda: source.stream.read(source.CHUNK),
+                                source.CHUNK / source.SAMPLE_RATE, timeout)
+        self._noise_floor = detector.noise_floor
+        if utterance is not None:
+            # Time spent making sure the speaker had finished
+            self.metrics.observe('endpointing', utterance.waited_seconds)
+        return utterance
+
+    @timed('recognition')
+    def recognize_audio(self, audio: "sr.AudioData", record_history: bool = True) -> str:
+        """Recognize a captured clip, returning "none" when nothing was understood"""
+        import speech_recognition as sr
         try:
             print("🔄 Processing speech...")
-            # Try multiple recognition services for better accuracy
-            command = self.recognizer.recognize_google(audio, language='en-in').lower()
+            print_ = None
+            command = None
+            if self.recognition_cache is not None:
+                print_ = fingerprint(audio.frame_data, audio.sample_rate, audio.sample_width)
+                command = self.recognition_cache.lookup(print_) if print_ else None
+            if command is None:
+                # Try multiple recognition services for better accuracy
+                with self.upstream('google-speech', (OSError, sr.RequestError)):
+                    command = self.recognizer.recognize_google(audio, language='en-in').lower()
+                if print_:
+                    self.recognition_cache.store(print_, command)
             print(f"👤 You said: {command}")
             
             # Store in conversation history
-            if self.user_context:
-                self.user_context.conversation_history.append(f"User: {command}")
+            if record_history and self.user_context:
+                self.user_context.conversation_history.add(USER, command)
                 
             return command
         except sr.UnknownValueError:
@@ -264,111 +936,225 @@ class EnhancedVoiceAssistant:
         except sr.RequestError as e:
             logging.error(f"Speech recognition service error: {e}")
             return "none"
+        except CircuitOpen as e:
+            logging.warning(f"Skipping speech recognition: {e}")
+            return "none"
         except Exception as e:
             logging.exception("Speech recognition error")
             return "none"
 
+    def transcribe_pcm_stream(self, chunks, sample_rate: int, sample_width: int, channels: int = 1,
+                              on_partial: Optional[Callable[[str], None]] = None) -> str:
+        """Recognize raw PCM chunks (e.g. uploaded from a browser) without buffering the whole clip.
+
+        With VAD on, the stream is cut into utterances at the speaker's pauses, as
+        the microphone is, and each is recognized as soon as its trailing silence
+        is heard; silence between them is never uploaded. AUDIO_SEGMENT_SECONDS
+        caps an utterance, so memory stays flat however long the speaker goes on.
+        With VAD off the stream is cut into fixed windows of that length.
+        ``on_partial`` gets the transcript so far after each segment.
+        """
+        import speech_recognition as sr
+        if sample_rate <= 0 or sample_width not in (1, 2, 3, 4) or channels not in (1, 2):
+            raise ValueError("Unsupported audio format")
+
+        frame_bytes = sample_width * channels
+        segment_bytes = max(1, AUDIO_SEGMENT_SECONDS) * sample_rate * sample_width
+        buffer = bytearray()
+        pending = bytearray()
+        transcript = []
+
+        def new_detector(noise_floor=None):
+            return VoiceActivityDetector(sample_rate, sample_width, noise_floor, VAD_MIN_SILENCE,
+                                         VAD_MAX_SILENCE, max_seconds=max(1, AUDIO_SEGMENT_SECONDS))
+
+        detector = new_detector() if VAD_ENABLED else None
+
+        def recognize_segment(data: bytes):
+            if detector is not None:
+                audio = sr.AudioData(*prepare_upload(data, sample_rate, sample_width))
+            else:
+                audio = sr.AudioData(data, sample_rate, sample_width)
+            text = self.recognize_audio(audio, record_history=False)
+            if text != "none":
+                transcript.append(text)
+                if on_partial:
+                    on_partial(" ".join(transcript))
+
+        for chunk in chunks:
+            buffer.extend(chunk)
+            # Whole sample frames only, so a chunk may split a sample
+            usable = len(buffer) - (len(buffer) % frame_bytes)
+            data = bytes(buffer[:usable])
+            del buffer[:usable]
+            if channels == 2:
+                data = to_mono(data, sample_width)
+            pending.extend(data)
+            if detector is None:
+                while len(pending) >= segment_bytes:
+                    recognize_segment(bytes(pending[:segment_bytes]))
+                    del pending[:segment_bytes]
+                continue
+            # One VAD frame at a time, so no audio after the end of an utterance is lost
+            step, offset = detector.frame_bytes, 0
+            while len(pending) - offset >= step:
+                utterance = detector.feed(bytes(pending[offset:offset + step]))
+                offset += step
+                if utterance:
+                    recognize_segment(utterance.pcm)
+                    detector = new_detector(detector.noise_floor)
+            del pending[:offset]
+
+        if detector is None:
+            if pending:
+                recognize_segment(bytes(pending))
+        else:
+            utterance = detector.flush()
+            if utterance:
+                recognize_segment(utterance.pcm)
+
+        command = " ".join(transcript)
+        if not command:
+            return "none"
+
+        if self.user_context:
+            self.user_context.conversation_history.add(USER, command)
+        return command
+
+    def transcribe_wav_stream(self, stream, chunk_seconds: float = 1.0,
+                              on_partial: Optional[Callable[[str], None]] = None) -> str:
+        """Recognize a WAV file-like object, reading it incrementally frame by frame"""
+        with wave.open(stream, 'rb') as wav:
+            sample_rate = wav.getframerate()
+            sample_width = wav.getsampwidth()
+            channels = wav.getnchannels()
+            frames_per_chunk = max(1, int(sample_rate * chunk_seconds))
+            chunks = iter(lambda: wav.readframes(frames_per_chunk), b'')
+            return self.transcribe_pcm_stream(chunks, sample_rate, sample_width, channels, on_partial)
+
+    @timed('nlp')
     def process_natural_language(self, text: str) -> Intent:
         """Enhanced NLP processing with context awareness"""
         text = text.lower().strip()
         
-        # Enhanced intent patterns with confidence scoring
-        intent_patterns = [
-            # Greetings with variations
-            (re.compile(r'\b(hello|hi|hey|good morning|good afternoon|good evening)\b'), IntentType.GREET, 0.9),
-            
-            # Time and date - more flexible patterns
-            (re.compile(r'\b(what\'s|what is|whats|what\'s the|what is the|tell me the)\s*(the\s*)?(time|current time)\b'), IntentType.TIME, 0.95),
-            (re.compile(r'\b(time|current time)\??\b'), IntentType.TIME, 0.8),
-            (re.compile(r'\b(what\'s|what is|whats|what\'s the|what is the|tell me the)\s*(the\s*)?(date|today\'s date)\b'), IntentType.DATE, 0.95),
-            (re.compile(r'\b(date|what date|today)\s*(is it|it is)?\??\b'), IntentType.DATE, 0.85),
-            
-            # Help and capabilities
-            (re.compile(r'\b(help|what can you do|capabilities)\b'), IntentType.HELP, 0.9),
-            
-            # Opening applications/websites
-            (re.compile(r'\bopen (.+)\b'), IntentType.OPEN, 0.8),
-            (re.compile(r'\blaunch (.+)\b'), IntentType.OPEN, 0.8),
-            
-            # Media and entertainment
-            (re.compile(r'\bplay (.+) on youtube\b'), IntentType.PLAY, 0.9),
-            (re.compile(r'\bplay (.+)\b'), IntentType.PLAY, 0.7),
-            
-            # Communication
-            (re.compile(r'\b(send|write) (an )?email\b'), IntentType.EMAIL, 0.9),
-            (re.compile(r'\bemail (.+)\b'), IntentType.EMAIL, 0.8),
-            
-            # Reminders and tasks
-            (re.compile(r'\b(remind me to|set a reminder for|create a reminder for)\b'), IntentType.REMINDER, 0.9),
-            (re.compile(r'\b(remind me|set reminder|set a reminder|create reminder|create a reminder|reminder)\b'), IntentType.REMINDER, 0.85),
-            
-            # Search and information
-            (re.compile(r'\bsearch for (.+)\b'), IntentType.SEARCH, 0.9),
-            (re.compile(r'\b(tell me about|tell me more about|what are|what is) (.+)\b'), IntentType.WIKI, 0.95),
-            (re.compile(r'\b(who is|who are) (.+)\b'), IntentType.WIKI, 0.95),
-            (re.compile(r'\bweather in (.+)\b'), IntentType.WEATHER, 0.9),
-            (re.compile(r'\bweather\b'), IntentType.WEATHER, 0.7),
-            
-            # News
-            (re.compile(r'\b(news|latest news|current events)\b'), IntentType.NEWS, 0.9),
-            
-            # Smart home
-            (re.compile(r'\b(turn on|turn off|switch) (.+)\b'), IntentType.SMART_HOME, 0.8),
-            (re.compile(r'\b(control|manage) (.+)\b'), IntentType.SMART_HOME, 0.7),
-            
-            # Calendar
-            (re.compile(r'\b(schedule|add to calendar|calendar)\b'), IntentType.CALENDAR, 0.8),
-            
-            # Notes
-            (re.compile(r'\b(note|remember|write down)\b'), IntentType.NOTE, 0.8),
-            
-            # Calculations
-            (re.compile(r'\b(calculate|compute|what is) (.+)\b'), IntentType.CALCULATE, 0.9),
-            
-            # Translation
-            (re.compile(r'\b(translate|how do you say)\b'), IntentType.TRANSLATE, 0.8),
-            
-            # Exit
-            (re.compile(r'\b(goodbye|exit|stop|quit)\b'), IntentType.EXIT, 0.9),
-        ]
+        # User-defined commands take precedence over the built-in patterns
+        if self.custom_commands:
+            command = self.custom_commands.match(text)
+            if command:
+                return Intent(IntentType.CUSTOM, 1.0, {'command_id': str(command.id)}, text)
         
-        best_intent = None
-        best_confidence = 0.0
+        if self.routines:
+            routine = self.routines.match(text)
+            if routine:
+                return Intent(IntentType.ROUTINE, 1.0, {'routine_id': str(routine.id)}, text)
         
-        for pattern, intent_type, confidence in intent_patterns:
-            match = pattern.search(text)
-            if match:
-                if confidence > best_confidence:
-                    best_confidence = confidence
-                    entities = {}
-                    
-                    # Extract entities based on intent type
-                    if intent_type == IntentType.OPEN:
-                        entities['target'] = match.group(1)
-                    elif intent_type == IntentType.PLAY:
-                        entities['query'] = match.group(1)
-                    elif intent_type == IntentType.SEARCH:
-                        entities['query'] = match.group(1)
-                    elif intent_type == IntentType.WIKI:
-                        entities['topic'] = match.group(2)
-                    elif intent_type == IntentType.WEATHER:
-                        if 'in' in text:
-                            entities['city'] = match.group(1)
-                    elif intent_type == IntentType.SMART_HOME:
-                        entities['action'] = match.group(1)
-                        entities['device'] = match.group(2)
-                    elif intent_type == IntentType.CALCULATE:
-                        entities['expression'] = match.group(2)
-                    
-                    best_intent = Intent(
-                        type=intent_type,
-                        confidence=confidence,
-                        entities=entities,
-                        raw_text=text
-                    )
+        best, scores = best_pattern(text)
+        if best is None:
+            return Intent(IntentType.GREET, FALLBACK_CONFIDENCE, {}, text, second_best(scores, None))
+        index, match, confidence = best
+        intent_type = INTENT_PATTERNS[index][1]
+        entities = {}
+        
+        # Extract entities based on intent type
+        if intent_type == IntentType.OPEN:
+            entities['target'] = match.group(1)
+        elif intent_type == IntentType.PLAY:
+            entities['query'] = match.group(1)
+        elif intent_type == IntentType.SEARCH:
+            entities['query'] = match.group(1)
+        elif intent_type == IntentType.WIKI:
+            entities['topic'] = match.group(2)
+        elif intent_type == IntentType.WEATHER:
+            if 'in' in text:
+                entities['city'] = match.group(1)
+        elif intent_type == IntentType.SMART_HOME:
+            entities['action'] = 'status' if match.group(1) in ('is', 'are') else match.group(1)
+            entities['device'] = match.group(2)
+        elif intent_type == IntentType.CALCULATE:
+            entities['expression'] = match.group(2)
+        elif intent_type == IntentType.REMINDER and match.group(0).endswith('reminders'):
+            entities['action'] = 'list'
         
-        return best_intent or Intent(IntentType.GREET, 0.1, {}, text)
+        return Intent(intent_type, confidence, entities, text, second_best(scores, intent_type))
+
+    def parse_intents(self, text: str) -> List[Intent]:
+        """One intent per request in a compound utterance, in spoken order.
+
+        The text is split on conjunctions, and a part only stands alone if it
+        is confidently a request of its own; anything else ("tobago" in "weather
+        in trinidad and tobago") is glued back onto its neighbour. Requests that
+        take free text, such as reminders, keep the rest of the sentence.
+        """
+        parts = COMPOUND_SPLIT_RE.split(text)
+        whole = self.process_natural_language(text)
+        if len(parts) == 1 or whole.type in (IntentType.CUSTOM, IntentType.ROUTINE):
+            return [whole]
+        
+        segments = []  # [text, intent]
+        prefix = ""
+        for i in range(0, len(parts), 2):
+            part = parts[i].strip()
+            joiner = parts[i - 1] if i else ""
+            if not part:
+                continue
+            if segments and segments[-1][1].type in FREE_TEXT_INTENTS:
+                segments[-1][0] += joiner + part
+                continue
+            intent = self.process_natural_language(prefix + part)
+            if intent.confidence >= MIN_SEGMENT_CONFIDENCE:
+                segments.append([prefix + part, intent])
+                prefix = ""
+            elif segments:
+                segments[-1][0] += joiner + part
+            else:
+                prefix += part + joiner
+        
+        if len(segments) < 2:
+            return [whole]
+        # Parts that absorbed their neighbours are classified again for their entities
+        return [intent if intent.raw_text == segment else self.process_natural_language(segment)
+                for segment, intent in segments]
+
+    def run_intents(self, intents: List[Intent], perform: Callable[[Intent], object]) -> List:
+        """Call ``perform`` for each intent, overlapping the ones that wait on the network.
 
+        Results come back in the order of ``intents``.
+        """
+        if len(intents) == 1:
+            return [perform(intents[0])]
+        turn_id = self.metrics.current_turn
+        deadline = request_deadline()
+        
+        def in_turn(intent):
+            with self.metrics.join_turn(turn_id), deadline_scope(deadline):
+                return perform(intent)
+        
+        # Each task runs in a copy of this context, so its log records keep the request's session
+        futures = {
+            i: self.intent_executor.submit(contextvars.copy_context().run, in_turn, intent)
+            for i, intent in enumerate(intents) if intent.type in CONCURRENT_INTENTS
+        }
+        results = [None if i in futures else perform(intent) for i, intent in enumerate(intents)]
+        for i, future in futures.items():
+            results[i] = future.result()
+        return results
+
+    def handle_intents(self, intents: List[Intent]):
+        """Handle every request in an utterance and say the replies as one response"""
+        if len(intents) == 1:
+            with self.recorded(intents[0]):
+                return self.handle_intent(intents[0])
+        
+        def perform(intent):
+            with self.collect_speech() as lines, self.recorded(intent):
+                done = self.handle_intent(intent)
+            return lines, done
+        
+        results = self.run_intents(intents, perform)
+        self.speak(" ".join(line for lines, _ in results for line in lines))
+        return any(done for _, done in results)
+
+    @timed('handler')
     def handle_intent(self, intent: Intent):
         """Enhanced intent handling with better error management"""
         try:
@@ -387,7 +1173,10 @@ class EnhancedVoiceAssistant:
             elif intent.type == IntentType.EMAIL:
                 self.handle_email()
             elif intent.type == IntentType.REMINDER:
-                self.handle_reminder()
+                if intent.entities.get('action') == 'list':
+                    self.speak(self.reminders_summary())
+                else:
+                    self.handle_reminder(intent.raw_text)
             elif intent.type == IntentType.SEARCH:
                 self.handle_search(intent.entities.get('query', ''))
             elif intent.type == IntentType.WIKI:
@@ -401,11 +1190,16 @@ class EnhancedVoiceAssistant:
             elif intent.type == IntentType.CALENDAR:
                 self.handle_calendar()
             elif intent.type == IntentType.NOTE:
-                self.handle_note()
+                self.handle_note(intent.raw_text)
             elif intent.type == IntentType.CALCULATE:
                 self.handle_calculate(intent.entities.get('expression', ''))
             elif intent.type == IntentType.TRANSLATE:
                 self.handle_translate()
+            elif intent.type == IntentType.CUSTOM:
+                self.handle_custom_command(int(intent.entities.get('command_id', 0)))
+            elif intent.type == IntentType.ROUTINE:
+                routine = self.routines.get(int(intent.entities.get('routine_id', 0))) if self.routines else None
+                self.speak(self.run_routine(routine, 'phrase') if routine else "I couldn't find that routine.")
             elif intent.type == IntentType.EXIT:
                 self.handle_exit()
             else:
@@ -526,47 +1320,26 @@ class EnhancedVoiceAssistant:
         self.speak(f"Searching YouTube for {query}")
 
     def handle_email(self):
-        """Enhanced email functionality"""
+        """Start the email dialog; recipient, subject and message arrive as follow-up turns"""
         if not SENDER_EMAIL or not SENDER_PASSWORD:
             self.speak("Email functionality is not configured. Please set your email credentials.")
             return
+        
+        self.speak(self.start_dialog('email'))
 
+    def _complete_email(self, slots: Dict) -> str:
         try:
-            contacts = self.load_contacts()
-            self.speak("To whom should I send the email?")
-            recipient_input = self.listen()
-            
-            if recipient_input == "none":
-                self.speak("I didn't catch the recipient. Cancelling email.")
-                return
-                
-            recipient = self.resolve_recipient(recipient_input, contacts)
-            if not recipient:
-                self.speak("I couldn't find that contact. Please try again.")
-                return
-            
-            self.speak("What should be the subject?")
-            subject = self.listen()
-            if subject == "none":
-                subject = "No Subject"
-            
-            self.speak("What's the message?")
-            body = self.listen()
-            if body == "none":
-                self.speak("I didn't catch the message. Cancelling email.")
-                return
-
-            self.send_email(recipient, subject, body)
-            self.speak("Email sent successfully!")
-            
-        except Exception as e:
+            self.send_email(slots['recipient'], slots['subject'], slots['body'])
+            return "Email sent successfully!"
+        except Exception:
             logging.exception("Email error")
-            self.speak("Sorry, I couldn't send the email.")
+            return "Sorry, I couldn't send the email."
 
     def send_email(self, recipient: str, subject: str, body: str):
         """Send email with enhanced error handling"""
+        import smtplib
         try:
-            with smtplib.SMTP('smtp.gmail.com', 587) as server:
+            with self.metrics.span('external_api', 'smtp'), smtplib.SMTP('smtp.gmail.com', 587) as server:
                 server.starttls()
                 server.login(SENDER_EMAIL, SENDER_PASSWORD)
                 
@@ -578,76 +1351,152 @@ class EnhancedVoiceAssistant:
         except Exception as e:
             raise Exception(f"Email sending failed: {str(e)}")
 
-    def handle_reminder(self):
-        """Enhanced reminder system with better time parsing and display"""
-        self.speak("What should I remind you about?")
-        reminder_text = self.listen()
+    def handle_reminder(self, text: str = ""):
+        """Reminder system that takes the task and time from a single utterance when it can"""
+        request = REMINDER_PREFIX_RE.sub('', text.lower(), count=1).strip()
+        
+        try:
+            recurring = parse_recurrence(request) if request else None
+        except RecurrenceError as e:
+            self.speak(f"{e}. Please try a different schedule.")
+            return
+        if recurring:
+            self.handle_recurring_reminder(*recurring)
+            return
         
-        if reminder_text == "none":
-            self.speak("I didn't catch that. Please try again.")
+        parsed = time_parser.parse_time_expression(request) if request else None
+        reminder_text = parsed.remainder if parsed else request
+        
+        # Only ask follow-up questions for whatever the utterance left out
+        if not reminder_text or not parsed:
+            slots = {}
+            if reminder_text:
+                slots['task'] = reminder_text
+            if parsed:
+                slots['when'] = parsed.due
+            self.speak(self.start_dialog('reminder', slots=slots))
             return
         
-        self.speak("In how many minutes?")
-        time_input = self.listen().lower()
+        self.speak(self._complete_reminder({'task': reminder_text, 'when': parsed.due}))
+
+    def handle_recurring_reminder(self, rule: RecurrenceRule, reminder_text: str):
+        """Set up a repeating reminder such as "every weekday at 8 am" """
+        if not reminder_text:
+            self.speak(self.start_dialog('reminder', slots={'rule': rule, 'when': rule}))
+            return
         
+        self.speak(self._complete_reminder({'task': reminder_text, 'when': rule, 'rule': rule}))
+
+    def _parse_reminder_task(self, text: str, slots: Dict):
+        """A task answer may carry the time too ("call mom at 5")"""
+        task = REMINDER_PREFIX_RE.sub('', text.lower(), count=1).strip()
+        if 'when' not in slots:
+            parsed = time_parser.parse_time_expression(task)
+            if parsed and parsed.remainder:
+                slots['when'] = parsed.due
+                task = parsed.remainder
+        return task or None
+
+    def _parse_reminder_time(self, text: str, slots: Dict):
+        logging.info(f"Parsing time input: '{text}'")
         try:
-            # Enhanced time parsing with debug logging
-            minutes = 0
-            logging.info(f"Parsing time input: '{time_input}'")
-            
-            # First try to extract any numbers
-            numbers = re.findall(r'\d+', time_input)
-            if numbers:
-                minutes = int(numbers[0])
-                logging.info(f"Found number in input: {minutes}")
-            else:
-                # If no numbers found, try word matching
-                time_words = {
-                    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
-                    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10
-                }
-                
-                for word, value in time_words.items():
-                    if word in time_input:
-                        minutes = value
-                        logging.info(f"Matched word number: {word} = {minutes}")
-                        break
-            
-            if minutes > 0:
-                # Calculate exact due time
-                delay_seconds = minutes * 60
-                due = time.time() + delay_seconds
-                reminder_id = str(uuid.uuid4())
-                
-                # Format the due time for display
-                due_time = datetime.datetime.fromtimestamp(due).strftime('%H:%M:%S')
-                
-                # Create and store the reminder
-                self.reminders.append((due, reminder_text, reminder_id))
-                
-                # Display confirmation in terminal
-                print("\n" + "-"*50)
-                print(f"📝 New Reminder Set:")
-                print(f"Task: {reminder_text}")
-                print(f"Due at: {due_time} ({minutes} minute{'s' if minutes != 1 else ''})")
-                print("-"*50 + "\n")
-                
-                # Log the scheduled reminder
-                logging.info(f"Scheduled reminder {reminder_id} for {due_time}: {reminder_text}")
-                
-                # Speak confirmation
-                self.speak(f"Okay, I'll remind you to {reminder_text} in {minutes} minute{'s' if minutes != 1 else ''}.")
+            recurring = parse_recurrence(text.lower())
+        except RecurrenceError as e:
+            raise Reprompt(f"{e}. How often should I remind you?")
+        if recurring:
+            slots['rule'] = recurring[0]
+            return recurring[0]
+        parsed = time_parser.parse_time_expression(text.lower(), default_unit='minutes')
+        if not parsed:
+            raise Reprompt("I didn't understand the time. Try something like 'in 10 minutes' or 'at 6 pm'.")
+        if self.past_due_reply(parsed.due):
+            raise Reprompt("That time has already passed. When should I remind you?")
+        return parsed.due
+
+    @staticmethod
+    def past_due_reply(due_at: datetime.datetime) -> Optional[str]:
+        """The reply when a one-off reminder time has already passed, otherwise None"""
+        if due_at.timestamp() <= time.time():
+            return "That time has already passed. Please give me a time in the future."
+        return None
+
+    def _complete_reminder(self, slots: Dict) -> str:
+        """Schedule a reminder from filled slots and return the confirmation"""
+        reminder_text = slots['task']
+        rule = slots.get('rule')
+        if rule:
+            first_due = rule.next_after(time.time())
+            if first_due is None:
+                return "That schedule never comes up. Please try a different one."
+            reminder_id = self.schedule_reminder(first_due, reminder_text, rule)
+            first_time = datetime.datetime.fromtimestamp(first_due).strftime('%Y-%m-%d %H:%M:%S')
+            logging.info(f"Scheduled recurring reminder {reminder_id} ({rule.description}), first at {first_time}: {reminder_text}")
+            return f"Okay, I'll remind you to {reminder_text} {rule.description}."
+        
+        due_at = slots['when']
+        passed = self.past_due_reply(due_at)
+        if passed:
+            return passed
+        
+        reminder_id = self.schedule_reminder(due_at.timestamp(), reminder_text)
+        
+        # Format the due time for display
+        due_time = due_at.strftime('%Y-%m-%d %H:%M:%S')
+        when = time_parser.describe_due(due_at)
+        
+        # Display confirmation in terminal
+        print("\n" + "-"*50)
+        print(f"📝 New Reminder Set:")
+        print(f"Task: {reminder_text}")
+        print(f"Due at: {due_time} ({when})")
+        print("-"*50 + "\n")
+        
+        # Log the scheduled reminder
+        logging.info(f"Scheduled reminder {reminder_id} for {due_time}: {reminder_text}")
+        return f"Okay, I'll remind you to {reminder_text} {when}."
+
+    def reminders_summary(self, within: float = 86400, limit: int = 5) -> str:
+        """Spoken list of the next few reminders due within ``within`` seconds"""
+        horizon = time.time() + within
+        with self.reminder_lock:
+            upcoming = self.reminders.upcoming(limit, horizon)
+        
+        if not upcoming:
+            return "You have no reminders coming up."
+        items = [f"{text} {time_parser.describe_due(datetime.datetime.fromtimestamp(due))}" for due, text, _ in upcoming]
+        return f"You have {len(upcoming)} reminder{'s' if len(upcoming) != 1 else ''} coming up: {'; '.join(items)}."
+
+    def schedule_reminder(self, due: float, text: str, rule: Optional[RecurrenceRule] = None) -> int:
+        """Queue a reminder for the monitor thread and return its id.
+
+        With a recurrence rule, ``due`` is the first occurrence and the monitor
+        computes each following one as the previous fires.
+        """
+        return self.schedule_reminders([(due, text, rule)])[0]
+
+    def schedule_reminders(self, items: List[Tuple[float, str, Optional[RecurrenceRule]]]) -> List[int]:
+        """Queue many (due, text, rule) reminders at once; a large batch rebuilds the queue with one sort"""
+        reminder_ids = list(itertools.islice(self._reminder_ids, len(items)))
+        
+        with self.reminder_lock:
+            for (_, _, rule), reminder_id in zip(items, reminder_ids):
+                if rule:
+                    self.reminder_series[reminder_id] = rule
+            if len(items) == 1:
+                due, text, _ = items[0]
+                self.reminders.push(due, text, reminder_ids[0])
             else:
-                self.speak("Please provide a positive number of minutes.")
-                
-        except (ValueError, IndexError) as e:
-            logging.error(f"Error parsing reminder time: {str(e)}")
-            self.speak("I didn't understand the time. Please say a number of minutes.")
+                self.reminders.extend((due, text, reminder_id)
+                                      for (due, text, _), reminder_id in zip(items, reminder_ids))
+        
+        # The monitor thread only starts once there is something to watch
+        self.subsystems.get('reminder_monitor')
+        return reminder_ids
 
     def _start_reminder_monitor(self):
         """Start a daemon thread that monitors due reminders and fires them."""
         if self._reminder_thread and self._reminder_thread.is_alive():
-            return
+            return self._reminder_thread
 
         def monitor():
             logging.info("Reminder monitor started")
@@ -655,28 +1504,31 @@ class EnhancedVoiceAssistant:
                 try:
                     now = time.time()
                     due_items = []
-                    remaining_reminders = []
-                    
-                    # Thread-safe copy of current reminders and sort by due time
-                    current_reminders = sorted(list(self.reminders), key=lambda x: x[0])
                     
-                    # Check which reminders are due
-                    for reminder in current_reminders:
-                        due_time, text, rid = reminder
-                        time_diff = due_time - now
-                        
-                        # Consider a reminder due if it's within 0.5 seconds of its target time
-                        if time_diff <= 0.5:
-                            due_items.append(reminder)
+                    # Pop everything due off the heap; the rest stays untouched
+                    with self.reminder_lock:
+                        while self.reminders:
+                            due_time, text, rid = self.reminders.peek()
+                            time_diff = due_time - now
+                            
+                            # Consider a reminder due if it's within 0.5 seconds of its target time
+                            if time_diff > 0.5:
+                                if time_diff < 10:  # Log the next upcoming reminder
+                                    logging.info(f"Reminder {rid} coming up in {time_diff:.2f} seconds")
+                                break
+                            
+                            self.reminders.pop()
+                            due_items.append((due_time, text, rid))
                             logging.info(f"Reminder {rid} is due (time_diff: {time_diff:.2f}s)")
-                        else:
-                            remaining_reminders.append(reminder)
-                            if time_diff < 10:  # Log upcoming reminders
-                                logging.info(f"Reminder {rid} coming up in {time_diff:.2f} seconds")
-                    
-                    # Update reminders list atomically
-                    if due_items:
-                        self.reminders = remaining_reminders
+                            
+                            # Recurring series only ever hold their next occurrence
+                            rule = self.reminder_series.get(rid)
+                            if rule:
+                                next_due = rule.next_after(max(due_time, now))
+                                if next_due is not None:
+                                    self.reminders.push(next_due, text, rid)
+                                else:
+                                    del self.reminder_series[rid]
 
                     # Fire due reminders
                     for due_ts, text, rid in due_items:
@@ -708,6 +1560,7 @@ class EnhancedVoiceAssistant:
         t = threading.Thread(target=monitor, daemon=True)
         t.start()
         self._reminder_thread = t
+        return t
 
     def handle_search(self, query: str):
         """Enhanced web search"""
@@ -725,55 +1578,88 @@ class EnhancedVoiceAssistant:
             self.speak("What would you like to know about?")
             return
         
+        import wikipedia
         try:
             self.speak(f"Searching Wikipedia for {topic}...")
-            result = wikipedia.summary(topic, sentences=3)
+            with self.upstream('wikipedia', (OSError, wikipedia.exceptions.HTTPTimeoutError)), \
+                    self.metrics.span('external_api', 'wikipedia'):
+                result = wikipedia.summary(topic, sentences=3)
+            self.remember('wikipedia', topic, result)
             self.speak("According to Wikipedia...")
             self.speak(result)
+            return
         except wikipedia.exceptions.DisambiguationError:
             self.speak(f"Multiple results found for {topic}. Please be more specific.")
+            return
         except wikipedia.exceptions.PageError:
             self.speak(f"Sorry, I couldn't find information about {topic}.")
+            return
+        except Overloaded:
+            raise
+        except CircuitOpen:
+            pass
         except Exception as e:
             logging.exception("Wikipedia error")
-            self.speak("An error occurred while searching Wikipedia.")
+        
+        self.speak(self.wiki_fallback(topic))
+
+    def wiki_fallback(self, topic: str) -> str:
+        """An earlier summary of ``topic``, while Wikipedia is down"""
+        last = self.recall('wikipedia', topic)
+        if last:
+            return f"Wikipedia isn't responding, but here is what I found earlier: {last[0]}"
+        return "Wikipedia isn't responding right now. Please try again in a minute."
 
     def handle_weather(self, city: str = ""):
         """Enhanced weather functionality"""
         if not city:
-            city = self.get_current_city()
+            city = self.preference('default_city') or self.get_current_city()
             if city:
                 self.speak(f"Getting weather for your location: {city}")
             else:
-                self.speak("Which city's weather would you like to know?")
-                city_input = self.listen()
-                if city_input != "none":
-                    city = city_input
-                else:
-                    return
+                self.speak(self.start_dialog('weather'))
+                return
         
+        self.speak(self.weather_report(city))
+
+    def weather_report(self, city: str) -> str:
+        """Current conditions for a city as a sentence"""
         if not OPENWEATHER_API_KEY:
-            self.speak("Weather service is not configured.")
-            return
+            return "Weather service is not configured."
         
+        import requests
         try:
-            url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={OPENWEATHER_API_KEY}&units=metric"
-            response = requests.get(url, timeout=10)
-            data = response.json()
+            url = f"{OPENWEATHER_URL}?q={city}&appid={OPENWEATHER_API_KEY}&units=metric"
+            with self.upstream('openweathermap'), self.metrics.span('external_api', 'openweathermap'):
+                response = requests.get(url, timeout=self.upstream_timeout('openweathermap', 10))
+                check_upstream_status(response)
+                data = response.json()
             
             if data["cod"] != "404":
                 temp = data["main"]["temp"]
                 description = data["weather"][0]["description"]
                 humidity = data["main"]["humidity"]
                 
-                weather_report = f"The weather in {city} is {description} with a temperature of {temp}°C and humidity of {humidity}%"
-                self.speak(weather_report)
-            else:
-                self.speak(f"Sorry, I couldn't find weather data for {city}")
-                
+                report = f"The weather in {city} is {description} with a temperature of {temp}°C and humidity of {humidity}%"
+                self.remember('openweathermap', city, report)
+                return report
+            return f"Sorry, I couldn't find weather data for {city}"
+        
+        except Overloaded:
+            raise
+        except CircuitOpen:
+            pass
         except Exception as e:
             logging.exception("Weather error")
-            self.speak("I couldn't get the weather information right now.")
+        return self.weather_fallback(city)
+
+    def weather_fallback(self, city: str) -> str:
+        """The last weather report for ``city`` with its age, while the weather service is down"""
+        last = self.recall('openweathermap', city)
+        if last:
+            report, age = last
+            return f"{report}, as of {describe_age(age)} ago. The weather service isn't responding right now."
+        return "I couldn't get the weather information right now."
 
     def handle_news(self):
         """Get latest news headlines"""
@@ -781,45 +1667,88 @@ class EnhancedVoiceAssistant:
             self.speak("News service is not configured.")
             return
         
+        import requests
         try:
-            url = f"https://newsapi.org/v2/top-headlines?country=us&apiKey={NEWS_API_KEY}"
-            response = requests.get(url, timeout=10)
-            data = response.json()
+            url = f"{NEWS_API_URL}?country=us&apiKey={NEWS_API_KEY}"
+            with self.upstream('newsapi'), self.metrics.span('external_api', 'newsapi'):
+                response = requests.get(url, timeout=self.upstream_timeout('newsapi', 10))
+                check_upstream_status(response)
+                data = response.json()
             
             if data["status"] == "ok":
-                articles = data["articles"][:5]  # Top 5 headlines
+                titles = [article['title'] for article in data["articles"][:5]]  # Top 5 headlines
+                self.remember('newsapi', 'top-headlines', titles)
                 self.speak("Here are the latest news headlines:")
-                for i, article in enumerate(articles, 1):
-                    self.speak(f"{i}. {article['title']}")
+                for i, title in enumerate(titles, 1):
+                    self.speak(f"{i}. {title}")
             else:
                 self.speak("Sorry, I couldn't fetch the news right now.")
-                
+            return
+        
+        except Overloaded:
+            raise
+        except CircuitOpen:
+            pass
         except Exception as e:
             logging.exception("News error")
+        
+        last = self.recall('newsapi', 'top-headlines')
+        if last:
+            titles, age = last
+            self.speak(f"The news service isn't responding, so these headlines are from {describe_age(age)} ago:")
+            for i, title in enumerate(titles, 1):
+                self.speak(f"{i}. {title}")
+        else:
             self.speak("I couldn't get the news right now.")
 
     def handle_smart_home(self, action: str, device: str):
         """Smart home device control"""
-        if not SMART_HOME_API_KEY:
+        if not self.smart_home:
             self.speak("Smart home integration is not configured.")
             return
         
-        # This would integrate with actual smart home APIs like Philips Hue, SmartThings, etc.
-        self.speak(f"I would {action} the {device}, but smart home integration needs to be configured.")
+        self.speak(self.smart_home_reply(action, device))
+
+    def smart_home_reply(self, action: str, device: str, session_id: Optional[str] = None) -> str:
+        """Run a device command; "Which light…?" starts a follow-up that finishes it"""
+        def ask(action, phrase, choices):
+            return self.start_dialog('device', session_id, slots={'action': action, 'choices': choices},
+                                     answers={'device': phrase})
+        return self.smart_home.handle(action, device, ask)
+
+    def _parse_device_choice(self, text: str, slots: Dict):
+        try:
+            device = smart_home_integration.DeviceRegistry.choose(text, slots['choices'])
+        except smart_home_integration.AmbiguousDevice as e:
+            slots['choices'] = e
+            raise Reprompt(str(e))
+        if device is None:
+            raise Reprompt(str(slots['choices']))
+        return device
+
+    def _complete_device(self, slots: Dict) -> str:
+        device = slots['device']
+        return self.smart_home.apply(slots['action'], [device], device.name)
 
     def handle_calendar(self):
         """Calendar management"""
         self.speak("Calendar functionality is coming soon. I can help you set reminders for now.")
 
-    def handle_note(self):
+    def handle_note(self, text: str = ""):
         """Note taking functionality"""
-        self.speak("What would you like me to remember?")
-        note_text = self.listen()
-        
-        if note_text != "none":
-            # Save to database
-            self.save_note(note_text)
-            self.speak("I've saved that note for you.")
+        self.speak(self.note_reply(text))
+
+    def note_reply(self, text: str, session_id: Optional[str] = None) -> str:
+        """Save the note in "note that ..." right away, otherwise ask what to write down"""
+        note_text = NOTE_PREFIX_RE.sub('', text.lower(), count=1).strip()
+        if note_text:
+            return self._complete_note({'text': note_text})
+        return self.start_dialog('note', session_id)
+
+    def _complete_note(self, slots: Dict) -> str:
+        # Save to database
+        self.save_note(slots['text'])
+        return "I've saved that note for you."
 
     def handle_calculate(self, expression: str):
         """Mathematical calculations"""
@@ -828,12 +1757,131 @@ class EnhancedVoiceAssistant:
             return
         
         try:
-            # Safe evaluation of mathematical expressions
-            result = eval(expression.replace("plus", "+").replace("minus", "-").replace("times", "*").replace("divided by", "/"))
-            self.speak(f"The result is {result}")
-        except Exception as e:
+            result = calculator.evaluate(expression)
+            self.speak(f"The result is {calculator.format_result(result)}")
+        except calculator.CalculationError as e:
+            logging.info(f"Could not calculate '{expression}': {e}")
             self.speak("I couldn't calculate that expression. Please try a simpler one.")
 
+    def handle_custom_command(self, command_id: int):
+        """Run a user-defined command: speak text, open a URL or play a macro of other commands"""
+        command = self.custom_commands.get(command_id) if self.custom_commands else None
+        if not command:
+            self.handle_unknown()
+            return
+        
+        if command.action == 'speak':
+            self.speak(command.parameters['text'])
+        elif command.action == 'open_url':
+            url = command.parameters['url']
+            webbrowser.open(url if url.startswith("http") else f"https://{url}")
+            self.speak(f"Opening {command.parameters.get('name', url)}")
+        elif command.action == 'macro':
+            depth = getattr(self._macro, 'depth', 0)
+            if depth >= MAX_MACRO_DEPTH:
+                logging.warning(f"Custom command {command_id} exceeded macro depth")
+                self.speak("That command calls itself too many times.")
+                return
+            self._macro.depth = depth + 1
+            try:
+                for step in command.parameters['steps']:
+                    if isinstance(step, dict):
+                        step_intent = Intent(IntentType(step['intent']), 1.0, step.get('entities', {}), '')
+                    else:
+                        step_intent = self.process_natural_language(step)
+                    self.handle_intent(step_intent)
+            finally:
+                self._macro.depth = depth
+
+    def _routine_intents(self, routine) -> List[Intent]:
+        """Intents for a routine's steps; a step may itself be a compound utterance"""
+        intents = []
+        for step in routine.steps:
+            if isinstance(step, dict):
+                try:
+                    intents.append(Intent(IntentType(step['intent']), 1.0, step.get('entities', {}), step.get('text', '')))
+                except (KeyError, ValueError):
+                    logging.warning(f"Routine {routine.id} has an unknown step: {step}")
+            else:
+                intents.extend(self.parse_intents(step))
+        # Routines don't start other routines
+        return [intent for intent in intents if intent.type != IntentType.ROUTINE]
+
+    def spoken_reply(self, intent: Intent) -> str:
+        """What handling ``intent`` would say, without saying it"""
+        with self.collect_speech() as lines:
+            self.handle_intent(intent)
+        return " ".join(lines)
+
+    def can_speculate(self, intent: Intent) -> bool:
+        """Whether ``intent`` can be fetched before the user finishes: online and nothing left to ask"""
+        if intent.type not in PREFETCH_INTENTS:
+            return False
+        if intent.type == IntentType.WEATHER:
+            return bool(intent.entities.get('city'))
+        if intent.type == IntentType.WIKI:
+            return bool(intent.entities.get('topic'))
+        return True
+
+    def prefetch_routine(self, routine) -> int:
+        """Fetch the replies of a routine's online steps ahead of its run; returns how many"""
+        intents = self._routine_intents(routine)
+        positions = [i for i, intent in enumerate(intents) if intent.type in PREFETCH_INTENTS]
+        start = time.perf_counter()
+        replies = self.run_intents([intents[i] for i in positions], self.spoken_reply) if positions else []
+        with self._routine_prefetch_lock:
+            self._routine_prefetch[routine.id] = (time.time(), dict(zip(positions, replies)))
+        logging.info(f"Prefetched {len(positions)} steps of routine '{routine.name}' in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return len(positions)
+
+    def run_routine(self, routine, source: str = 'phrase', perform: Optional[Callable[[Intent], str]] = None) -> str:
+        """Run every step of a routine and return the combined reply.
+
+        Online steps run concurrently, and steps fetched ahead of a scheduled run
+        are answered from that. ``perform`` turns one intent into reply text
+        (the web app passes its own). The end-to-end time is stored in
+        routine_runs.
+        """
+        perform = perform or self.spoken_reply
+        started_at = time.time()
+        start = time.perf_counter()
+        intents = self._routine_intents(routine)
+        
+        with self._routine_prefetch_lock:
+            fetched_at, prefetched = self._routine_prefetch.pop(routine.id, (0.0, {}))
+        if started_at - fetched_at > ROUTINE_PREFETCH_MAX_AGE:
+            prefetched = {}
+        positions = {id(intent): i for i, intent in enumerate(intents)}
+        failures = []
+        
+        def perform_step(intent):
+            reply = prefetched.get(positions[id(intent)])
+            if reply is not None:
+                return reply
+            try:
+                return perform(intent)
+            except Exception:
+                logging.exception(f"Routine '{routine.name}' step {intent.type.value} failed")
+                failures.append(intent)
+                return None
+        
+        with self.metrics.span('routine', routine.name):
+            replies = self.run_intents(intents, perform_step)
+        duration_ms = (time.perf_counter() - start) * 1000
+        
+        if self.routines:
+            self.routines.record_run(routine.id, started_at, duration_ms, source, len(prefetched), len(failures))
+        logging.info(f"Routine '{routine.name}' ran {len(intents)} steps in {duration_ms:.0f} ms "
+                     f"({source}, {len(prefetched)} prefetched)")
+        return "\n".join(reply for reply in replies if reply)
+
+    def _run_scheduled_routine(self, routine):
+        with self.metrics.turn():
+            reply = self.run_routine(routine, 'schedule')
+        # Use the speak lock to avoid concurrent TTS calls
+        with self.speak_lock:
+            self.speak(reply)
+
     def handle_translate(self):
         """Translation functionality"""
         self.speak("Translation functionality is coming soon.")
@@ -848,16 +1896,27 @@ class EnhancedVoiceAssistant:
         self.speak("I didn't understand that. You can say 'help' to see what I can do.")
 
     def get_current_city(self):
-        """Get current city using IP geolocation"""
+        """Get current city using IP geolocation, reusing a lookup made in the last LOCATION_MAX_AGE seconds"""
+        recent = self.fallbacks.get(('ip-api', 'city'), LOCATION_MAX_AGE)
+        if recent:
+            return recent[0]
+        import requests
         try:
-            response = requests.get("http://ip-api.com/json/", timeout=5)
-            data = response.json()
-            return data.get("city")
+            # A lookup that is refused (Overloaded, CircuitOpen) falls back to an older one or asking for the city
+            with self.upstream('ip-api'), self.metrics.span('external_api', 'ip-api'):
+                response = requests.get(GEOLOCATION_URL, timeout=self.upstream_timeout('ip-api', 5))
+                check_upstream_status(response)
+                data = response.json()
+            city = data.get("city")
+            if city:
+                self.remember('ip-api', 'city', city)
+            return city
         except Exception:
-            return None
+            last = self.recall('ip-api', 'city')
+            return last[0] if last else None
 
     def load_contacts(self):
-        """Load contacts from database or environment"""
+        """Contacts from CONTACTS_JSON (or the defaults) used to seed the contacts table"""
         if CONTACTS_JSON:
             try:
                 return json.loads(CONTACTS_JSON)
@@ -869,41 +1928,65 @@ class EnhancedVoiceAssistant:
             "self": SENDER_EMAIL,
         }
 
-    def resolve_recipient(self, said: str, contacts: dict):
-        """Resolve spoken name to email address"""
-        said = said.lower()
+    def resolve_recipient(self, said: str, slots: Optional[Dict] = None):
+        """Resolve a spoken name to an email address (recipient slot parser).
+
+        A near match is offered back as "Did you mean ...?" and the suggestion is
+        kept in the dialog slots until the next answer confirms or rejects it.
+        """
+        slots = slots if slots is not None else {}
+        said = said.lower().strip()
+        
+        suggestion = slots.pop('_suggestion', None)
+        if suggestion:
+            words = said.split()
+            if any(word in words for word in YES_WORDS):
+                return suggestion.email
+            if any(word in words for word in NO_WORDS) and len(words) <= 2:
+                raise Reprompt("Okay. Who should I send it to?")
         
         # Check if it's already an email
         if "@" in said and "." in said:
             return said
         
-        # Check contacts
-        if said in contacts:
-            return contacts[said]
-        
         # Remove common prefixes
         if said.startswith("to "):
             said = said[3:]
-            if said in contacts:
-                return contacts[said]
         
-        return None
+        if not self.contacts:
+            email = self.load_contacts().get(said)
+            if email:
+                return email
+            raise Reprompt("I couldn't find that contact. Who should I send it to?")
+        
+        contact, ranked = self.contacts.resolve(said)
+        if contact:
+            return contact.email
+        
+        # Close but not certain: confirm instead of failing outright
+        if ranked and ranked[0][1] >= SUGGEST_THRESHOLD:
+            slots['_suggestion'] = ranked[0][0]
+            raise Reprompt(f"Did you mean {ranked[0][0].name.title()}?")
+        raise Reprompt("I couldn't find that contact. Who should I send it to?")
 
     def save_note(self, note_text: str):
         """Save note to database"""
         try:
-            cursor = self.db_connection.cursor()
-            cursor.execute(
-                "INSERT INTO conversations (user_id, session_id, message, intent) VALUES (?, ?, ?, ?)",
-                (self.user_context.user_id, self.user_context.session_id, note_text, "note")
-            )
-            self.db_connection.commit()
+            with self.db_lock:
+                cursor = self.db_connection.cursor()
+                cursor.execute(
+                    "INSERT INTO conversations (user_id, session_id, message, intent) VALUES (?, ?, ?, ?)",
+                    (self.user_context.user_id, self.user_context.session_id, note_text, "note")
+                )
+                self.db_connection.commit()
         except Exception as e:
             logging.error(f"Error saving note: {e}")
 
     def run(self):
         """Main assistant loop"""
         self.speak("Hello! I'm your advanced voice assistant. How can I help you today?")
+        # Stored settings (e.g. a custom wake word) apply from the first turn
+        self.subsystems.get('preferences')
         
         none_count = 0
         while True:
@@ -912,7 +1995,8 @@ class EnhancedVoiceAssistant:
                 
                 if command == "none":
                     none_count += 1
-                    if TEXT_FALLBACK_ENABLED and none_count >= 2:
+                    # Straight to typing while the speech service's circuit is open
+                    if TEXT_FALLBACK_ENABLED and (none_count >= 2 or not self.service_available('google-speech')):
                         try:
                             typed = input("Type your command: ").strip().lower()
                             command = typed if typed else "none"
@@ -924,19 +2008,28 @@ class EnhancedVoiceAssistant:
                 else:
                     none_count = 0
                 
+                # Answers to a pending question don't need the wake word
+                if self.dialogs.active(self.user_context.session_id):
+                    with self.metrics.turn():
+                        reply = self.continue_dialog(command.replace(self.wake_word, "").strip())
+                    if reply is not None:
+                        self.speak(reply)
+                        continue
+                
                 # Wake word handling
-                if WAKE_MODE_ENABLED and WAKE_WORD not in command:
+                if self.wake_mode and self.wake_word not in command:
                     continue
                 
-                if WAKE_MODE_ENABLED:
-                    command = command.replace(WAKE_WORD, "").strip()
+                if self.wake_mode:
+                    command = command.replace(self.wake_word, "").strip()
                 
-                # Process natural language
-                intent = self.process_natural_language(command)
-                
-                # Handle intent
-                if self.handle_intent(intent):
-                    break
+                with self.metrics.turn():
+                    # Process natural language; "X and Y" yields one intent per request
+                    intents = self.parse_intents(command)
+                    
+                    # Handle intents
+                    if self.handle_intents(intents):
+                        break
                     
             except KeyboardInterrupt:
                 self.speak("Goodbye!")
@@ -945,6 +2038,147 @@ class EnhancedVoiceAssistant:
                 logging.exception("Main loop error")
                 self.speak("I encountered an error. Please try again.")
 
-if __name__ == "__main__":
+    def disable_audio(self):
+        """Run without microphone or speaker: the TTS engine and recognizer are never created"""
+        self.subsystems['tts'].set(None)
+        self.subsystems['recognizer'].set(None)
+
+    def reply_to_text(self, text: str) -> Dict:
+        """Handle one typed utterance and return what would have been said, as plain data"""
+        start = time.perf_counter()
+        intents = []
+        done = False
+        with self.metrics.turn(), self.collect_speech() as lines:
+            reply = self.continue_dialog(text)
+            if reply is not None:
+                lines.append(reply)
+            else:
+                intents = self.parse_intents(text)
+                done = bool(self.handle_intents(intents)) or any(i.type == IntentType.EXIT for i in intents)
+        return {
+            'reply': " ".join(lines),
+            'intents': [{'type': i.type.value, 'confidence': i.confidence, 'entities': i.entities} for i in intents],
+            'dialog': self.dialogs.pending_slot(self.user_context.session_id),
+            'exit': done,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 3),
+        }
+
+    def answer_request(self, message: Dict) -> Dict:
+        """The output record for one text-mode request (see read_text_line): its id, text and reply or error"""
+        record = {'id': message['id']} if 'id' in message else {}
+        if 'error' in message:
+            record['error'] = message['error']
+            return record
+        text = str(message.get('text', '')).strip()
+        if not text:
+            record['error'] = "No text provided"
+            return record
+        record['text'] = text
+        try:
+            record.update(self.reply_to_text(text.lower()))
+        except Exception as e:
+            logging.exception(f"Text mode error for {text!r}")
+            record['error'] = str(e)
+        return record
+
+    def run_text(self, lines, out, stop_on_exit: bool = False, prompt: str = "") -> int:
+        """Answer utterances from ``lines`` with one JSON object per line on ``out``.
+
+        A line is either plain text or a JSON object with ``text`` and an
+        optional ``id`` that is echoed back. Returns how many lines were handled.
+        """
+        handled = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            record = self.answer_request(read_text_line(line))
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            handled += 1
+            if stop_on_exit and record.get('exit'):
+                break
+            if prompt:
+                sys.stderr.write(prompt)
+                sys.stderr.flush()
+        return handled
+
+    def replay_text(self, lines, out, processes: int) -> int:
+        """Like run_text for a whole batch, answered on ``processes`` worker processes.
+
+        Requests are independent unless they share a ``session_id``, so a
+        follow-up answer only reaches its question when both carry the same one.
+        """
+        from workers import WorkerPool
+        
+        messages = [read_text_line(line) for line in lines if line.strip()]
+        pool = WorkerPool(processes)
+        try:
+            records = pool.replay(messages, self.schedule_reminders)
+        finally:
+            pool.close()
+        for record in records:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        return len(records)
+
+
+def read_text_line(line: str) -> Dict:
+    """One line of text-mode input as a request: {'text': line}, the JSON object it holds, or {'error': ...}"""
+    line = line.strip()
+    if not line.startswith('{'):
+        return {'text': line}
+    try:
+        message = json.loads(line)
+    except ValueError as e:
+        return {'error': f"Invalid JSON: {e}"}
+    return message
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Voice assistant. Without options, listens on the microphone "
+                                                 "(or reads utterances from stdin when it is a pipe).")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--text', action='store_true', help='type utterances instead of speaking them')
+    mode.add_argument('--batch', metavar='FILE', help="answer the utterances in FILE ('-' for stdin) and exit")
+    parser.add_argument('--workers', type=int, default=0, metavar='N',
+                        help='answer a batch on N worker processes; lines are then independent unless they '
+                             'share a session_id')
+    args = parser.parse_args(argv)
+    
+    batch = args.batch or (None if args.text or sys.stdin.isatty() else '-')
+    if args.workers and not batch:
+        parser.error("--workers needs a batch (--batch FILE or utterances piped to stdin)")
     assistant = EnhancedVoiceAssistant()
-    assistant.run()
+    try:
+        if not (args.text or batch):
+            assistant.run()
+            return
+        
+        assistant.disable_audio()
+        # JSON lines own stdout; anything else printed (e.g. reminders firing) goes to stderr
+        out = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            if args.text:
+                prompt = "> " if sys.stdin.isatty() else ""
+                sys.stderr.write(prompt)
+                sys.stderr.flush()
+                assistant.run_text(sys.stdin, out, stop_on_exit=True, prompt=prompt)
+                return
+            
+            def answer(lines):
+                if args.workers:
+                    return assistant.replay_text(lines, out, args.workers)
+                return assistant.run_text(lines, out)
+            
+            if batch == '-':
+                answer(sys.stdin)
+            else:
+                with open(batch, encoding='utf-8') as f:
+                    answer(f)
+    finally:
+        # Counts still waiting for the background writers would be lost at exit
+        assistant.save_counts()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Conversation history packed into a single buffer.
+
+Entries used to be ``"User: ..."`` / ``"Assistant: ..."`` strings in a list.
+Each one was a str object, with about 50 bytes of header plus the prefix,
+on top of the text. ``ConversationHistory`` stores the UTF-8 text of every
+entry in one bytearray, with an ``array`` of end offsets and a one-byte role
+code per entry. That is about 9 bytes plus the text. Only the newest
+``capacity`` entries are kept.
+"""
+import threading
+from array import array
+from typing import Iterator, List, Optional, Tuple
+
+USER = 0
+ASSISTANT = 1
+ROLE_NAMES = ('User', 'Assistant')
+
+
+class ConversationHistory:
+    """The newest ``capacity`` (role, text) entries; indexing and slicing give "Role: text" strings"""
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = max(1, capacity)
+        self._data = bytearray()
+        self._ends = array('q')
+        self._roles = array('b')
+        # Entries before this index have been dropped but not yet compacted away
+        self._first = 0
+        self._lock = threading.Lock()
+
+    def add(self, role: int, text: str):
+        with self._lock:
+            self._data += text.encode('utf-8')
+            self._ends.append(len(self._data))
+            self._roles.append(role)
+            if len(self._ends) - self._first > self.capacity:
+                self._first += 1
+                # Compact in batches so dropping old entries costs O(1) per entry on average
+                if self._first >= max(1024, self.capacity // 4):
+                    self._compact()
+
+    def _compact(self):
+        cut = self._ends[self._first - 1]
+        del self._data[:cut]
+        self._ends = array('q', [end - cut for end in self._ends[self._first:]])
+        self._roles = self._roles[self._first:]
+        self._first = 0
+
+    def __len__(self) -> int:
+        return len(self._ends) - self._first
+
+    def _entry(self, index: int) -> Tuple[int, str]:
+        position = self._first + index
+        start = self._ends[position - 1] if position else 0
+        return self._roles[position], self._data[start:self._ends[position]].decode('utf-8')
+
+    def entries(self, start: int = 0, stop: Optional[int] = None) -> List[Tuple[str, str]]:
+        """(role name, text) pairs, sliced like a list"""
+        with self._lock:
+            indices = range(len(self))[start:stop]
+            return [(ROLE_NAMES[role], text) for role, text in map(self._entry, indices)]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step not in (None, 1):
+                raise ValueError("History slices take no step")
+            return [f"{role}: {text}" for role, text in self.entries(key.start or 0, key.stop)]
+        with self._lock:
+            size = len(self)
+            if not -size <= key < size:
+                raise IndexError("history index out of range")
+            role, text = self._entry(key % size)
+        return f"{ROLE_NAMES[role]}: {text}"
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self[:])
@@ -0,0 +1,228 @@
+"""Per-stage latency instrumentation for the listen → recognize → intent → handle → speak pipeline.
+
+Code wraps each stage in ``metrics.span("stage")``. Every span feeds a rolling
+window per stage, which is summarized as p50/p95/p99 in Prometheus text format,
+and is also appended to a bounded trace buffer that can be exported as Chrome
+trace JSON (load it in chrome://tracing or Perfetto) to see where one turn's
+time went.
+"""
+import functools
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# Pipeline stages, in the order a voice turn passes through them
+STAGES = (
+    'turn', 'mic_open', 'ambient_calibration', 'capture', 'endpointing', 'recognition',
+    'nlp', 'handler', 'admission', 'external_api', 'tts',
+)
+# Not a stage of its own: from the end of the user's speech to the first audio of the reply
+RESPONSE_STAGE = 'first_audio'
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Samples kept per stage for the rolling quantiles, and spans kept for trace export
+WINDOW_SIZE = 1024
+TRACE_BUFFER_SIZE = 5000
+
+
+class RollingHistogram:
+    """Latency samples over a sliding window plus lifetime count and sum"""
+
+    __slots__ = ('samples', 'count', 'total', 'errors')
+
+    def __init__(self, window: int = WINDOW_SIZE):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self, quantiles=QUANTILES) -> Dict[float, float]:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in quantiles}
+        last = len(ordered) - 1
+        return {q: ordered[min(last, int(round(q * last)))] for q in quantiles}
+
+
+class Metrics:
+    """Thread-safe registry of stage histograms, turn ids and recent spans"""
+
+    def __init__(self, window: int = WINDOW_SIZE, trace_size: int = TRACE_BUFFER_SIZE, tracing: bool = True):
+        self.window = window
+        self.tracing = tracing
+        self.histograms: Dict[Tuple[str, str], RollingHistogram] = {}
+        self.trace = deque(maxlen=trace_size)
+        self.counters: Dict[str, int] = {}
+        self.turns = 0
+        self._turn_ids = itertools.count(1)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._epoch = time.perf_counter()
+
+    @property
+    def current_turn(self) -> Optional[int]:
+        return getattr(self._local, 'turn', None)
+
+    def observe(self, stage: str, seconds: float, service: str = '', start: Optional[float] = None,
+                error: bool = False):
+        """Record one duration for a stage (and optional upstream service)"""
+        key = (stage, service)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = RollingHistogram(self.window)
+            histogram.observe(seconds)
+            if error:
+                histogram.errors += 1
+        if self.tracing:
+            if start is None:
+                start = time.perf_counter() - seconds
+            event = {
+                'name': stage,
+                'ph': 'X',
+                'ts': round((start - self._epoch) * 1e6),
+                'dur': round(seconds * 1e6),
+                'pid': 1,
+                'tid': threading.get_ident(),
+                'args': {'turn': self.current_turn},
+            }
+            if service:
+                event['args']['service'] = service
+            if error:
+                event['args']['error'] = True
+            self.trace.append(event)
+
+    def increment(self, name: str, amount: int = 1):
+        """Add to a named event counter (exported as ``assistant_<name>_total``)"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def span(self, stage: str, service: str = ''):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, service, start, error)
+
+    @contextmanager
+    def turn(self):
+        """Mark one user turn; spans recorded inside it carry its id"""
+        outer = self.current_turn
+        if outer is not None:
+            # Nested turns (e.g. macros) belong to the turn already in progress
+            yield outer
+            return
+        turn_id = next(self._turn_ids)
+        self._local.turn = turn_id
+        with self._lock:
+            self.turns += 1
+        try:
+            with self.span('turn'):
+                yield turn_id
+        finally:
+            self._local.turn = None
+
+    def mark_end_of_speech(self, at: Optional[float] = None):
+        """Note when the user stopped speaking (``time.perf_counter()`` value, default now)"""
+        self._local.speech_ended = time.perf_counter() if at is None else at
+
+    def first_audio(self):
+        """Record end of speech to first reply audio, once per marked utterance"""
+        ended = getattr(self._local, 'speech_ended', None)
+        if ended is not None:
+            self._local.speech_ended = None
+            self.observe(RESPONSE_STAGE, time.perf_counter() - ended, start=ended)
+
+    @contextmanager
+    def join_turn(self, turn_id: Optional[int]):
+        """Attribute spans recorded on this thread (e.g. a worker) to a turn started elsewhere"""
+        outer = self.current_turn
+        self._local.turn = turn_id
+        try:
+            yield turn_id
+        finally:
+            self._local.turn = outer
+
+    def _collect(self):
+        """Copy histogram state under the lock, then compute quantiles outside it"""
+        with self._lock:
+            items = [(key, list(h.samples), h.count, h.total, h.errors) for key, h in self.histograms.items()]
+            turns = self.turns
+            counters = dict(self.counters)
+        rows = []
+        for (stage, service), samples, count, total, errors in sorted(items):
+            window = RollingHistogram(len(samples) or 1)
+            window.samples.extend(samples)
+            rows.append((stage, service, window.quantiles(), count, total, errors))
+        return rows, turns, counters
+
+    def snapshot(self) -> Dict:
+        """Quantiles, counts and sums per stage as plain data"""
+        rows, turns, counters = self._collect()
+        stages = {}
+        for stage, service, quantiles, count, total, errors in rows:
+            name = f"{stage}:{service}" if service else stage
+            stages[name] = {
+                'count': count,
+                'sum_seconds': total,
+                'errors': errors,
+                **{f"p{int(q * 100)}_seconds": v for q, v in quantiles.items()},
+            }
+        return {'turns': turns, 'stages': stages, 'counters': counters}
+
+    def prometheus(self) -> str:
+        """Render all histograms in the Prometheus text exposition format"""
+        rows, turns, counters = self._collect()
+        lines = [
+            '# HELP assistant_stage_latency_seconds Latency of assistant pipeline stages over a rolling window',
+            '# TYPE assistant_stage_latency_seconds summary',
+        ]
+        error_lines = []
+        for stage, service, quantiles, count, total, errors in rows:
+            labels = f'stage="{stage}"' + (f',service="{service}"' if service else '')
+            for quantile, value in quantiles.items():
+                lines.append(f'assistant_stage_latency_seconds{{{labels},quantile="{quantile}"}} {value:.6f}')
+            lines.append(f'assistant_stage_latency_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'assistant_stage_latency_seconds_count{{{labels}}} {count}')
+            error_lines.append(f'assistant_stage_errors_total{{{labels}}} {errors}')
+        lines += ['# HELP assistant_stage_errors_total Spans that ended with an exception',
+                  '# TYPE assistant_stage_errors_total counter'] + error_lines
+        lines += ['# HELP assistant_turns_total User turns handled',
+                  '# TYPE assistant_turns_total counter',
+                  f'assistant_turns_total {turns}']
+        for name, value in sorted(counters.items()):
+            lines += [f'# TYPE assistant_{name}_total counter', f'assistant_{name}_total {value}']
+        return '\n'.join(lines) + '\n'
+
+    def export_trace(self) -> Dict:
+        """Recent spans in Chrome trace event format"""
+        return {'traceEvents': list(self.trace), 'displayTimeUnit': 'ms'}
+
+    def write_trace(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.export_trace(), f)
+
+
+def timed(stage: str):
+    """Decorate an assistant method so each call is recorded as a span of ``stage``"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.span(stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
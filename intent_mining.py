@@ -0,0 +1,500 @@
+"""Find the utterances the intent patterns get wrong, and try better patterns against them.
+
+Two kinds of turn are misrouted without anyone noticing. Some match no
+pattern at all and get the 0.1-confidence greeting. Others match patterns of
+two intents with nearly the same confidence, like "what is ..." for WIKI
+(0.95) and CALCULATE (0.9). While the assistant runs, ``MissedUtteranceStore``
+keeps every such utterance in the ``missed_utterances`` table with how often
+it was heard. It also keeps utterances whose best match is below
+``min_confidence``.
+
+The rest works offline, over conversation logs exported as text or JSON
+lines. Identical utterances are classified once and weighted by how often
+they occur, so logs of millions of lines take minutes.
+
+* ``mine`` classifies a log and groups the misses into clusters of similar
+  utterances, by Jaccard similarity of their word n-grams.
+* ``replay`` runs a log against the built-in patterns and candidate pattern
+  sets. For each pattern it reports matches, wins, precision against labelled
+  lines and searches per second.
+* ``export`` writes the captured misses as JSON lines, ready for either.
+
+    python intent_mining.py export > misses.jsonl
+    python intent_mining.py mine conversations.jsonl misses.jsonl --top 20
+    python intent_mining.py replay labelled.jsonl --patterns current candidate.json
+"""
+import argparse
+import gzip
+import json
+import logging
+import math
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+FALLBACK = 'fallback'
+LOW_CONFIDENCE = 'low_confidence'
+AMBIGUOUS = 'ambiguous'
+
+# Defaults for what counts as a miss: best match below this confidence, or a rival intent this close to it
+MIN_CONFIDENCE = 0.75
+AMBIGUITY_MARGIN = 0.1
+# Word n-gram length and Jaccard similarity for clustering misses
+NGRAM_SIZE = 2
+CLUSTER_SIMILARITY = 0.5
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def miss_reason(confidence: float, runner_up_confidence: Optional[float], fallback: bool,
+                min_confidence: float = MIN_CONFIDENCE, margin: float = AMBIGUITY_MARGIN) -> Optional[str]:
+    """Why a classification is worth a second look, or None"""
+    if fallback:
+        return FALLBACK
+    if runner_up_confidence is not None and confidence - runner_up_confidence <= margin:
+        return AMBIGUOUS
+    if confidence < min_confidence:
+        return LOW_CONFIDENCE
+    return None
+
+
+def normalize(text: str) -> str:
+    return WHITESPACE_RE.sub(' ', text.lower()).strip()
+
+
+class MissedUtteranceStore:
+    """Misrouted-looking utterances with counts, written to SQLite in the background"""
+
+    def __init__(self, connection: sqlite3.Connection, lock: Optional[threading.Lock] = None,
+                 max_utterances: int = 50000, flush_interval: float = 5.0):
+        self.connection = connection
+        self.lock = lock or threading.Lock()
+        self.max_utterances = max_utterances
+        self.flush_interval = flush_interval
+        # text -> [reason, intent, confidence, runner-up, runner-up confidence, count, first seen, last seen]
+        self.pending: Dict[str, list] = {}
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        with self.lock:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS missed_utterances (
+                    text TEXT PRIMARY KEY,
+                    reason TEXT,
+                    intent TEXT,
+                    confidence REAL,
+                    runner_up TEXT,
+                    runner_up_confidence REAL,
+                    count INTEGER,
+                    first_seen REAL,
+                    last_seen REAL
+                )
+            ''')
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS missed_utterances_last_seen ON missed_utterances (last_seen)"
+            )
+            self.connection.commit()
+        self._writer = threading.Thread(target=self._write_loop, name='missed-utterances-writer', daemon=True)
+        self._writer.start()
+
+    def capture(self, text: str, reason: str, intent: str, confidence: float,
+                runner_up: Optional[str] = None, runner_up_confidence: Optional[float] = None):
+        text = normalize(text)
+        if not text:
+            return
+        now = time.time()
+        with self._pending_lock:
+            entry = self.pending.get(text)
+            if entry is None:
+                self.pending[text] = [reason, intent, confidence, runner_up, runner_up_confidence, 1, now, now]
+            else:
+                entry[:5] = reason, intent, confidence, runner_up, runner_up_confidence
+                entry[5] += 1
+                entry[7] = now
+
+    def flush(self) -> int:
+        """Write pending captures now; returns how many utterances were written"""
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return 0
+            try:
+                with self.lock:
+                    self.connection.executemany(
+                        "INSERT INTO missed_utterances (text, reason, intent, confidence, runner_up, "
+                        "runner_up_confidence, count, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (text) DO UPDATE SET reason = excluded.reason, intent = excluded.intent, "
+                        "confidence = excluded.confidence, runner_up = excluded.runner_up, "
+                        "runner_up_confidence = excluded.runner_up_confidence, count = count + excluded.count, "
+                        "last_seen = excluded.last_seen",
+                        [(text, *entry) for text, entry in pending.items()]
+                    )
+                    # The least recently heard utterances make way once the table is full
+                    excess = self.connection.execute("SELECT COUNT(*) FROM missed_utterances").fetchone()[0] \
+                        - self.max_utterances
+                    if excess > 0:
+                        self.connection.execute(
+                            "DELETE FROM missed_utterances WHERE text IN "
+                            "(SELECT text FROM missed_utterances ORDER BY last_seen LIMIT ?)", (excess,)
+                        )
+                    self.connection.commit()
+            except Exception:
+                logging.exception(f"Could not save {len(pending)} missed utterances")
+                return 0
+            return len(pending)
+
+    def _write_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def rows(self, limit: Optional[int] = None, reason: Optional[str] = None) -> List[Dict]:
+        """Captured utterances, most often heard first"""
+        self.flush()
+        query = ("SELECT text, reason, intent, confidence, runner_up, runner_up_confidence, count, first_seen, "
+                 "last_seen FROM missed_utterances")
+        parameters = []
+        if reason:
+            query += " WHERE reason = ?"
+            parameters.append(reason)
+        query += " ORDER BY count DESC, last_seen DESC"
+        if limit:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        with self.lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+        keys = ('text', 'reason', 'intent', 'confidence', 'runner_up', 'runner_up_confidence', 'count',
+                'first_seen', 'last_seen')
+        return [dict(zip(keys, row)) for row in rows]
+
+
+def _open(path: str):
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
+def read_corpus(paths: Iterable[str]) -> Dict[str, Counter]:
+    """Utterances in exported logs: text -> Counter of labels (None for unlabelled lines).
+
+    A line is plain text, a "User: ..." history entry ("Assistant: ..."
+    entries are skipped), or a JSON object with ``text`` (or ``message``), an
+    optional expected ``label`` and an optional ``count``. Text-mode output,
+    batch input and ``export`` output are all read as they are. JSON lines that
+    can't be used (bad JSON, no text, a label that isn't a string, a count that
+    isn't a positive number) are skipped, and how many is logged per file.
+    """
+    corpus: Dict[str, Counter] = defaultdict(Counter)
+    for path in paths:
+        source = _open(path)
+        skipped = 0
+        try:
+            for line in source:
+                line = line.strip()
+                if not line:
+                    continue
+                label, count = None, 1
+                if line.startswith('{'):
+                    try:
+                        record = json.loads(line)
+                        text = record.get('text') or record.get('message')
+                        label = record.get('label')
+                        count = int(record.get('count', 1))
+                    except (ValueError, TypeError, AttributeError, OverflowError):
+                        skipped += 1
+                        continue
+                    if not isinstance(text, str) or not (label is None or isinstance(label, str)) or count < 1:
+                        skipped += 1
+                        continue
+                elif line.startswith('Assistant: '):
+                    continue
+                else:
+                    text = line[6:] if line.startswith('User: ') else line
+                text = normalize(text)
+                if text:
+                    corpus[text][label] += count
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        if skipped:
+            logging.warning(f"Skipped {skipped} unusable lines in {path}")
+    return corpus
+
+
+def load_patterns(spec: str) -> Tuple[str, list]:
+    """(name, patterns): the built-in set for 'current', else a JSON file.
+
+    The file holds ``{"name": ..., "patterns": [...]}`` or just the list, each
+    pattern as ``{"pattern": regex, "intent": "weather", "confidence": 0.9}``,
+    in priority order. With ``"extends": "current"`` the patterns are added
+    after the built-in ones.
+    """
+    from enhanced_voice_assistant import INTENT_PATTERNS, IntentType
+    if spec == 'current':
+        return 'current', INTENT_PATTERNS
+    with open(spec, encoding='utf-8') as f:
+        data = json.load(f)
+    entries = data['patterns'] if isinstance(data, dict) else data
+    try:
+        patterns = [(re.compile(entry['pattern']), IntentType(entry['intent']), float(entry['confidence']))
+                    for entry in entries]
+    except (KeyError, ValueError, re.error) as e:
+        raise ValueError(f"{spec}: bad pattern entry ({e})")
+    if isinstance(data, dict) and data.get('extends') == 'current':
+        patterns = INTENT_PATTERNS + patterns
+    name = data.get('name', spec) if isinstance(data, dict) else spec
+    return name, patterns
+
+
+def classify(text: str, patterns) -> Tuple[Optional[int], str, float, Optional[str], Optional[float]]:
+    """(winning pattern index, intent, confidence, runner-up intent, runner-up confidence), as the assistant decides"""
+    from enhanced_voice_assistant import FALLBACK_CONFIDENCE, IntentType, best_pattern, second_best
+    best, scores = best_pattern(text, patterns)
+    if best is None:
+        index, intent_type, confidence = None, IntentType.GREET, FALLBACK_CONFIDENCE
+    else:
+        index, _, confidence = best
+        intent_type = patterns[index][1]
+    rival = second_best(scores, intent_type if best else None)
+    return (index, intent_type.value, confidence,
+            rival[0].value if rival else None, rival[1] if rival else None)
+
+
+def mine(corpus: Dict[str, Counter], patterns, min_confidence: float = MIN_CONFIDENCE,
+         margin: float = AMBIGUITY_MARGIN) -> List[Dict]:
+    """Every utterance in ``corpus`` that falls back, is ambiguous or is low confidence, most frequent first"""
+    misses = []
+    for text, labels in corpus.items():
+        index, intent, confidence, runner_up, runner_up_confidence = classify(text, patterns)
+        reason = miss_reason(confidence, runner_up_confidence, index is None, min_confidence, margin)
+        if reason:
+            misses.append({'text': text, 'count': sum(labels.values()), 'reason': reason, 'intent': intent,
+                           'confidence': confidence, 'runner_up': runner_up,
+                           'runner_up_confidence': runner_up_confidence})
+    misses.sort(key=lambda miss: (-miss['count'], miss['text']))
+    return misses
+
+
+def ngrams(text: str, size: int = NGRAM_SIZE) -> frozenset:
+    """Word n-grams of every length from 1 to ``size``"""
+    tokens = TOKEN_RE.findall(text)
+    return frozenset(' '.join(tokens[i:i + n]) for n in range(1, size + 1) for i in range(len(tokens) - n + 1))
+
+
+def cluster(misses: List[Dict], similarity: float = CLUSTER_SIMILARITY, size: int = NGRAM_SIZE,
+            examples: int = 5) -> List[Dict]:
+    """Group misses whose n-gram sets have Jaccard similarity of at least ``similarity``, biggest first.
+
+    Misses are taken most frequent first; each joins the most similar
+    cluster leader, or leads a new cluster. Only leaders sharing one of the
+    rarest n-grams can reach the threshold (prefix filtering), so each miss is
+    compared with a few candidates rather than with every cluster.
+    """
+    features = [ngrams(miss['text'], size) for miss in misses]
+    frequency = Counter(feature for grams in features for feature in grams)
+    leaders: List[frozenset] = []
+    members: List[List[int]] = []
+    index: Dict[str, List[int]] = defaultdict(list)
+    for position, grams in enumerate(features):
+        if not grams:
+            continue
+        ordered = sorted(grams, key=lambda feature: (frequency[feature], feature))
+        prefix = ordered[:len(ordered) - math.ceil(similarity * len(ordered)) + 1]
+        best, best_similarity, seen = None, similarity, set()
+        for feature in prefix:
+            for candidate in index.get(feature, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                leader = leaders[candidate]
+                shared = len(grams & leader)
+                score = shared / (len(grams) + len(leader) - shared)
+                if score >= best_similarity and (best is None or score > best_similarity):
+                    best, best_similarity = candidate, score
+        if best is None:
+            best = len(leaders)
+            leaders.append(grams)
+            members.append([])
+            for feature in prefix:
+                index[feature].append(best)
+        members[best].append(position)
+
+    clusters = []
+    for leader, positions in zip(leaders, members):
+        group = [misses[position] for position in positions]
+        shared = Counter(feature for position in positions for feature in features[position])
+        clusters.append({
+            'leader': group[0]['text'],
+            'count': sum(miss['count'] for miss in group),
+            'utterances': len(group),
+            'reasons': dict(Counter(miss['reason'] for miss in group)),
+            'intents': dict(Counter(miss['intent'] for miss in group)),
+            'common_ngrams': [feature for feature, seen in shared.most_common(10) if seen * 2 > len(group)][:5],
+            'examples': [{'text': miss['text'], 'count': miss['count']} for miss in group[:examples]],
+        })
+    clusters.sort(key=lambda found: (-found['count'], found['leader']))
+    return clusters
+
+
+def replay(corpus: Dict[str, Counter], name: str, patterns) -> Dict:
+    """Classify ``corpus`` with ``patterns``.
+
+    Reports overall throughput and accuracy, and for each pattern its matches,
+    wins, precision against labelled lines and searches per second.
+    """
+    texts = list(corpus)
+    lines = sum(sum(labels.values()) for labels in corpus.values())
+    start = time.perf_counter()
+    decisions = [classify(text, patterns) for text in texts]
+    seconds = max(time.perf_counter() - start, 1e-9)
+
+    wins = [Counter() for _ in patterns]  # 'lines', 'labelled', 'correct'
+    totals = Counter()
+    for text, (index, intent, *_) in zip(texts, decisions):
+        # Lines no pattern matched count straight into the totals, so totals['lines'] is the fallbacks
+        row = wins[index] if index is not None else totals
+        for label, count in corpus[text].items():
+            row['lines'] += count
+            if label is not None:
+                correct = count if label == intent else 0
+                row['labelled'] += count
+                row['correct'] += correct
+                if row is not totals:
+                    totals['labelled'] += count
+                    totals['correct'] += correct
+    fallbacks = totals['lines']
+
+    report = []
+    for position, (pattern, intent_type, confidence) in enumerate(patterns):
+        # Each pattern is timed on its own over every distinct utterance
+        search = pattern.search
+        begin = time.perf_counter()
+        matched = [text for text in texts if search(text)]
+        elapsed = max(time.perf_counter() - begin, 1e-9)
+        row = wins[position]
+        report.append({
+            'pattern': pattern.pattern,
+            'intent': intent_type.value,
+            'confidence': confidence,
+            'matches': sum(sum(corpus[text].values()) for text in matched),
+            'wins': row['lines'],
+            'labelled_wins': row['labelled'],
+            'precision': round(row['correct'] / row['labelled'], 4) if row['labelled'] else None,
+            'searches_per_second': round(len(texts) / elapsed),
+        })
+    return {
+        'name': name,
+        'lines': lines,
+        'distinct': len(texts),
+        'seconds': round(seconds, 3),
+        'utterances_per_second': round(len(texts) / seconds),
+        'fallback_rate': round(fallbacks / lines, 4) if lines else 0.0,
+        'labelled': totals['labelled'],
+        'accuracy': round(totals['correct'] / totals['labelled'], 4) if totals['labelled'] else None,
+        'patterns': report,
+    }
+
+
+def print_clusters(clusters: List[Dict], misses: List[Dict], corpus: Dict[str, Counter], out):
+    lines = sum(sum(labels.values()) for labels in corpus.values())
+    missed = sum(miss['count'] for miss in misses)
+    out.write(f"{missed} of {lines} lines ({len(misses)} distinct utterances) fell back, were ambiguous or "
+              f"had low confidence; {len(clusters)} clusters\n")
+    for found in clusters:
+        reasons = ', '.join(f"{reason} {count}" for reason, count in found['reasons'].items())
+        intents = ', '.join(f"{intent} {count}" for intent, count in found['intents'].items())
+        out.write(f"\n{found['count']:>8}  {found['leader']!r}  ({found['utterances']} distinct; {reasons}; "
+                  f"routed to {intents})\n")
+        if found['common_ngrams']:
+            out.write(f"          shared: {', '.join(found['common_ngrams'])}\n")
+        for example in found['examples'][1:]:
+            out.write(f"          {example['count']:>6}  {example['text']!r}\n")
+
+
+def print_replay(run: Dict, out):
+    accuracy = f", accuracy {run['accuracy']:.1%} of {run['labelled']} labelled" if run['labelled'] else ""
+    out.write(f"{run['name']}: {run['lines']} lines ({run['distinct']} distinct) in {run['seconds']} s, "
+              f"{run['utterances_per_second']} utterances/s, fallback {run['fallback_rate']:.1%}{accuracy}\n")
+    for entry in run['patterns']:
+        precision = '     -' if entry['precision'] is None else f"{entry['precision']:>6.1%}"
+        out.write(f"  {entry['intent']:>10} {entry['confidence']:.2f}  matches {entry['matches']:>8}  "
+                  f"wins {entry['wins']:>8}  precision {precision}  {entry['searches_per_second']:>8}/s  "
+                  f"{entry['pattern']}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    mine_parser = commands.add_parser('mine', help='cluster the utterances a pattern set gets wrong')
+    mine_parser.add_argument('logs', nargs='+', help='log files (text or JSON lines, .gz allowed, - for stdin)')
+    mine_parser.add_argument('--patterns', default='current', help="'current' or a pattern set JSON file")
+    mine_parser.add_argument('--min-confidence', type=float, default=MIN_CONFIDENCE)
+    mine_parser.add_argument('--margin', type=float, default=AMBIGUITY_MARGIN,
+                             help='runner-up confidence this close to the winner counts as ambiguous')
+    mine_parser.add_argument('--similarity', type=float, default=CLUSTER_SIMILARITY,
+                             help='Jaccard similarity of n-grams needed to join a cluster')
+    mine_parser.add_argument('--ngram', type=int, default=NGRAM_SIZE, help='longest word n-gram compared')
+    mine_parser.add_argument('--top', type=int, default=20, help='clusters to show (0 for all)')
+    mine_parser.add_argument('--json', action='store_true', help='print results as JSON')
+
+    replay_parser = commands.add_parser('replay', help='score pattern sets against a log')
+    replay_parser.add_argument('logs', nargs='+', help='log files; JSON lines may carry an expected "label"')
+    replay_parser.add_argument('--patterns', nargs='+', default=['current'],
+                               help="'current' and/or pattern set JSON files to compare")
+    replay_parser.add_argument('--json', action='store_true', help='print results as JSON')
+
+    export_parser = commands.add_parser('export', help='write captured misses as JSON lines')
+    export_parser.add_argument('--db', help='database file (default: DATABASE_PATH)')
+    export_parser.add_argument('--reason', choices=(FALLBACK, LOW_CONFIDENCE, AMBIGUOUS))
+    export_parser.add_argument('--limit', type=int, default=0)
+    args = parser.parse_args(argv)
+    out = sys.stdout
+
+    if args.command == 'export':
+        if args.db:
+            path = args.db
+        else:
+            from enhanced_voice_assistant import DATABASE_PATH
+            path = DATABASE_PATH
+        store = MissedUtteranceStore(sqlite3.connect(path, check_same_thread=False), flush_interval=3600)
+        for row in store.rows(args.limit or None, args.reason):
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return 0
+
+    try:
+        pattern_sets = [load_patterns(spec) for spec in ([args.patterns] if args.command == 'mine' else args.patterns)]
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    start = time.perf_counter()
+    corpus = read_corpus(args.logs)
+    logging.info(f"Read {len(corpus)} distinct utterances in {time.perf_counter() - start:.1f} s")
+
+    if args.command == 'mine':
+        misses = mine(corpus, pattern_sets[0][1], args.min_confidence, args.margin)
+        clusters = cluster(misses, args.similarity, args.ngram)
+        shown = clusters[:args.top] if args.top else clusters
+        if args.json:
+            out.write(json.dumps({'misses': len(misses), 'clusters': shown}, indent=2, ensure_ascii=False) + "\n")
+        else:
+            print_clusters(shown, misses, corpus, out)
+        return 0
+
+    runs = [replay(corpus, name, patterns) for name, patterns in pattern_sets]
+    if args.json:
+        out.write(json.dumps(runs, indent=2, ensure_ascii=False) + "\n")
+    else:
+        for run in runs:
+            print_replay(run, out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
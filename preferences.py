@@ -0,0 +1,161 @@
+"""Per-user preferences kept in memory and written through to ``users.preferences``.
+
+The user's row is read once. After that every read is a dict lookup, and
+updates change the in-memory values immediately. A background writer saves
+the latest values to SQLite, so bursts of changes collapse into one write and
+callers never wait on the disk. Listeners are told which keys changed, so the
+TTS engine and the wake-word matcher pick up new settings without a restart.
+"""
+import json
+import logging
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+# Settings the assistant understands: key -> (type, check, description of valid values)
+PREFERENCE_SPECS = {
+    'voice': (str, lambda v: True, 'part of a TTS voice name or id, or "" for the default'),
+    'speech_rate': (int, lambda v: 80 <= v <= 400, 'words per minute between 80 and 400'),
+    'volume': (float, lambda v: 0.0 <= v <= 1.0, 'a number between 0 and 1'),
+    'default_city': (str, lambda v: True, 'a city name, or "" to use your location'),
+    'wake_word': (str, lambda v: bool(v.strip()), 'a non-empty phrase'),
+    'wake_mode': (bool, lambda v: True, 'true or false'),
+}
+
+# Seconds flush() waits for the writer by default
+FLUSH_TIMEOUT = 5.0
+
+
+def coerce_preference(key: str, value: Any):
+    """Validated value for a preference, or ValueError"""
+    if key not in PREFERENCE_SPECS:
+        raise ValueError(f"Unknown setting '{key}'. Choose from: {', '.join(PREFERENCE_SPECS)}")
+    kind, check, expected = PREFERENCE_SPECS[key]
+    try:
+        if kind is bool:
+            if isinstance(value, str):
+                if value.strip().lower() not in ('true', 'false', '1', '0', 'yes', 'no', 'on', 'off'):
+                    raise ValueError(value)
+                value = value.strip().lower() in ('true', '1', 'yes', 'on')
+            elif not isinstance(value, (bool, int)):
+                raise ValueError(value)
+            value = bool(value)
+        elif kind is str:
+            if not isinstance(value, str):
+                raise ValueError(value)
+            value = value.strip()
+        else:
+            if isinstance(value, bool):
+                raise ValueError(value)
+            value = kind(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"Setting '{key}' must be {expected}")
+    if not check(value):
+        raise ValueError(f"Setting '{key}' must be {expected}")
+    return value
+
+
+class PreferenceStore:
+    """One user's preferences: in-memory reads, asynchronous write-through"""
+
+    def __init__(self, connection: sqlite3.Connection, user_id: str, defaults: Dict[str, Any],
+                 lock: Optional[threading.Lock] = None):
+        self.connection = connection
+        self.lock = lock or threading.Lock()
+        self.user_id = user_id
+        self.defaults = dict(defaults)
+        self.values: Dict[str, Any] = dict(defaults)
+        self.listeners = []  # (callback, keys or None)
+        self._values_lock = threading.Lock()
+        self._version = 0
+        self._saved_version = 0
+        self._saved = threading.Condition(self._values_lock)
+        self._dirty = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name='preferences-writer', daemon=True)
+        self.load()
+        self._writer.start()
+
+    def load(self):
+        """Read the user's row (creating it if needed) into memory"""
+        with self.lock:
+            row = self.connection.execute("SELECT preferences FROM users WHERE id = ?", (self.user_id,)).fetchone()
+            if row is None:
+                self.connection.execute("INSERT INTO users (id, preferences) VALUES (?, ?)", (self.user_id, '{}'))
+                self.connection.commit()
+        stored = {}
+        if row and row[0]:
+            try:
+                stored = json.loads(row[0])
+            except ValueError:
+                logging.warning(f"Ignoring unreadable preferences for user {self.user_id}")
+        values = dict(self.defaults)
+        for key, value in stored.items():
+            try:
+                values[key] = coerce_preference(key, value)
+            except ValueError as e:
+                logging.warning(f"Ignoring stored preference: {e}")
+        with self._values_lock:
+            self.values = values
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.values.get(key, default)
+
+    def all(self) -> Dict[str, Any]:
+        return dict(self.values)
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None], keys: Optional[Iterable[str]] = None):
+        """Call ``callback(changes)`` after updates that touch any of ``keys`` (all keys by default)"""
+        self.listeners.append((callback, set(keys) if keys is not None else None))
+
+    def update(self, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate and apply several settings at once; returns the ones that actually changed"""
+        coerced = {key: coerce_preference(key, value) for key, value in changes.items()}
+        with self._values_lock:
+            changed = {key: value for key, value in coerced.items() if self.values.get(key) != value}
+            if not changed:
+                return {}
+            # Readers see either the old or the new dict, never a half-applied update
+            self.values = {**self.values, **changed}
+            self._version += 1
+        self._dirty.set()
+        for callback, keys in self.listeners:
+            if keys is None or keys & changed.keys():
+                try:
+                    callback(changed)
+                except Exception:
+                    logging.exception("Preference listener failed")
+        return changed
+
+    def set(self, key: str, value: Any) -> bool:
+        return bool(self.update({key: value}))
+
+    def reset(self, keys: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """Return settings to their defaults"""
+        keys = list(keys) if keys is not None else list(self.defaults)
+        return self.update({key: self.defaults[key] for key in keys if key in self.defaults})
+
+    def flush(self, timeout: float = FLUSH_TIMEOUT) -> bool:
+        """Wait until every update so far is on disk"""
+        with self._saved:
+            return self._saved.wait_for(lambda: self._saved_version >= self._version, timeout)
+
+    def _write_loop(self):
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+            with self._values_lock:
+                version = self._version
+                # Only what differs from the defaults is stored, so changed defaults still apply
+                overrides = {k: v for k, v in self.values.items() if self.defaults.get(k) != v}
+            try:
+                with self.lock:
+                    self.connection.execute(
+                        "UPDATE users SET preferences = ? WHERE id = ?", (json.dumps(overrides), self.user_id)
+                    )
+                    self.connection.commit()
+            except Exception:
+                logging.exception(f"Could not save preferences for user {self.user_id}")
+                continue
+            with self._saved:
+                self._saved_version = max(self._saved_version, version)
+                self._saved.notify_all()
@@ -0,0 +1,224 @@
+"""Reuse transcripts of short clips that sound like ones recognized before.
+
+Shared-room devices hear the same few commands ("what time is it", "news")
+over and over, and each one is normally a round trip to the speech service.
+Each captured clip is reduced to a small acoustic fingerprint:
+
+1. Resample to 16 kHz mono and cut it into 20 ms frames.
+2. For every frame measure loudness, zero-crossing rate and spectral tilt
+   (energy of the first and second sample-to-sample differences relative to
+   the frame's).
+3. Trim silence at both ends, then average the voiced frames into a fixed
+   number of bins and quantize each feature to 4 bits on a log scale.
+
+Loudness is normalized per clip, so a command said closer to the microphone
+still matches. A new clip whose fingerprint is close enough to a cached one
+(``threshold``) takes that transcript instead of being uploaded.
+
+The fingerprint is coarse, so clips that differ in one sound ("turn on the
+lights" / "turn off the lights") can score above 0.9. The default threshold of
+0.96 is the lowest at which ``benchmarks/bench_recognition_cache.py
+--minimal-pairs`` finds no false hits: there the closest pair of different
+utterances scores 0.948. Check it again on recordings from the room the cache
+will run in before turning the cache on.
+Everything uses ``audioop``, so no numeric libraries are needed. Where it is
+missing (Python 3.13+ without audioop-lts) the assistant runs without the cache.
+"""
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from vad import AUDIOOP_AVAILABLE, voiced_range
+
+if AUDIOOP_AVAILABLE:
+    import audioop
+
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.02
+# Voiced frames are averaged into this many bins per feature
+BINS = 24
+LEVELS = 15  # 4-bit quantization
+FEATURES = 4  # loudness, zero crossings and two spectral tilts
+
+# Clips with less voiced audio than this, or more, are never cached
+MIN_VOICED_SECONDS = 0.15
+MAX_CLIP_SECONDS = 4.0
+# Only clips whose voiced lengths are within this ratio of each other are compared
+DURATION_TOLERANCE = 0.25
+
+DEFAULT_CAPACITY = 256
+DEFAULT_THRESHOLD = 0.96
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    digest: str            # exact hash of the PCM, for byte-identical replays
+    signature: bytes       # BINS x FEATURES levels, 0..LEVELS each
+    voiced_seconds: float
+
+
+def _to_mono16k(pcm: bytes, sample_rate: int, sample_width: int, channels: int = 1) -> bytes:
+    if channels == 2:
+        pcm = audioop.tomono(pcm, sample_width, 0.5, 0.5)
+    if sample_width != 2:
+        pcm = audioop.lin2lin(pcm, sample_width, 2)
+    if sample_rate != SAMPLE_RATE:
+        pcm, _ = audioop.ratecv(pcm, 2, 1, sample_rate, SAMPLE_RATE, None)
+    return pcm
+
+
+def _difference(frame: bytes) -> bytes:
+    # Halved so the result cannot overflow 16 bits
+    half = audioop.mul(frame, 2, 0.5)
+    return audioop.add(half[2:], audioop.mul(half[:-2], 2, -1), 2)
+
+
+def frame_features(pcm: bytes) -> List[Tuple[int, float, float, float]]:
+    """(rms, zero-crossing rate, tilt, second tilt) for each 20 ms frame of 16 kHz 16-bit mono PCM"""
+    frame_bytes = int(SAMPLE_RATE * FRAME_SECONDS) * 2
+    features = []
+    for offset in range(0, len(pcm) - frame_bytes + 1, frame_bytes):
+        frame = pcm[offset:offset + frame_bytes]
+        rms = audioop.rms(frame, 2)
+        crossings = audioop.cross(frame, 2) / (frame_bytes // 2)
+        # Differences act as high-pass filters; their share of the energy tracks how bright
+        # the frame is, the second one weighting the upper formants more
+        first = _difference(frame)
+        second = _difference(first)
+        tilt = audioop.rms(first, 2) / rms if rms else 0.0
+        tilt2 = audioop.rms(second, 2) / rms if rms else 0.0
+        features.append((rms, crossings, tilt, tilt2))
+    return features
+
+
+def _quantize_log(value: float, low: float, high: float) -> int:
+    """Position of ``value`` on a log scale from ``low`` to ``high``, as 0..LEVELS"""
+    position = math.log(max(value, low) / low) / math.log(high / low)
+    return max(0, min(LEVELS, int(round(position * LEVELS))))
+
+
+def fingerprint(pcm: bytes, sample_rate: int, sample_width: int, channels: int = 1) -> Optional[Fingerprint]:
+    """Acoustic fingerprint of a clip, or None if it is too short, too long or silent to cache"""
+    if len(pcm) > MAX_CLIP_SECONDS * sample_rate * sample_width * channels:
+        return None
+    digest = hashlib.sha1(pcm).hexdigest()
+    features = frame_features(_to_mono16k(pcm, sample_rate, sample_width, channels))
+    span = voiced_range([f[0] for f in features])
+    if span is None:
+        return None
+    voiced = features[span[0]:span[1]]
+    if len(voiced) * FRAME_SECONDS < MIN_VOICED_SECONDS:
+        return None
+
+    # Loudness relative to the clip's loudest frame, over a 40 dB range
+    peak = max(f[0] for f in voiced)
+    signature = bytearray()
+    for b in range(BINS):
+        start = b * len(voiced) // BINS
+        end = max(start + 1, (b + 1) * len(voiced) // BINS)
+        count = end - start
+        energy = sum(f[0] for f in voiced[start:end]) / count
+        crossings = sum(f[1] for f in voiced[start:end]) / count
+        tilt = sum(f[2] for f in voiced[start:end]) / count
+        tilt2 = sum(f[3] for f in voiced[start:end]) / count
+        signature += bytes((
+            _quantize_log(energy / peak, 0.01, 1.0),
+            _quantize_log(crossings, 0.005, 0.5),
+            _quantize_log(tilt, 0.01, 1.0),
+            _quantize_log(tilt2, 0.001, 1.0),
+        ))
+    return Fingerprint(digest, bytes(signature), len(voiced) * FRAME_SECONDS)
+
+
+def similarity(a: Fingerprint, b: Fingerprint) -> float:
+    """1.0 for identical signatures, lower as features drift apart; allows a one-bin shift in timing"""
+    if a.digest == b.digest:
+        return 1.0
+    longer = max(a.voiced_seconds, b.voiced_seconds)
+    if abs(a.voiced_seconds - b.voiced_seconds) > DURATION_TOLERANCE * longer:
+        return 0.0
+    best = 0.0
+    for shift in (-FEATURES, 0, FEATURES):
+        x = a.signature[max(0, shift):len(a.signature) + min(0, shift)]
+        y = b.signature[max(0, -shift):len(b.signature) + min(0, -shift)]
+        # Each feature scores 1 when equal, falling to 0 three levels apart
+        score = sum(max(0, 3 - abs(p - q)) for p, q in zip(x, y)) / (3 * len(x))
+        best = max(best, score)
+    return best
+
+
+class RecognitionCache:
+    """LRU map from fingerprints to transcripts with near-match lookup"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, threshold: float = DEFAULT_THRESHOLD, metrics=None):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.metrics = metrics
+        self.entries: 'OrderedDict[str, Tuple[Fingerprint, str]]' = OrderedDict()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _count(self, name: str):
+        if self.metrics:
+            self.metrics.increment(f'recognition_cache_{name}')
+
+    def lookup(self, print_: Fingerprint) -> Optional[str]:
+        """Transcript of the most similar cached clip above the threshold, or None"""
+        with self._lock:
+            entry = self.entries.get(print_.digest)
+            score = 1.0
+            if entry is None:
+                best, score = None, self.threshold
+                for key, (cached, text) in self.entries.items():
+                    candidate = similarity(print_, cached)
+                    if candidate >= score:
+                        best, score = key, candidate
+                entry = self.entries.get(best) if best else None
+                if entry:
+                    self.near_hits += 1
+            if entry is None:
+                self.misses += 1
+                self._count('misses')
+                return None
+            self.entries.move_to_end(entry[0].digest)
+            self.hits += 1
+        self._count('hits')
+        return entry[1]
+
+    def store(self, print_: Fingerprint, text: str):
+        evicted = 0
+        with self._lock:
+            self.entries[print_.digest] = (print_, text)
+            self.entries.move_to_end(print_.digest)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        for _ in range(evicted):
+            self._count('evictions')
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'capacity': self.capacity,
+            'threshold': self.threshold,
+            'hits': self.hits,
+            'near_hits': self.near_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
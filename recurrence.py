@@ -0,0 +1,216 @@
+"""Recurrence rules for repeating reminders.
+
+A series is stored as a single rule plus its next due time. The scheduler only
+ever holds that next occurrence; when it fires, ``next_after`` computes the one
+after it. Memory therefore grows with the number of active series, never with
+the number of occurrences.
+"""
+import datetime
+import re
+from dataclasses import dataclass
+from typing import FrozenSet, Optional, Tuple
+
+import time_parser
+
+CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 6),  # 0 = Sunday, as in cron
+)
+
+# How far ahead next_after searches before deciding a schedule never fires (e.g. "30 2 * *")
+MAX_SEARCH_DAYS = 366 * 5
+# Shortest repeat interval accepted ("every 30 seconds" would flood the reminder queue)
+MIN_INTERVAL_SECONDS = 60
+
+
+class RecurrenceError(ValueError):
+    """Raised for a repeat schedule that can't be understood"""
+
+
+def _parse_cron_field(field: str, low: int, high: int) -> FrozenSet[int]:
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step <= 0:
+                raise RecurrenceError(f"Invalid step in cron field: {field}")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = end = int(part)
+        if high == 6 and end == 7:
+            # Both 0 and 7 mean Sunday
+            values.add(0)
+            end = 6
+        if start < low or end > high or start > end:
+            raise RecurrenceError(f"Cron field out of range: {field}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+@dataclass(frozen=True)
+class CronSchedule:
+    minutes: FrozenSet[int]
+    hours: FrozenSet[int]
+    days: FrozenSet[int]
+    months: FrozenSet[int]
+    weekdays: FrozenSet[int]
+    day_restricted: bool
+    weekday_restricted: bool
+
+    @classmethod
+    def parse(cls, expression: str) -> 'CronSchedule':
+        fields = expression.split()
+        if len(fields) != 5:
+            raise RecurrenceError(f"Cron schedules need 5 fields, got: {expression!r}")
+        try:
+            parsed = [_parse_cron_field(f, low, high) for f, (_, low, high) in zip(fields, CRON_FIELDS)]
+        except ValueError as e:
+            raise RecurrenceError(str(e))
+        return cls(*parsed, day_restricted=fields[2] != '*', weekday_restricted=fields[4] != '*')
+
+    def _day_matches(self, date: datetime.date) -> bool:
+        if date.month not in self.months:
+            return False
+        day_ok = date.day in self.days
+        weekday_ok = (date.weekday() + 1) % 7 in self.weekdays
+        # Cron semantics: when both day fields are restricted, either may match
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment: datetime.datetime) -> Optional[datetime.datetime]:
+        start = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        hours = sorted(self.hours)
+        minutes = sorted(self.minutes)
+        date = start.date()
+        for offset in range(MAX_SEARCH_DAYS):
+            if self._day_matches(date):
+                first_day = offset == 0
+                for hour in hours:
+                    if first_day and hour < start.hour:
+                        continue
+                    for minute in minutes:
+                        if first_day and hour == start.hour and minute < start.minute:
+                            continue
+                        return datetime.datetime.combine(date, datetime.time(hour, minute))
+            date += datetime.timedelta(days=1)
+        return None
+
+
+@dataclass(frozen=True)
+class RecurrenceRule:
+    """How a reminder series repeats: a fixed interval or a cron-style schedule"""
+    description: str
+    interval: Optional[float] = None
+    cron: Optional[CronSchedule] = None
+
+    def next_after(self, timestamp: float) -> Optional[float]:
+        """Due timestamp of the first occurrence strictly after ``timestamp``"""
+        if self.interval is not None:
+            return timestamp + self.interval
+        moment = self.cron.next_after(datetime.datetime.fromtimestamp(timestamp))
+        return moment.timestamp() if moment else None
+
+
+_WEEKDAY_NAMES = '|'.join(time_parser.WEEKDAYS)
+_CRON_RE = re.compile(r'^\s*(?:cron[:\s]+)?(?P<expr>(?:[\d*/,-]+\s+){4}[\d*/,-]+)\s*$')
+_MULTIPLIER_WORDS = time_parser.NUMBER_WORDS_PATTERN
+_INTERVAL_RE = re.compile(
+    rf'\bevery\s+(?:(?P<number>\d+|{_MULTIPLIER_WORDS})\s+)?'
+    r'(?P<unit>seconds?|minutes?|mins?|hours?|hrs?|days?|weeks?)\b'
+    r'|\b(?P<adverb>hourly)\b'
+)
+_DAILY_RE = re.compile(r'\b(?:every\s*day|daily|each\s+day|every\s+(?P<part>morning|afternoon|evening|night))\b')
+# Only "every"/"each" or a plural makes days recurring: "on monday" and "the weekends schedule"
+# are one-off, and are left to time_parser
+_WEEKDAYS_RE = re.compile(r'\b(?:(?:every|each)\s+(?:weekday|working\s+day)|on\s+weekdays)\b')
+_WEEKENDS_RE = re.compile(r'\b(?:(?:every|each)\s+weekend(?:\s+day)?|on\s+weekends)\b')
+_DAY_LIST = rf'(?:{_WEEKDAY_NAMES})s?(?:\s*(?:,|and)\s*(?:{_WEEKDAY_NAMES})s?)*'
+_NAMED_DAYS_RE = re.compile(
+    rf'\b(?:(?:every|each)\s+(?P<days>{_DAY_LIST})'
+    rf'|(?:on\s+)?(?P<plural>(?:{_WEEKDAY_NAMES})s(?:\s*(?:,|and)\s*(?:{_WEEKDAY_NAMES})s?)*))\b'
+)
+
+
+def _clock_description(hour: int, minute: int) -> str:
+    return datetime.time(hour, minute).strftime('%I:%M %p').lstrip('0')
+
+
+def parse_recurrence(text: str) -> Optional[Tuple[RecurrenceRule, str]]:
+    """Find a repeat schedule in an utterance or API field.
+
+    Understands "every 30 minutes", "hourly", "every day at 9", "every weekday
+    at 8 am", "every monday and thursday at 6 pm", "on mondays" and raw cron
+    expressions ("cron: 0 9 * * 1-5"). A single day ("on monday") is not a
+    schedule. Returns (rule, remainder) or None.
+    """
+    text = text.lower().strip()
+
+    match = _CRON_RE.match(text)
+    if match:
+        expression = ' '.join(match.group('expr').split())
+        return RecurrenceRule(f"on schedule {expression}", cron=CronSchedule.parse(expression)), ''
+
+    match = _INTERVAL_RE.search(text)
+    if match and match.group('unit') in ('day', 'days') and not match.group('number'):
+        # "every day" is a daily schedule at a time of day, handled below
+        match = None
+    if match:
+        if match.group('adverb'):
+            seconds, description = 3600, 'every hour'
+        else:
+            unit = match.group('unit')
+            amount = int(time_parser.parse_number(match.group('number'))) if match.group('number') else 1
+            key = {'mins': 'minutes', 'min': 'minute', 'hrs': 'hours', 'hr': 'hour'}.get(unit, unit)
+            key = key if key in time_parser.UNIT_SECONDS else key + 's'
+            seconds = amount * time_parser.UNIT_SECONDS[key]
+            base = key.rstrip('s')
+            if amount <= 0:
+                raise RecurrenceError(f"A reminder can't repeat every {amount} {base}s")
+            if seconds < MIN_INTERVAL_SECONDS:
+                raise RecurrenceError("Reminders can repeat at most once a minute")
+            description = f"every {amount} {base}s" if amount != 1 else f"every {base}"
+        remainder = time_parser.remove_spans(text, [match.span()])
+        return RecurrenceRule(description, interval=float(seconds)), remainder
+
+    for pattern, weekday_field, label in (
+        (_WEEKDAYS_RE, '1-5', 'every weekday'),
+        (_WEEKENDS_RE, '0,6', 'every weekend day'),
+        (_NAMED_DAYS_RE, None, None),
+        (_DAILY_RE, '*', 'every day'),
+    ):
+        match = pattern.search(text)
+        if not match:
+            continue
+        start, end = match.span()
+        blanked = text[:start] + ' ' * (end - start) + text[end:]
+        remainder = time_parser.remove_spans(text, [match.span()])
+        if weekday_field is None:
+            names = re.findall(_WEEKDAY_NAMES, match.group('days') or match.group('plural'))
+            numbers = sorted({(time_parser.WEEKDAYS[n] + 1) % 7 for n in names})
+            weekday_field = ','.join(str(n) for n in numbers)
+            label = 'every ' + ' and '.join(n.capitalize() for n in dict.fromkeys(names))
+
+        time_of_day = time_parser.parse_time_of_day(blanked)
+        part = match.groupdict().get('part')
+        if time_of_day:
+            hour, minute, remainder = time_of_day
+        elif part:
+            hour, minute = time_parser.PART_OF_DAY_HOURS[part], 0
+        else:
+            hour, minute = 9, 0
+
+        expression = f"{minute} {hour} * * {weekday_field}"
+        description = f"{label} at {_clock_description(hour, minute)}"
+        return RecurrenceRule(description, cron=CronSchedule.parse(expression)), remainder
+
+    return None
@@ -0,0 +1,116 @@
+"""Scheduled reminders in due order, stored column by column.
+
+A heap of ``(due, text, id)`` tuples costs a tuple, a float object and a
+36-character uuid string for every reminder, about 180 bytes before the text
+itself. ``ReminderQueue`` keeps the same binary min-heap in three parallel
+columns: due times in an ``array('d')``, integer ids in an ``array('q')`` and
+the texts in a list, about 24 bytes plus the text.
+
+The queue does no locking; the assistant holds its reminder lock around every call.
+"""
+import heapq
+from array import array
+from typing import Iterable, List, Optional, Tuple
+
+Reminder = Tuple[float, str, int]
+
+
+class ReminderQueue:
+    """Min-heap of reminders keyed by due time (epoch seconds)"""
+
+    def __init__(self):
+        self.due = array('d')
+        self.ids = array('q')
+        self.texts: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.due)
+
+    def clear(self):
+        self.due = array('d')
+        self.ids = array('q')
+        self.texts = []
+
+    def peek(self) -> Optional[Reminder]:
+        """The next reminder due, without removing it"""
+        if not self.due:
+            return None
+        return self.due[0], self.texts[0], self.ids[0]
+
+    def push(self, due: float, text: str, reminder_id: int):
+        self.due.append(due)
+        self.ids.append(reminder_id)
+        self.texts.append(text)
+        self._sift_up(len(self.due) - 1)
+
+    def extend(self, reminders: Iterable[Reminder]):
+        """Add many reminders; a batch larger than the queue rebuilds it with one sort"""
+        reminders = list(reminders)
+        if len(reminders) <= len(self.due):
+            for due, text, reminder_id in reminders:
+                self.push(due, text, reminder_id)
+            return
+        due = self.due.tolist()
+        ids = self.ids.tolist()
+        texts = self.texts
+        for when, text, reminder_id in reminders:
+            due.append(when)
+            ids.append(reminder_id)
+            texts.append(text)
+        # A sorted array is a valid heap
+        order = sorted(range(len(due)), key=due.__getitem__)
+        self.due = array('d', [due[i] for i in order])
+        self.ids = array('q', [ids[i] for i in order])
+        self.texts = [texts[i] for i in order]
+
+    def pop(self) -> Reminder:
+        """Remove and return the next reminder due"""
+        due, ids, texts = self.due, self.ids, self.texts
+        last = due.pop(), texts.pop(), ids.pop()
+        if not due:
+            return last
+        first = due[0], texts[0], ids[0]
+        due[0], texts[0], ids[0] = last
+        self._sift_down(0)
+        return first
+
+    def upcoming(self, limit: int, until: float) -> List[Reminder]:
+        """Up to ``limit`` reminders due by ``until``, in due order, without sorting the whole queue"""
+        due, found = self.due, []
+        candidates = [(due[0], 0)] if due else []
+        while candidates and len(found) < limit:
+            when, index = heapq.heappop(candidates)
+            if when > until:
+                break
+            found.append((when, self.texts[index], self.ids[index]))
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(due):
+                    heapq.heappush(candidates, (due[child], child))
+        return found
+
+    def _sift_up(self, pos: int):
+        due, ids, texts = self.due, self.ids, self.texts
+        item = due[pos], ids[pos], texts[pos]
+        while pos > 0:
+            parent = (pos - 1) >> 1
+            if due[parent] <= item[0]:
+                break
+            due[pos], ids[pos], texts[pos] = due[parent], ids[parent], texts[parent]
+            pos = parent
+        due[pos], ids[pos], texts[pos] = item
+
+    def _sift_down(self, pos: int):
+        due, ids, texts = self.due, self.ids, self.texts
+        size = len(due)
+        item = due[pos], ids[pos], texts[pos]
+        while True:
+            child = 2 * pos + 1
+            if child >= size:
+                break
+            if child + 1 < size and due[child + 1] < due[child]:
+                child += 1
+            if item[0] <= due[child]:
+                break
+            due[pos], ids[pos], texts[pos] = due[child], ids[child], texts[child]
+            pos = child
+        due[pos], ids[pos], texts[pos] = item
@@ -0,0 +1,307 @@
+"""Named routines: a list of ordinary requests run as one, by phrase or on a schedule.
+
+A routine such as "good morning" bundles steps like "what's the date",
+"weather in delhi" and "what's the news". Steps are utterances or intent
+objects, as in macro custom commands. Routines live in the ``routines`` table,
+and every run is recorded in ``routine_runs`` with its end-to-end time.
+
+Scheduled routines are run by ``RoutineScheduler``. It wakes ``lead`` seconds
+before each run so the assistant can fetch the online parts (weather, news)
+early, and the replies are ready when the routine fires.
+"""
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from custom_commands import CommandTrie, normalize_phrase
+from recurrence import RecurrenceError, RecurrenceRule, parse_recurrence
+
+# Scheduled routines fetch their online data this many seconds before they run
+PREFETCH_LEAD = 300.0
+
+# Runs kept per routine in routine_runs; older ones are deleted as new ones are recorded
+MAX_RUNS_KEPT = 200
+
+
+@dataclass
+class Routine:
+    id: int
+    name: str
+    trigger: str
+    steps: List = field(default_factory=list)
+    schedule: str = ''
+    enabled: bool = True
+
+    @property
+    def rule(self) -> Optional[RecurrenceRule]:
+        return parse_schedule(self.schedule) if self.schedule else None
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id, 'name': self.name, 'trigger': self.trigger, 'steps': self.steps,
+            'schedule': self.schedule, 'enabled': self.enabled,
+        }
+
+
+def parse_schedule(schedule: str) -> RecurrenceRule:
+    """Recurrence rule for a routine schedule such as "every weekday at 7 am" """
+    parsed = parse_recurrence(schedule)
+    if not parsed:
+        raise RecurrenceError(f"Couldn't understand the schedule {schedule!r}")
+    return parsed[0]
+
+
+def validate_routine(name: str, trigger: str, steps: List, schedule: str):
+    """Raise ValueError unless the fields form a runnable routine"""
+    if not (name or '').strip():
+        raise ValueError('Routine name is required')
+    if trigger and not normalize_phrase(trigger):
+        raise ValueError('Trigger phrase must contain at least one word')
+    if not trigger and not schedule:
+        raise ValueError('A routine needs a trigger phrase, a schedule or both')
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("'steps' must be a non-empty list")
+    if not all(isinstance(step, str) and step.strip() or isinstance(step, dict) and step.get('intent')
+               for step in steps):
+        raise ValueError("Each step must be an utterance or an object with an 'intent'")
+    if schedule:
+        # RecurrenceError is a ValueError; a rule that can't compute its next run would break the scheduler
+        try:
+            next_run = parse_schedule(schedule).next_after(time.time())
+        except (ArithmeticError, AttributeError, OSError) as e:
+            raise RecurrenceError(f"The schedule {schedule!r} can't be used: {e}")
+        if next_run is None:
+            raise RecurrenceError(f"The schedule {schedule!r} never comes up")
+
+
+class RoutineStore:
+    """In-memory index of routines, written through to SQLite"""
+
+    def __init__(self, connection: sqlite3.Connection, lock: Optional[threading.Lock] = None):
+        self.connection = connection
+        self.lock = lock or threading.Lock()
+        self.routines: Dict[int, Routine] = {}
+        self.trie = CommandTrie()
+        # Called after every create, update or delete (the scheduler recomputes its timers)
+        self.on_change: Optional[Callable[[], None]] = None
+        self.load()
+
+    def load(self):
+        """Read every routine from the table and rebuild the index"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, name, trigger, steps, schedule, enabled FROM routines ORDER BY id"
+            ).fetchall()
+        self.routines = {}
+        self.trie = CommandTrie()
+        for routine_id, name, trigger, steps, schedule, enabled in rows:
+            try:
+                routine = Routine(routine_id, name, trigger or '', json.loads(steps or '[]'), schedule or '', bool(enabled))
+            except ValueError:
+                continue
+            self._index(routine)
+
+    def _index(self, routine: Routine):
+        self.routines[routine.id] = routine
+        if routine.trigger:
+            self.trie.insert(normalize_phrase(routine.trigger), routine)
+
+    def _unindex(self, routine: Routine):
+        self.routines.pop(routine.id, None)
+        if routine.trigger:
+            self.trie.remove(normalize_phrase(routine.trigger))
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def match(self, text: str) -> Optional[Routine]:
+        if not self.trie.size:
+            return None
+        routine = self.trie.prefix_match(normalize_phrase(text))
+        return routine if routine and routine.enabled else None
+
+    def get(self, routine_id: int) -> Optional[Routine]:
+        return self.routines.get(routine_id)
+
+    def list(self) -> List[Routine]:
+        return list(self.routines.values())
+
+    def scheduled(self) -> List[Routine]:
+        return [r for r in self.routines.values() if r.enabled and r.schedule]
+
+    def _check_free(self, name: str, trigger: str, routine_id: Optional[int] = None):
+        for routine in self.routines.values():
+            if routine.id != routine_id and routine.name.lower() == name.lower():
+                raise ValueError(f"A routine named '{name}' already exists")
+        owner = self.trie.get(normalize_phrase(trigger)) if trigger else None
+        if owner is not None and owner.id != routine_id:
+            raise ValueError(f"A routine with the trigger '{trigger}' already exists")
+
+    def create(self, user_id: Optional[str], name: str, steps: List, trigger: str = '',
+               schedule: str = '', enabled: bool = True) -> Routine:
+        validate_routine(name, trigger, steps, schedule)
+        name = name.strip()
+        trigger = ' '.join(normalize_phrase(trigger or ''))
+        self._check_free(name, trigger)
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO routines (user_id, name, trigger, steps, schedule, enabled) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, name, trigger, json.dumps(steps), schedule, int(enabled))
+            )
+            self.connection.commit()
+        routine = Routine(cursor.lastrowid, name, trigger, steps, schedule, enabled)
+        self._index(routine)
+        self._changed()
+        return routine
+
+    def update(self, routine_id: int, name: Optional[str] = None, steps: Optional[List] = None,
+               trigger: Optional[str] = None, schedule: Optional[str] = None,
+               enabled: Optional[bool] = None) -> Optional[Routine]:
+        existing = self.routines.get(routine_id)
+        if existing is None:
+            return None
+        name = name.strip() if name is not None else existing.name
+        steps = steps if steps is not None else existing.steps
+        trigger = ' '.join(normalize_phrase(trigger)) if trigger is not None else existing.trigger
+        schedule = schedule if schedule is not None else existing.schedule
+        enabled = bool(enabled) if enabled is not None else existing.enabled
+        validate_routine(name, trigger, steps, schedule)
+        self._check_free(name, trigger, routine_id)
+
+        with self.lock:
+            self.connection.execute(
+                "UPDATE routines SET name = ?, trigger = ?, steps = ?, schedule = ?, enabled = ? WHERE id = ?",
+                (name, trigger, json.dumps(steps), schedule, int(enabled), routine_id)
+            )
+            self.connection.commit()
+        routine = Routine(routine_id, name, trigger, steps, schedule, enabled)
+        self._unindex(existing)
+        self._index(routine)
+        self._changed()
+        return routine
+
+    def delete(self, routine_id: int) -> bool:
+        existing = self.routines.get(routine_id)
+        if existing is None:
+            return False
+        with self.lock:
+            self.connection.execute("DELETE FROM routine_runs WHERE routine_id = ?", (routine_id,))
+            self.connection.execute("DELETE FROM routines WHERE id = ?", (routine_id,))
+            self.connection.commit()
+        self._unindex(existing)
+        self._changed()
+        return True
+
+    def record_run(self, routine_id: int, started_at: float, duration_ms: float, source: str,
+                   prefetched: int = 0, errors: int = 0):
+        """Store one run's end-to-end timing"""
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO routine_runs (routine_id, started_at, duration_ms, source, prefetched, errors) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (routine_id, started_at, duration_ms, source, prefetched, errors)
+            )
+            self.connection.execute(
+                "DELETE FROM routine_runs WHERE routine_id = ? AND id NOT IN "
+                "(SELECT id FROM routine_runs WHERE routine_id = ? ORDER BY id DESC LIMIT ?)",
+                (routine_id, routine_id, MAX_RUNS_KEPT)
+            )
+            self.connection.commit()
+
+    def runs(self, routine_id: int, limit: int = 20) -> List[Dict]:
+        """Most recent runs first"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT started_at, duration_ms, source, prefetched, errors FROM routine_runs "
+                "WHERE routine_id = ? ORDER BY id DESC LIMIT ?",
+                (routine_id, limit)
+            ).fetchall()
+        return [
+            {'started_at': started_at, 'duration_ms': round(duration_ms, 1), 'source': source,
+             'prefetched': prefetched, 'errors': errors}
+            for started_at, duration_ms, source, prefetched, errors in rows
+        ]
+
+
+class RoutineScheduler:
+    """Background timer that prefetches and then runs scheduled routines.
+
+    ``prefetch(routine)`` is called ``lead`` seconds before each scheduled run
+    (or straight away if the run is closer than that), and ``run(routine)`` at
+    the scheduled time.
+    """
+
+    def __init__(self, store: RoutineStore, prefetch: Callable[[Routine], None],
+                 run: Callable[[Routine], None], lead: float = PREFETCH_LEAD):
+        self.store = store
+        self.prefetch = prefetch
+        self.run = run
+        self.lead = lead
+        self.timers = []  # heap of (when, kind, routine_id, due)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def reschedule(self):
+        """Recompute the next prefetch and run of every scheduled routine"""
+        now = time.time()
+        timers = []
+        for routine in self.store.scheduled():
+            # One unusable schedule (e.g. stored before it was validated) must not stop the others
+            try:
+                due = routine.rule.next_after(now)
+            except Exception:
+                logging.exception(f"Skipping routine {routine.id} ({routine.name}): bad schedule {routine.schedule!r}")
+                continue
+            if due is not None:
+                timers.append((max(now, due - self.lead), 'prefetch', routine.id, due))
+        heapq.heapify(timers)
+        with self._lock:
+            self.timers = timers
+        self._wake.set()
+        if timers and not (self._thread and self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._loop, name='routine-scheduler', daemon=True)
+            self._thread.start()
+
+    def next_runs(self) -> Dict[int, float]:
+        """Next scheduled run time of each routine, keyed by id"""
+        with self._lock:
+            return {routine_id: due for _, _, routine_id, due in self.timers}
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                when = self.timers[0][0] if self.timers else None
+            self._wake.wait(None if when is None else max(0.0, when - time.time()))
+            self._wake.clear()
+            now = time.time()
+            with self._lock:
+                if not self.timers or self.timers[0][0] > now:
+                    continue
+                _, kind, routine_id, due = heapq.heappop(self.timers)
+                routine = self.store.get(routine_id)
+                if routine is None or not routine.enabled or not routine.schedule:
+                    continue
+                if kind == 'prefetch':
+                    heapq.heappush(self.timers, (due, 'run', routine_id, due))
+                else:
+                    try:
+                        following = routine.rule.next_after(max(now, due))
+                    except Exception:
+                        logging.exception(f"Routine {routine_id} will not run again: bad schedule")
+                        following = None
+                    if following is not None:
+                        heapq.heappush(self.timers, (max(now, following - self.lead), 'prefetch', routine_id, following))
+            try:
+                if kind == 'prefetch':
+                    self.prefetch(routine)
+                else:
+                    self.run(routine)
+            except Exception:
+                logging.exception(f"Scheduled routine {routine_id} ({kind}) failed")
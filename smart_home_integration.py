@@ -0,0 +1,553 @@
+"""Smart home device control.
+
+Devices live in a ``DeviceRegistry`` that resolves spoken phrases ("the kitchen
+lights", "all lights", "bedroom fan", an alias like "reading lamp") to devices.
+Each device is driven through an adapter (HTTP or MQTT). Commands for several
+devices run concurrently, so a group command takes as long as the slowest
+device, not the sum of all of them. The last known state of each device is
+cached, so status questions are answered without touching the network.
+
+``SimulatedDeviceServer`` speaks the same HTTP API as ``HttpAdapter`` and is
+used for local development and benchmarks:
+
+    python smart_home_integration.py --port 8765 --latency 0.05
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+PAHO_AVAILABLE = importlib.util.find_spec("paho") is not None
+
+# Spoken words for each device type; plurals and "all" make a phrase a group command
+TYPE_WORDS = {
+    'light': ('light', 'lights', 'lamp', 'lamps', 'bulb', 'bulbs'),
+    'fan': ('fan', 'fans'),
+    'switch': ('switch', 'switches', 'plug', 'plugs', 'outlet', 'outlets'),
+    'heater': ('heater', 'heaters', 'heating', 'thermostat'),
+    'tv': ('tv', 'tvs', 'television'),
+}
+_TYPE_BY_WORD = {word: device_type for device_type, words in TYPE_WORDS.items() for word in words}
+# The first word of each type is its singular; the ones ending in "s" are plurals
+PLURAL_TYPE_WORDS = {word for words in TYPE_WORDS.values() for word in words[1:] if word.endswith('s')}
+EVERYTHING_WORDS = ('everything', 'all devices', 'all the devices')
+GROUP_WORDS = ('all', 'both', 'every')
+# "Which light?" names the candidates when there are at most this many
+MAX_CHOICES_SPOKEN = 4
+
+# How long a group command waits for its slowest device, and how many devices it drives at once
+COMMAND_TIMEOUT = 5.0
+MAX_WORKERS = 64  # threads are only started as needed
+
+# Devices served by the simulator when SMART_HOME_SIMULATE is on and no config is given
+DEMO_DEVICES = [
+    {'id': 'living_room_lamp', 'name': 'living room lamp', 'type': 'light', 'room': 'living room',
+     'aliases': ['reading lamp']},
+    {'id': 'living_room_ceiling', 'name': 'living room ceiling light', 'type': 'light', 'room': 'living room'},
+    {'id': 'kitchen_light', 'name': 'kitchen light', 'type': 'light', 'room': 'kitchen'},
+    {'id': 'kitchen_plug', 'name': 'coffee machine', 'type': 'switch', 'room': 'kitchen', 'aliases': ['coffee maker']},
+    {'id': 'bedroom_light', 'name': 'bedroom light', 'type': 'light', 'room': 'bedroom'},
+    {'id': 'bedroom_fan', 'name': 'bedroom fan', 'type': 'fan', 'room': 'bedroom'},
+    {'id': 'office_heater', 'name': 'office heater', 'type': 'heater', 'room': 'office'},
+    {'id': 'tv', 'name': 'tv', 'type': 'tv', 'room': 'living room', 'aliases': ['television']},
+]
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+def _normalize(text: str) -> str:
+    return ' '.join(_WORD_RE.findall(text.lower()))
+
+
+def _contains(text: str, phrase: str) -> bool:
+    return f" {phrase} " in f" {text} "
+
+
+class DeviceError(Exception):
+    """Raised when a device can't be reached or rejects a command"""
+
+
+class AmbiguousDevice(DeviceError):
+    """Raised when a phrase names one device ("the light") but several match"""
+
+    def __init__(self, word: str, devices: List['Device']):
+        self.word = word
+        self.devices = devices
+        if len(devices) > MAX_CHOICES_SPOKEN:
+            super().__init__(f"Which {word}? There are {len(devices)} of them.")
+        else:
+            names = [f"the {device.name}" for device in devices]
+            super().__init__(f"Which {word}: {', '.join(names[:-1])} or {names[-1]}?")
+
+
+@dataclass
+class Device:
+    id: str
+    name: str
+    type: str
+    room: str = ''
+    aliases: List[str] = field(default_factory=list)
+    adapter: str = 'default'
+    address: str = ''
+
+    def __post_init__(self):
+        self.name = _normalize(self.name)
+        self.room = _normalize(self.room)
+        self.aliases = [_normalize(alias) for alias in self.aliases]
+        self.address = self.address or self.id
+
+    def to_dict(self) -> Dict:
+        return {'id': self.id, 'name': self.name, 'type': self.type, 'room': self.room,
+                'aliases': self.aliases, 'adapter': self.adapter}
+
+
+class DeviceAdapter(ABC):
+    """Transport for one family of devices"""
+
+    name = 'adapter'
+
+    @abstractmethod
+    def set_state(self, device: Device, state: Dict) -> Dict:
+        """Apply ``state`` (e.g. {"on": true}) and return the device's new state"""
+
+    @abstractmethod
+    def get_state(self, device: Device) -> Dict:
+        """The device's current state"""
+
+
+class HttpAdapter(DeviceAdapter):
+    """REST hub: PUT/GET {base_url}/devices/{address} with a JSON state body"""
+
+    name = 'http'
+
+    def __init__(self, base_url: str, token: str = '', timeout: float = COMMAND_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.headers = {'Authorization': f'Bearer {token}'} if token else {}
+        # One keep-alive session per worker thread
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+            session = self._local.session = requests.Session()
+            session.headers.update(self.headers)
+        return session
+
+    def _request(self, method: str, device: Device, body: Optional[Dict] = None) -> Dict:
+        url = f"{self.base_url}/devices/{device.address}"
+        try:
+            response = self._session().request(method, url, json=body, timeout=self.timeout)
+        except Exception as e:
+            raise DeviceError(f"{device.name}: {e}")
+        if response.status_code >= 400:
+            raise DeviceError(f"{device.name}: hub returned {response.status_code}")
+        return response.json()
+
+    def set_state(self, device: Device, state: Dict) -> Dict:
+        return self._request('PUT', device, state)
+
+    def get_state(self, device: Device) -> Dict:
+        return self._request('GET', device)
+
+
+class MqttAdapter(DeviceAdapter):
+    """MQTT broker: publishes {"on": ...} to "{prefix}/{address}/set" (needs paho-mqtt)"""
+
+    name = 'mqtt'
+
+    def __init__(self, host: str, port: int = 1883, prefix: str = 'home', username: str = '',
+                 password: str = '', timeout: float = COMMAND_TIMEOUT):
+        if not PAHO_AVAILABLE:
+            raise DeviceError("MQTT devices need the paho-mqtt package")
+        self.host = host
+        self.port = port
+        self.prefix = prefix.rstrip('/')
+        self.auth = {'username': username, 'password': password} if username else None
+        self.timeout = timeout
+
+    def set_state(self, device: Device, state: Dict) -> Dict:
+        from paho.mqtt import publish
+        try:
+            publish.single(f"{self.prefix}/{device.address}/set", json.dumps(state), qos=1,
+                           hostname=self.host, port=self.port, auth=self.auth, keepalive=int(self.timeout))
+        except Exception as e:
+            raise DeviceError(f"{device.name}: {e}")
+        # MQTT commands are fire-and-forget; assume the device applied the state
+        return dict(state)
+
+    def get_state(self, device: Device) -> Dict:
+        """Wait up to ``timeout`` for the device's (retained) state message"""
+        from paho.mqtt import client as mqtt
+        topic = f"{self.prefix}/{device.address}/state"
+        payloads = []
+        # paho-mqtt 2 wants the callback API version up front; 1.x has no such argument
+        version = getattr(mqtt, 'CallbackAPIVersion', None)
+        client = mqtt.Client(version.VERSION2) if version else mqtt.Client()
+        if self.auth:
+            client.username_pw_set(self.auth['username'], self.auth['password'])
+        client.on_connect = lambda client, *args: client.subscribe(topic, qos=1)
+        client.on_message = lambda client, userdata, message: payloads.append(message.payload)
+        deadline = time.monotonic() + self.timeout
+        try:
+            client.connect(self.host, self.port, keepalive=max(int(self.timeout), 1))
+            while not payloads and time.monotonic() < deadline:
+                client.loop(timeout=min(0.1, max(deadline - time.monotonic(), 0.0)))
+        except Exception as e:
+            raise DeviceError(f"{device.name}: {e}")
+        finally:
+            client.disconnect()
+        if not payloads:
+            raise DeviceError(f"{device.name}: no state within {self.timeout:g}s")
+        return json.loads(payloads[0])
+
+
+ADAPTER_TYPES = {'http': HttpAdapter, 'mqtt': MqttAdapter}
+
+
+class DeviceRegistry:
+    """Devices indexed by id, name/alias, room and type"""
+
+    def __init__(self, devices: List[Device] = ()):
+        self.devices: Dict[str, Device] = {}
+        self.by_alias: Dict[str, Device] = {}
+        self.rooms: Dict[str, List[Device]] = {}
+        for device in devices:
+            self.add(device)
+
+    def add(self, device: Device):
+        self.devices[device.id] = device
+        for alias in [device.name] + device.aliases:
+            self.by_alias[alias] = device
+        if device.room:
+            self.rooms.setdefault(device.room, []).append(device)
+
+    def resolve(self, phrase: str) -> List[Device]:
+        """Devices a spoken phrase refers to; several only for group commands.
+
+        A singular type word ("the light", "the bedroom lamp") asks for one device
+        and raises ``AmbiguousDevice`` when several match. Plurals ("the lights"),
+        "all"/"both"/"every" and a bare room ("the kitchen") are group commands.
+        """
+        text = _normalize(phrase)
+        if not text:
+            return []
+        if any(_contains(text, word) for word in EVERYTHING_WORDS):
+            return list(self.devices.values())
+
+        # An exact name or alias wins, longest first ("living room lamp" over "lamp")
+        aliases = [alias for alias in self.by_alias if _contains(text, alias)]
+        if aliases:
+            return [self.by_alias[max(aliases, key=len)]]
+
+        rooms = [room for room in self.rooms if _contains(text, room)]
+        type_words = [word for word in text.split() if word in _TYPE_BY_WORD]
+        types = {_TYPE_BY_WORD[word] for word in type_words}
+        if not rooms and not types:
+            return []
+        candidates = [d for room in rooms for d in self.rooms[room]] if rooms else self.devices.values()
+        devices = [device for device in candidates if not types or device.type in types]
+        group = (not type_words or any(word in PLURAL_TYPE_WORDS for word in type_words)
+                 or any(word in GROUP_WORDS for word in text.split()))
+        if len(devices) > 1 and not group:
+            raise AmbiguousDevice(type_words[0], devices)
+        return devices
+
+    @staticmethod
+    def choose(phrase: str, choices: AmbiguousDevice) -> Optional[Device]:
+        """The one device an answer to "Which light…?" picks, or None if it names none of them.
+
+        The answer may give a name or alias ("the reading lamp"), a room ("the
+        kitchen one") or any word of a name ("ceiling"). Raises ``AmbiguousDevice``
+        with the narrower choice when it still fits several.
+        """
+        text = _normalize(phrase)
+        named = [(alias, device) for device in choices.devices
+                 for alias in [device.name] + device.aliases if _contains(text, alias)]
+        if named:
+            return max(named, key=lambda pair: len(pair[0]))[1]
+        matches = [device for device in choices.devices if device.room and _contains(text, device.room)]
+        if not matches:
+            words = set(text.split())
+            matches = [device for device in choices.devices
+                       if words & set(' '.join([device.name] + device.aliases).split())]
+        if len(matches) > 1:
+            raise AmbiguousDevice(choices.word, matches)
+        return matches[0] if matches else None
+
+
+@dataclass
+class CommandResult:
+    devices: List[Device]
+    succeeded: List[Device] = field(default_factory=list)
+    failed: List[Tuple[Device, str]] = field(default_factory=list)
+    seconds: float = 0.0
+
+
+class SmartHomeController:
+    """Runs device commands concurrently and caches the last known device state"""
+
+    def __init__(self, registry: DeviceRegistry, adapters: Dict[str, DeviceAdapter],
+                 max_workers: int = MAX_WORKERS, timeout: float = COMMAND_TIMEOUT, metrics=None):
+        self.registry = registry
+        self.adapters = adapters
+        self.timeout = timeout
+        self.metrics = metrics
+        self.states: Dict[str, Dict] = {}
+        self._states_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='smart-home')
+
+    def _call(self, device: Device, state: Optional[Dict]) -> Dict:
+        adapter = self.adapters.get(device.adapter)
+        if adapter is None:
+            raise DeviceError(f"{device.name}: no adapter named '{device.adapter}'")
+        start = time.perf_counter()
+        error = False
+        try:
+            return adapter.set_state(device, state) if state is not None else adapter.get_state(device)
+        except Exception:
+            error = True
+            raise
+        finally:
+            if self.metrics:
+                self.metrics.observe('external_api', time.perf_counter() - start, adapter.name, start, error)
+
+    def _fan_out(self, devices: List[Device], state: Optional[Dict]) -> CommandResult:
+        result = CommandResult(devices)
+        start = time.perf_counter()
+        futures = {self._executor.submit(self._call, device, state): device for device in devices}
+        done, pending = wait(futures, timeout=self.timeout)
+        for future in done:
+            device = futures[future]
+            try:
+                new_state = future.result()
+            except Exception as e:
+                result.failed.append((device, str(e)))
+                continue
+            with self._states_lock:
+                self.states[device.id] = dict(new_state, updated_at=time.time())
+            result.succeeded.append(device)
+        for future in pending:
+            future.cancel()
+            result.failed.append((futures[future], 'timed out'))
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def set_power(self, devices: List[Device], on: bool) -> CommandResult:
+        return self._fan_out(devices, {'on': on})
+
+    def refresh(self, devices: Optional[List[Device]] = None) -> CommandResult:
+        """Fetch current state from the devices into the cache"""
+        return self._fan_out(list(devices or self.registry.devices.values()), None)
+
+    def cached_state(self, device: Device) -> Optional[Dict]:
+        with self._states_lock:
+            return self.states.get(device.id)
+
+    def handle(self, action: str, phrase: str,
+               ask: Optional[Callable[[str, str, AmbiguousDevice], str]] = None) -> str:
+        """Carry out a spoken smart home command and describe the outcome.
+
+        When the phrase fits several devices, ``ask(action, phrase, error)`` is
+        called to start a follow-up and returns the question; without it the
+        question is only spoken.
+        """
+        action = _normalize(action)
+        phrase = _normalize(phrase)
+        if action in ('switch', 'control', 'manage'):
+            # "switch off the lights": the on/off word comes first in the device phrase
+            first, _, rest = phrase.partition(' ')
+            if first in ('on', 'off'):
+                action, phrase = f"turn {first}", rest
+        try:
+            devices = self.registry.resolve(phrase)
+        except AmbiguousDevice as e:
+            return ask(action, phrase, e) if ask else str(e)
+        if not devices:
+            return f"I couldn't find a device called {phrase}." if phrase else "Which device?"
+        return self.apply(action, devices, phrase)
+
+    def apply(self, action: str, devices: List[Device], phrase: str) -> str:
+        """Run a normalized action ("turn on", "turn off", "status") on resolved devices"""
+        if action == 'status':
+            return self.describe_status(devices)
+        if action not in ('turn on', 'turn off'):
+            return f"Should I turn the {phrase} on or off?"
+
+        on = action == 'turn on'
+        result = self.set_power(devices, on)
+        return describe_result(result, 'on' if on else 'off')
+
+    def describe_status(self, devices: List[Device]) -> str:
+        parts = []
+        for device in devices:
+            state = self.cached_state(device)
+            if state is None:
+                parts.append(f"I don't know whether the {device.name} is on yet")
+            else:
+                parts.append(f"the {device.name} is {'on' if state.get('on') else 'off'}")
+        text = '; '.join(parts)
+        return text[0].upper() + text[1:] + '.'
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _count(devices: List[Device]) -> str:
+    """"4 lights" when all devices share a type, otherwise "4 devices" """
+    types = {device.type for device in devices}
+    noun = TYPE_WORDS[types.pop()][1] if len(types) == 1 and next(iter(types)) in TYPE_WORDS else 'devices'
+    return f"{len(devices)} {noun}"
+
+
+def describe_result(result: CommandResult, word: str) -> str:
+    if not result.failed:
+        if len(result.succeeded) == 1:
+            return f"Turned {word} the {result.succeeded[0].name}."
+        return f"Turned {word} {_count(result.succeeded)}."
+    failed = ', '.join(device.name for device, _ in result.failed)
+    if not result.succeeded:
+        return f"I couldn't reach the {failed}."
+    return f"Turned {word} {_count(result.succeeded)}, but I couldn't reach the {failed}."
+
+
+def load_controller(config: Dict, token: str = '', metrics=None) -> SmartHomeController:
+    """Build a controller from {"adapters": {name: {"type": "http", ...}}, "devices": [...]}"""
+    adapters = {}
+    for name, options in config.get('adapters', {}).items():
+        options = dict(options)
+        adapter_type = options.pop('type', 'http')
+        if adapter_type not in ADAPTER_TYPES:
+            raise ValueError(f"Unknown adapter type '{adapter_type}'")
+        if adapter_type == 'http' and token:
+            options.setdefault('token', token)
+        adapters[name] = ADAPTER_TYPES[adapter_type](**options)
+    registry = DeviceRegistry([Device(**device) for device in config.get('devices', [])])
+    return SmartHomeController(registry, adapters, metrics=metrics)
+
+
+class SimulatedDeviceServer:
+    """In-process HTTP hub holding on/off state for a set of devices.
+
+    ``latency`` delays every request (seconds), optionally per device id via
+    ``device_latency``, to imitate slow devices.
+    """
+
+    def __init__(self, devices: List[Dict], host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.0, device_latency: Optional[Dict[str, float]] = None):
+        self.states = {device.get('address') or device['id']: {'on': False} for device in devices}
+        self.latency = latency
+        self.device_latency = device_latency or {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out as separate writes; don't let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _device(self):
+                parts = self.path.strip('/').split('/')
+                if len(parts) == 2 and parts[0] == 'devices' and parts[1] in simulator.states:
+                    time.sleep(simulator.device_latency.get(parts[1], simulator.latency))
+                    return parts[1]
+                return None
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/devices':
+                    with simulator._lock:
+                        return self._reply(200, simulator.states)
+                address = self._device()
+                if address is None:
+                    return self._reply(404, {'error': 'unknown device'})
+                with simulator._lock:
+                    simulator.requests += 1
+                    return self._reply(200, simulator.states[address])
+
+            def do_PUT(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    return self._reply(400, {'error': 'invalid JSON'})
+                address = self._device()
+                if address is None:
+                    return self._reply(404, {'error': 'unknown device'})
+                with simulator._lock:
+                    simulator.requests += 1
+                    simulator.states[address].update(body)
+                    return self._reply(200, simulator.states[address])
+
+        return Handler
+
+    def start(self) -> 'SimulatedDeviceServer':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='smart-home-simulator', daemon=True)
+        self._thread.start()
+        logging.info(f"Simulated smart home hub listening on {self.url}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def simulated_controller(devices: List[Dict] = DEMO_DEVICES, latency: float = 0.0,
+                         metrics=None) -> Tuple[SmartHomeController, SimulatedDeviceServer]:
+    """Start a simulator for ``devices`` and a controller wired to it"""
+    server = SimulatedDeviceServer(devices, latency=latency).start()
+    config = {'adapters': {'default': {'type': 'http', 'base_url': server.url}}, 'devices': devices}
+    return load_controller(config, metrics=metrics), server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a simulated smart home hub")
+    parser.add_argument('--config', help='JSON config whose devices to simulate (default: demo devices)')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of delay per request')
+    args = parser.parse_args()
+
+    devices = DEMO_DEVICES
+    if args.config:
+        with open(args.config) as f:
+            devices = json.load(f)['devices']
+    server = SimulatedDeviceServer(devices, port=args.port, latency=args.latency)
+    print(f"Simulating {len(devices)} devices at {server.url} (Ctrl+C to stop)")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Start the network fetch for a request while the user is still saying it.
+
+Streaming recognizers (the browser's Web Speech API, or ``/api/audio``
+recognizing an upload window by window) report partial transcripts before
+the final one. Each partial is classified; once one is confident enough and
+names everything the fetch needs ("weather in delhi"), the fetch starts in
+the background. When the final transcript arrives, a request with the same
+intent and entities takes the fetched reply (commit), and anything else
+throws it away (discard). A later partial that changes the request replaces
+the speculation.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import CancelledError, Executor, Future, TimeoutError
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from admission import Overloaded
+
+# Speculations whose final transcript never arrives are dropped after this many seconds
+SPECULATION_TTL = 30.0
+# Longest a final turn waits for a speculative fetch before doing the work itself
+COMMIT_TIMEOUT = 15.0
+
+
+def speculation_key(intent) -> Tuple:
+    """What must match between the partial and the final request for a prefetch to be reused"""
+    entities = tuple(sorted((k, str(v).strip().lower()) for k, v in intent.entities.items()))
+    return intent.type, entities
+
+
+@dataclass
+class Speculation:
+    key: Tuple
+    text: str
+    future: Future
+    started_at: float
+
+
+class SpeculationManager:
+    """Speculative fetches keyed by utterance id"""
+
+    def __init__(self, executor: Executor, classify: Callable[[str], object], eligible: Callable[[object], bool],
+                 threshold: float, metrics=None, ttl: float = SPECULATION_TTL):
+        self.executor = executor
+        self.classify = classify
+        self.eligible = eligible
+        self.threshold = threshold
+        self.metrics = metrics
+        self.ttl = ttl
+        self.speculations: Dict[str, Speculation] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str):
+        if self.metrics:
+            self.metrics.increment(f'speculation_{name}')
+
+    def partial(self, utterance_id: str, text: str, fetch: Callable[[object], str]) -> bool:
+        """Classify a partial transcript and start ``fetch(intent)`` if it looks settled; True if started"""
+        intent = self.classify(text)
+        if intent.confidence < self.threshold or not self.eligible(intent):
+            return False
+        key = speculation_key(intent)
+        with self._lock:
+            self._prune()
+            current = self.speculations.get(utterance_id)
+            if current and current.key == key:
+                return False
+            future = self.executor.submit(self._run, fetch, intent)
+            self.speculations[utterance_id] = Speculation(key, text, future, time.monotonic())
+        if current:
+            self._drop(current)
+        self._count('started')
+        logging.debug(f"Speculating on '{text}' ({intent.type.value})")
+        return True
+
+    def _run(self, fetch, intent):
+        if self.metrics:
+            with self.metrics.span('speculation', intent.type.value):
+                return fetch(intent)
+        return fetch(intent)
+
+    def commit(self, utterance_id: str, intent, timeout: float = COMMIT_TIMEOUT) -> Optional[str]:
+        """The speculative reply if it was for ``intent``; None means do the work normally"""
+        key = speculation_key(intent)
+        with self._lock:
+            current = self.speculations.get(utterance_id)
+            if current is None or current.key != key:
+                return None
+            del self.speculations[utterance_id]
+        try:
+            reply = current.future.result(timeout)
+        except (CancelledError, TimeoutError, Overloaded):
+            # Overloaded: the upstream refused the early fetch; the final request gets its own chance
+            self._count('discarded')
+            return None
+        except Exception:
+            logging.exception(f"Speculative fetch for '{current.text}' failed")
+            self._count('discarded')
+            return None
+        self._count('committed')
+        return reply
+
+    def finish(self, utterance_id: str):
+        """The final transcript has been handled: discard whatever it didn't use"""
+        with self._lock:
+            current = self.speculations.pop(utterance_id, None)
+        if current:
+            self._drop(current)
+
+    def _drop(self, speculation: Speculation):
+        # A fetch that has not started yet costs nothing; one in flight just goes unused
+        speculation.future.cancel()
+        self._count('discarded')
+
+    def _prune(self):
+        now = time.monotonic()
+        expired = [uid for uid, s in self.speculations.items() if now - s.started_at > self.ttl]
+        for utterance_id in expired:
+            self._drop(self.speculations.pop(utterance_id))
@@ -0,0 +1,219 @@
+"""Non-blocking structured logging for the assistant.
+
+Calling threads (audio, request handlers, the reminder monitor) only filter a
+record and put it on an in-memory queue. A single background listener formats
+it and does all file and console I/O: size-rotated JSON lines go to the log
+file, a short human-readable line to the console.
+
+Repetitive messages are rate limited before they are queued. Messages that
+differ only in numbers or ids ("Reminder 3f2a... coming up in 4.20 seconds")
+share one key. Each key may log ``burst`` records per ``interval`` seconds; the
+rest are dropped and counted, and the next record let through for that key
+carries the count as ``suppressed``.
+"""
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+CONSOLE_FORMAT = '[%(asctime)s] %(levelname)s: %(message)s'
+
+# Numbers, uuids and hex ids are masked so similar messages share a rate limit key
+_VARIABLE_RE = re.compile(r'[0-9a-f]{8}(?:-[0-9a-f]{4}){3}-[0-9a-f]{12}|\d+(?:\.\d+)?')
+
+# Keys tracked by the rate limiter before old ones are forgotten
+MAX_RATE_LIMIT_KEYS = 10000
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_context_filter: Optional['ContextFilter'] = None
+_configure_lock = threading.Lock()
+# Session of the request being handled; unset outside requests, where the process's own session is used
+_request_session: contextvars.ContextVar = contextvars.ContextVar('log_session', default=None)
+
+
+class ContextFilter(logging.Filter):
+    """Stamp records with the session id and the id of the turn in progress.
+
+    Runs in the thread that logs the record, so a session set with
+    ``log_session`` for one web request is not seen by requests on other threads.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.session_id: Optional[str] = None
+        self.turn_source: Optional[Callable[[], Optional[int]]] = None
+
+    def filter(self, record):
+        record.session = _request_session.get() or self.session_id
+        record.turn = self.turn_source() if self.turn_source else None
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Let at most ``burst`` similar records through per ``interval`` seconds"""
+
+    def __init__(self, burst: int = 5, interval: float = 10.0, max_level: int = logging.INFO):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_level = max_level  # warnings and errors are never dropped
+        self.windows = {}  # key -> [window_start, count, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.burst <= 0 or record.levelno > self.max_level:
+            return True
+        template = record.msg if record.args else _VARIABLE_RE.sub('#', str(record.msg))
+        key = (record.name, record.levelno, template)
+        now = time.monotonic()
+        with self._lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                if len(self.windows) >= MAX_RATE_LIMIT_KEYS:
+                    self.windows.clear()
+                self.windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+            'session': getattr(record, 'session', None),
+            'turn': getattr(record, 'turn', None),
+        }
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps the traceback separate from the message text"""
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(log_file: str = 'assistant.log', level: str = 'INFO', console_level: str = 'INFO',
+                      max_bytes: int = 5 * 1024 * 1024, backup_count: int = 3,
+                      rate_limit_burst: int = 5, rate_limit_interval: float = 10.0) -> logging.handlers.QueueListener:
+    """Route the root logger through a queue to a background writer; safe to call twice"""
+    global _listener, _context_filter
+    with _configure_lock:
+        if _listener is not None:
+            return _listener
+
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+        file_handler.setFormatter(JsonFormatter())
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        console_handler.setLevel(console_level)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = _QueueHandler(log_queue)
+        _context_filter = ContextFilter()
+        queue_handler.addFilter(RateLimitFilter(rate_limit_burst, rate_limit_interval))
+        queue_handler.addFilter(_context_filter)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(
+            log_queue, file_handler, console_handler, respect_handler_level=True
+        )
+        _listener.start()
+        atexit.register(shutdown_logging)
+        return _listener
+
+
+def set_log_context(session_id: Optional[str] = None, turn_source: Optional[Callable[[], Optional[int]]] = None):
+    """Set the session id and turn id provider stamped on every record"""
+    if _context_filter is None:
+        return
+    if session_id is not None:
+        _context_filter.session_id = session_id
+    if turn_source is not None:
+        _context_filter.turn_source = turn_source
+
+
+@contextmanager
+def log_session(session_id: Optional[str]):
+    """Stamp records logged inside the block, in this thread or context, with ``session_id``"""
+    token = _request_session.set(session_id)
+    try:
+        yield
+    finally:
+        _request_session.reset(token)
+
+
+def forward_logging(log_queue, level: str = 'INFO'):
+    """In a worker process: send every record to ``log_queue`` for the parent's writer instead"""
+    # Importing the assistant may have configured a writer of this process's own; only the parent writes
+    shutdown_logging()
+    handler = _QueueHandler(log_queue)
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+class _Relog(logging.Handler):
+    """Pass a record from a worker through this process's loggers, filters and writer"""
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def listen_for_workers(log_queue) -> logging.handlers.QueueListener:
+    """Start a thread that logs what worker processes put on ``log_queue`` (see forward_logging)"""
+    listener = logging.handlers.QueueListener(log_queue, _Relog())
+    listener.start()
+    return listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
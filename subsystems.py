@@ -0,0 +1,99 @@
+"""Lazily initialized assistant subsystems.
+
+Each subsystem (TTS engine, recognizer, database, ...) is created the first time
+something asks for it, so constructing the assistant is cheap and a text request
+never waits for audio drivers it doesn't use. Every subsystem records its state
+and how long it took to come up, which the readiness API reports.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+NOT_STARTED = "not_started"
+INITIALIZING = "initializing"
+READY = "ready"
+FAILED = "failed"
+
+
+class LazySubsystem:
+    """A component built by ``factory`` on first use; failures are remembered, not retried"""
+
+    def __init__(self, name: str, factory: Callable):
+        self.name = name
+        self.factory = factory
+        self.state = NOT_STARTED
+        self.value = None
+        self.error: Optional[str] = None
+        self.init_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.state in (READY, FAILED):
+            return self.value
+        with self._lock:
+            if self.state in (READY, FAILED):
+                return self.value
+            self.state = INITIALIZING
+            start = time.perf_counter()
+            try:
+                self.value = self.factory()
+                self.state = READY
+            except Exception as e:
+                logging.error(f"Failed to initialize {self.name}: {e}")
+                self.value = None
+                self.error = str(e)
+                self.state = FAILED
+            self.init_seconds = time.perf_counter() - start
+            return self.value
+
+    def set(self, value):
+        """Replace the subsystem, e.g. with a stub, marking it ready"""
+        with self._lock:
+            self.value = value
+            self.state = READY
+            self.error = None
+
+    def status(self) -> Dict:
+        status = {'state': self.state}
+        if self.init_seconds is not None:
+            status['init_ms'] = round(self.init_seconds * 1000, 2)
+        if self.error:
+            status['error'] = self.error
+        return status
+
+
+class SubsystemRegistry:
+    """Named lazy subsystems with readiness reporting and optional background warm-up"""
+
+    def __init__(self):
+        self._subsystems: Dict[str, LazySubsystem] = {}
+
+    def register(self, name: str, factory: Callable) -> LazySubsystem:
+        subsystem = LazySubsystem(name, factory)
+        self._subsystems[name] = subsystem
+        return subsystem
+
+    def __getitem__(self, name: str) -> LazySubsystem:
+        return self._subsystems[name]
+
+    def get(self, name: str):
+        return self._subsystems[name].get()
+
+    def readiness(self) -> Dict[str, Dict]:
+        return {name: subsystem.status() for name, subsystem in self._subsystems.items()}
+
+    def warm_up(self, names: Optional[Iterable[str]] = None, background: bool = True):
+        """Initialize subsystems ahead of first use, by default on a daemon thread"""
+        names = list(names) if names is not None else list(self._subsystems)
+
+        def run():
+            for name in names:
+                self._subsystems[name].get()
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="subsystem-warm-up", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,314 @@
+"""Natural-language time expressions for reminders.
+
+Turns utterances such as "in an hour and a half", "at 6:30 pm" or
+"tomorrow at 9" into an absolute datetime. The number/unit/weekday lexicon is
+built once at import and compiled into a handful of regular expressions, so
+parsing a sentence costs a few regex searches and no per-call compilation.
+"""
+import datetime
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from calculator import UNITS, TENS
+
+# ---- Lexicon -------------------------------------------------------------
+
+NUMBER_LEXICON = {word: value for word, value in UNITS.items() if word != 'oh'}
+NUMBER_LEXICON.update(TENS)
+for _tens_word, _tens_value in TENS.items():
+    for _unit_word, _unit_value in UNITS.items():
+        if 1 <= _unit_value <= 9 and _unit_word != 'oh':
+            NUMBER_LEXICON[f"{_tens_word} {_unit_word}"] = _tens_value + _unit_value
+            NUMBER_LEXICON[f"{_tens_word}-{_unit_word}"] = _tens_value + _unit_value
+NUMBER_LEXICON.update({'a': 1, 'an': 1, 'a couple of': 2, 'couple of': 2, 'a few': 3, 'few': 3})
+
+UNIT_SECONDS = {
+    'second': 1, 'seconds': 1, 'sec': 1, 'secs': 1,
+    'minute': 60, 'minutes': 60, 'min': 60, 'mins': 60,
+    'hour': 3600, 'hours': 3600, 'hr': 3600, 'hrs': 3600,
+    'day': 86400, 'days': 86400,
+    'week': 604800, 'weeks': 604800,
+}
+
+WEEKDAYS = {
+    'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3,
+    'friday': 4, 'saturday': 5, 'sunday': 6,
+}
+
+DAY_OFFSETS = {'today': 0, 'tonight': 0, 'tomorrow': 1, 'day after tomorrow': 2}
+
+# Default hour for a part of the day when no clock time is given
+PART_OF_DAY_HOURS = {'morning': 9, 'afternoon': 15, 'evening': 18, 'night': 20, 'tonight': 20}
+PM_PARTS = {'afternoon', 'evening', 'night', 'tonight'}
+
+# Furthest ahead a relative time may reach ("in 5000000 days" is not a reminder)
+MAX_DURATION_SECONDS = 10 * 365 * 86400
+
+# ---- Grammar -------------------------------------------------------------
+
+def _alternation(words):
+    return '|'.join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+_DIGIT_WORDS = _alternation(w for w, v in UNITS.items() if 1 <= v <= 9 and w != 'oh')
+# Compounds like "twenty five" are matched structurally rather than listed, which keeps
+# the compiled patterns small; NUMBER_LEXICON still resolves them to values
+NUMBER_WORDS_PATTERN = (
+    rf'(?:{_alternation(TENS)})(?:[ -](?:{_DIGIT_WORDS}))?'
+    rf'|{_alternation(w for w in UNITS if w != "oh")}'
+    r'|a couple of|couple of|a few|few|an|a'
+)
+_NUM = rf'(?:\d+(?:\.\d+)?|{NUMBER_WORDS_PATTERN})'
+_UNIT = rf'(?:{_alternation(UNIT_SECONDS)})'
+_PART = rf'{_NUM}\s+(?:and\s+a\s+half\s+)?{_UNIT}(?:\s+and\s+a\s+half)?'
+_FRACTION = r'(?:half\s+an?\s+hour|(?:a\s+)?quarter\s+(?:of\s+)?an?\s+hour|three\s+quarters\s+of\s+an?\s+hour)'
+_DURATION = rf'(?:{_FRACTION}|{_PART})(?:\s*(?:,|and)?\s*(?:{_PART}))*'
+
+_RELATIVE_RE = re.compile(rf'\b(?:in|after|within)\s+(?P<duration>{_DURATION})\b')
+_BARE_DURATION_RE = re.compile(rf'^\s*(?P<duration>{_DURATION})\s*$')
+_BARE_NUMBER_RE = re.compile(rf'^\s*(?P<number>{_NUM})\s*$')
+_DURATION_PART_RE = re.compile(
+    rf'(?P<number>{_NUM})\s+(?P<half_before>and\s+a\s+half\s+)?(?P<unit>{_UNIT})(?P<half_after>\s+and\s+a\s+half)?'
+)
+
+_HOUR_WORD = _alternation(w for w, v in UNITS.items() if 1 <= v <= 12)
+_MINUTE_WORD = rf'(?:{_alternation(TENS)})(?:[ -](?:{_DIGIT_WORDS}))?|{_alternation(w for w, v in UNITS.items() if v >= 10)}'
+_MERIDIEM = r'(?P<meridiem>a\.?\s?m\.?|p\.?\s?m\.?)'
+_CLOCK_RE = re.compile(
+    rf'\b(?:at\s+|by\s+)?(?P<hour>\d{{1,2}})(?::|\.)(?P<minute>\d{{2}})(?:\s*{_MERIDIEM})?(?![\w])'
+    rf'|\b(?:at\s+|by\s+)?(?P<hour2>\d{{1,2}})\s*{_MERIDIEM.replace("meridiem", "meridiem2")}(?![\w])'
+    rf'|\b(?:at|by)\s+(?P<hour3>\d{{1,2}}|{_HOUR_WORD})(?:\s+(?P<minute3>{_MINUTE_WORD}|o\'?clock))?(?:\s*{_MERIDIEM.replace("meridiem", "meridiem3")})?\b'
+)
+_PAST_TO_RE = re.compile(
+    rf'\b(?:at\s+)?(?P<fraction>half|quarter)\s+(?P<relation>past|to)\s+(?P<hour>\d{{1,2}}|{_HOUR_WORD})(?:\s*{_MERIDIEM})?\b'
+)
+_NAMED_TIME_RE = re.compile(r'\b(?:at\s+)?(?P<name>noon|midday|midnight)\b')
+_DAY_RE = re.compile(
+    rf'\b(?:on\s+|next\s+|this\s+)?(?P<day>day after tomorrow|tomorrow|today|tonight|{_alternation(WEEKDAYS)})\b'
+)
+_PART_OF_DAY_RE = re.compile(r'\b(?:in\s+the\s+|this\s+)?(?P<part>morning|afternoon|evening|night)\b')
+_LEFTOVER_RE = re.compile(r'^(?:\s*\b(?:to|at|on|in|for|by|and)\b\s*)+|(?:\s*\b(?:to|at|on|in|for|by|and)\b\s*)+$')
+
+
+@dataclass
+class TimeExpression:
+    due: datetime.datetime
+    remainder: str
+
+
+def parse_number(text: str) -> float:
+    """Value of a digit string or number phrase from the lexicon"""
+    text = re.sub(r'\s+', ' ', text.strip())
+    if text in NUMBER_LEXICON:
+        return NUMBER_LEXICON[text]
+    return float(text)
+
+
+def _duration_seconds(text: str) -> float:
+    """Total seconds for a matched duration such as "1 hour and 30 minutes" """
+    text = re.sub(r'\s+', ' ', text)
+    if re.match(r'half an? hour', text):
+        return 1800
+    if re.match(r'three quarters of an? hour', text):
+        return 2700
+    if re.match(r'(?:a )?quarter (?:of )?an? hour', text):
+        return 900
+
+    seconds = 0.0
+    for part in _DURATION_PART_RE.finditer(text):
+        amount = parse_number(part.group('number'))
+        if part.group('half_before') or part.group('half_after'):
+            amount += 0.5
+        seconds += amount * UNIT_SECONDS[part.group('unit')]
+    return seconds
+
+
+def _meridiem_hour(hour: int, meridiem: Optional[str]) -> int:
+    if meridiem.startswith('p') and hour < 12:
+        return hour + 12
+    if meridiem.startswith('a') and hour == 12:
+        return 0
+    return hour
+
+
+def remove_spans(text: str, spans) -> str:
+    """Cut matched time phrases out of an utterance, leaving the task text"""
+    for start, end in sorted(spans, reverse=True):
+        text = text[:start] + ' ' + text[end:]
+    text = re.sub(r'\s+', ' ', text).strip(' ,.')
+    return _LEFTOVER_RE.sub('', text).strip(' ,.')
+
+
+def _parse_clock(text: str):
+    """Find a clock time, returning (hour, minute, meridiem, span) or None"""
+    match = _NAMED_TIME_RE.search(text)
+    if match:
+        hour = 0 if match.group('name') == 'midnight' else 12
+        return hour, 0, 'explicit', match.span()
+
+    match = _PAST_TO_RE.search(text)
+    if match:
+        hour = int(parse_number(match.group('hour')))
+        minutes = 30 if match.group('fraction') == 'half' else 15
+        if match.group('relation') == 'to':
+            hour = hour - 1 if hour > 1 else 12
+            minutes = 60 - minutes
+        return hour, minutes, match.group('meridiem'), match.span()
+
+    match = _CLOCK_RE.search(text)
+    if match:
+        if match.group('hour') is not None:
+            hour, minute, meridiem = int(match.group('hour')), int(match.group('minute')), match.group('meridiem')
+        elif match.group('hour2') is not None:
+            hour, minute, meridiem = int(match.group('hour2')), 0, match.group('meridiem2')
+        else:
+            hour = int(parse_number(match.group('hour3')))
+            minute_text = match.group('minute3')
+            minute = int(parse_number(minute_text)) if minute_text and 'clock' not in minute_text else 0
+            meridiem = match.group('meridiem3')
+        if hour > 23 or minute > 59:
+            return None
+        return hour, minute, meridiem, match.span()
+    return None
+
+
+def parse_time_of_day(text: str):
+    """Find a clock time or part of day for a recurring schedule ("at 9", "in the evening").
+
+    Returns (hour, minute, remainder) or None. Unlike parse_time_expression this
+    never looks at the current time, so "at 9" is nine in the morning and
+    "at 5" is five in the afternoon.
+    """
+    text = text.lower().strip()
+    clock = _parse_clock(text)
+    part_match = _PART_OF_DAY_RE.search(text)
+    part = part_match.group('part') if part_match else None
+    if clock is None and part is None:
+        return None
+
+    spans = [part_match.span()] if part_match else []
+    if clock:
+        hour, minute, meridiem, span = clock
+        spans.append(span)
+        if meridiem == 'explicit':
+            pass
+        elif meridiem:
+            hour = _meridiem_hour(hour, meridiem)
+        elif (part in PM_PARTS and hour < 12) or 1 <= hour <= 6:
+            hour += 12
+    else:
+        hour, minute = PART_OF_DAY_HOURS[part], 0
+    return hour, minute, remove_spans(text, spans)
+
+
+def _in_range(seconds: float) -> bool:
+    return 0 < seconds <= MAX_DURATION_SECONDS
+
+
+def parse_time_expression(text: str, now: Optional[datetime.datetime] = None,
+                          default_unit: Optional[str] = None) -> Optional[TimeExpression]:
+    """Resolve the time expression in an utterance to an absolute datetime.
+
+    ``default_unit`` (e.g. "minutes") lets a bare number such as "five" be read
+    as a duration, which is how answers to "in how many minutes?" arrive.
+    Returns None when the text contains no recognizable time, or a duration
+    longer than ``MAX_DURATION_SECONDS``.
+    """
+    now = now or datetime.datetime.now()
+    text = text.lower().strip()
+
+    match = _RELATIVE_RE.search(text)
+    if match:
+        seconds = _duration_seconds(match.group('duration'))
+        if not _in_range(seconds):
+            return None
+        return TimeExpression(now + datetime.timedelta(seconds=seconds), remove_spans(text, [match.span()]))
+
+    if default_unit:
+        match = _BARE_DURATION_RE.match(text)
+        if match:
+            seconds = _duration_seconds(match.group('duration'))
+            if _in_range(seconds):
+                return TimeExpression(now + datetime.timedelta(seconds=seconds), '')
+        match = _BARE_NUMBER_RE.match(text)
+        if match and default_unit in UNIT_SECONDS:
+            seconds = parse_number(match.group('number')) * UNIT_SECONDS[default_unit]
+            if _in_range(seconds):
+                return TimeExpression(now + datetime.timedelta(seconds=seconds), '')
+
+    spans = []
+    clock = _parse_clock(text)
+    if clock:
+        spans.append(clock[3])
+
+    day_match = _DAY_RE.search(text)
+    day = None
+    if day_match and not any(s[0] <= day_match.start() < s[1] for s in spans):
+        day = day_match.group('day')
+        spans.append(day_match.span())
+
+    part_match = _PART_OF_DAY_RE.search(text)
+    part = None
+    if part_match and not any(s[0] <= part_match.start() < s[1] for s in spans):
+        part = part_match.group('part')
+        spans.append(part_match.span())
+    if day == 'tonight':
+        part = part or 'tonight'
+
+    if clock is None and day is None and part is None:
+        return None
+
+    # Resolve the calendar date
+    date = now.date()
+    if day in DAY_OFFSETS:
+        date += datetime.timedelta(days=DAY_OFFSETS[day])
+    elif day in WEEKDAYS:
+        days_ahead = (WEEKDAYS[day] - now.weekday()) % 7 or 7
+        date += datetime.timedelta(days=days_ahead)
+
+    # Resolve the clock time
+    if clock:
+        hour, minute, meridiem, _ = clock
+        if meridiem == 'explicit':
+            pass
+        elif meridiem:
+            hour = _meridiem_hour(hour, meridiem)
+        elif part in PM_PARTS and hour < 12:
+            hour += 12
+        elif day is None and part is None and 1 <= hour <= 12:
+            # "at 6" means the next 6 o'clock, morning or evening
+            candidate = datetime.datetime.combine(date, datetime.time(hour % 12, minute))
+            if candidate <= now:
+                candidate += datetime.timedelta(hours=12)
+            if candidate <= now:
+                candidate += datetime.timedelta(hours=12)
+            return TimeExpression(candidate, remove_spans(text, spans))
+        elif day is not None and 1 <= hour <= 6:
+            # Nobody schedules "tomorrow at 5" for five in the morning
+            hour += 12
+    else:
+        hour, minute = PART_OF_DAY_HOURS.get(part, 9), 0
+
+    due = datetime.datetime.combine(date, datetime.time(hour, minute))
+    if due <= now and day is None:
+        due += datetime.timedelta(days=1)
+    return TimeExpression(due, remove_spans(text, spans))
+
+
+def describe_due(due: datetime.datetime, now: Optional[datetime.datetime] = None) -> str:
+    """Phrase a due time for speech: "in 90 minutes" or "at 06:30 PM tomorrow" """
+    now = now or datetime.datetime.now()
+    delta = (due - now).total_seconds()
+    if delta < 3600 * 2 and due.date() == now.date():
+        minutes = max(1, round(delta / 60))
+        return f"in {minutes} minute{'s' if minutes != 1 else ''}"
+
+    clock = due.strftime('%I:%M %p').lstrip('0')
+    days = (due.date() - now.date()).days
+    if days == 0:
+        return f"at {clock}"
+    if days == 1:
+        return f"at {clock} tomorrow"
+    if days < 7:
+        return f"at {clock} on {due.strftime('%A')}"
+    return f"at {clock} on {due.strftime('%B %d')}"
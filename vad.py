@@ -0,0 +1,225 @@
+"""Voice activity detection on raw PCM frames.
+
+``listen()`` used to hand the microphone to ``Recognizer.listen``, which waits
+for a fixed second of silence and uploads everything it heard, silence
+included. Here each 20 ms frame is compared with a running noise floor:
+
+* the utterance starts after a few consecutive frames well above the floor,
+  keeping a short pre-roll so the first consonant is not clipped;
+* it ends once the speaker has been quiet for a hangover that adapts to
+  them: 1.5 times the longest pause seen between their words, kept within
+  ``min_silence``..``max_silence``;
+* leading and trailing silence are dropped, and ``prepare_upload`` resamples
+  to 16 kHz mono before the recognizer compresses the clip to FLAC.
+
+The noise floor carries over between utterances, so no separate ambient
+calibration is needed.
+"""
+try:
+    import audioop
+except ImportError:
+    # Removed from the standard library in Python 3.13; the audioop-lts package puts it back
+    audioop = None
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+# Everything here needs audioop; callers fall back to plain recognition without it
+AUDIOOP_AVAILABLE = audioop is not None
+
+FRAME_SECONDS = 0.02
+# A frame is speech when its energy is this many times the noise floor
+SPEECH_RATIO = 3.0
+MIN_SPEECH_ENERGY = 100
+# Consecutive speech frames needed to start an utterance
+START_FRAMES = 3
+# Silence that ends an utterance: starts at INITIAL_SILENCE, then follows the speaker's pauses
+MIN_SILENCE = 0.3
+MAX_SILENCE = 0.8
+INITIAL_SILENCE = 0.5
+PAUSE_FACTOR = 1.5
+# Audio kept before the first and after the last speech frame
+PRE_ROLL = 0.15
+POST_ROLL = 0.1
+MAX_UTTERANCE_SECONDS = 10.0
+# The speech service gains nothing from more than 16 kHz; smaller uploads finish sooner
+UPLOAD_SAMPLE_RATE = 16000
+
+
+@dataclass
+class Utterance:
+    pcm: bytes
+    sample_rate: int
+    sample_width: int
+    speech_seconds: float   # first to last speech frame
+    waited_seconds: float   # silence listened to after the last speech frame
+    truncated: bool = False
+
+
+def voiced_range(energies: List[int]) -> Optional[Tuple[int, int]]:
+    """First and last frame (exclusive) louder than the clip's noise floor, or None if all quiet"""
+    if not energies:
+        return None
+    ordered = sorted(energies)
+    noise_floor = ordered[len(ordered) // 10]
+    threshold = max(noise_floor * SPEECH_RATIO, ordered[-1] * 0.1, MIN_SPEECH_ENERGY / 2)
+    voiced = [i for i, energy in enumerate(energies) if energy >= threshold]
+    if not voiced:
+        return None
+    return voiced[0], voiced[-1] + 1
+
+
+def trim_silence(pcm: bytes, sample_rate: int, sample_width: int) -> bytes:
+    """A whole clip without its leading and trailing silence (b'' if it is all silence)"""
+    frame_bytes = int(sample_rate * FRAME_SECONDS) * sample_width
+    energies = [audioop.rms(pcm[i:i + frame_bytes], sample_width)
+                for i in range(0, len(pcm) - frame_bytes + 1, frame_bytes)]
+    span = voiced_range(energies)
+    if span is None:
+        return b''
+    start = max(0, span[0] - int(PRE_ROLL / FRAME_SECONDS)) * frame_bytes
+    end = min(len(energies), span[1] + int(POST_ROLL / FRAME_SECONDS)) * frame_bytes
+    return pcm[start:end]
+
+
+def to_mono(pcm: bytes, sample_width: int) -> bytes:
+    """Interleaved stereo PCM mixed down to mono"""
+    if not AUDIOOP_AVAILABLE:
+        raise ValueError("Stereo audio needs the audioop module (pip install audioop-lts)")
+    return audioop.tomono(pcm, sample_width, 0.5, 0.5)
+
+
+def prepare_upload(pcm: bytes, sample_rate: int, sample_width: int, channels: int = 1) -> Tuple[bytes, int, int]:
+    """Mono 16-bit PCM at no more than UPLOAD_SAMPLE_RATE, as (pcm, sample_rate, sample_width)"""
+    if channels == 2:
+        pcm = to_mono(pcm, sample_width)
+    if sample_width != 2:
+        pcm = audioop.lin2lin(pcm, sample_width, 2)
+    if sample_rate > UPLOAD_SAMPLE_RATE:
+        pcm, _ = audioop.ratecv(pcm, 2, 1, sample_rate, UPLOAD_SAMPLE_RATE, None)
+        sample_rate = UPLOAD_SAMPLE_RATE
+    return pcm, sample_rate, 2
+
+
+class VoiceActivityDetector:
+    """Finds one utterance in a stream of PCM chunks fed to ``feed``"""
+
+    def __init__(self, sample_rate: int, sample_width: int, noise_floor: Optional[float] = None,
+                 min_silence: float = MIN_SILENCE, max_silence: float = MAX_SILENCE,
+                 max_seconds: float = MAX_UTTERANCE_SECONDS):
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.noise_floor = noise_floor
+        self.min_silence = min_silence
+        self.max_silence = max_silence
+        self.max_frames = int(max_seconds / FRAME_SECONDS)
+        self.frame_bytes = int(sample_rate * FRAME_SECONDS) * sample_width
+        self.started = False
+        self.longest_pause = 0.0
+        self._pending = bytearray()
+        self._pre_roll = deque(maxlen=int(PRE_ROLL / FRAME_SECONDS))
+        self._onset: List[bytes] = []
+        self._frames: List[bytes] = []
+        self._first_voiced = 0
+        self._last_voiced = 0
+        self._silent_run = 0
+
+    @property
+    def hangover(self) -> float:
+        """Seconds of silence that currently end the utterance"""
+        if not self.longest_pause:
+            return INITIAL_SILENCE
+        return min(self.max_silence, max(self.min_silence, PAUSE_FACTOR * self.longest_pause))
+
+    def feed(self, chunk: bytes) -> Optional[Utterance]:
+        """Add audio; returns the utterance once it has ended"""
+        self._pending += chunk
+        offset = 0
+        while len(self._pending) - offset >= self.frame_bytes:
+            utterance = self._frame(bytes(self._pending[offset:offset + self.frame_bytes]))
+            offset += self.frame_bytes
+            if utterance:
+                del self._pending[:]
+                return utterance
+        del self._pending[:offset]
+        return None
+
+    def flush(self) -> Optional[Utterance]:
+        """End of stream: the utterance so far, if speech had started"""
+        return self._finish() if self.started else None
+
+    def _update_floor(self, energy: int):
+        if self.noise_floor is None:
+            self.noise_floor = float(energy)
+        elif energy < self.noise_floor:
+            # Fall quickly (the seed may have caught the start of speech), rise slowly
+            self.noise_floor = 0.5 * self.noise_floor + 0.5 * energy
+        else:
+            self.noise_floor = 0.98 * self.noise_floor + 0.02 * energy
+
+    def _frame(self, frame: bytes) -> Optional[Utterance]:
+        energy = audioop.rms(frame, self.sample_width)
+        if self.noise_floor is None:
+            self._update_floor(energy)
+        speech = energy >= max(self.noise_floor * SPEECH_RATIO, MIN_SPEECH_ENERGY)
+
+        if not self.started:
+            if speech:
+                self._onset.append(frame)
+                if len(self._onset) >= START_FRAMES:
+                    self.started = True
+                    self._frames = list(self._pre_roll) + self._onset
+                    self._first_voiced = len(self._pre_roll)
+                    self._last_voiced = len(self._frames)
+            else:
+                # A blip too short to be speech is background after all
+                self._pre_roll.extend(self._onset)
+                self._onset = []
+                self._pre_roll.append(frame)
+                self._update_floor(energy)
+            return None
+
+        self._frames.append(frame)
+        if speech:
+            if self._silent_run:
+                self.longest_pause = max(self.longest_pause, self._silent_run * FRAME_SECONDS)
+                self._silent_run = 0
+            self._last_voiced = len(self._frames)
+        else:
+            self._silent_run += 1
+            self._update_floor(energy)
+            if self._silent_run * FRAME_SECONDS >= self.hangover - 1e-9:
+                return self._finish()
+        if len(self._frames) >= self.max_frames:
+            return self._finish(truncated=True)
+        return None
+
+    def _finish(self, truncated: bool = False) -> Utterance:
+        keep = min(len(self._frames), self._last_voiced + int(POST_ROLL / FRAME_SECONDS))
+        return Utterance(
+            b''.join(self._frames[:keep]), self.sample_rate, self.sample_width,
+            speech_seconds=(self._last_voiced - self._first_voiced) * FRAME_SECONDS,
+            waited_seconds=self._silent_run * FRAME_SECONDS,
+            truncated=truncated,
+        )
+
+
+def capture(detector: VoiceActivityDetector, read: Callable[[], bytes], chunk_seconds: float,
+            timeout: Optional[float] = None) -> Optional[Utterance]:
+    """Read chunks until the detector finds the end of an utterance.
+
+    Returns None if nobody starts speaking within ``timeout`` seconds of audio
+    or the stream ends first.
+    """
+    waited = 0.0
+    while True:
+        chunk = read()
+        if not chunk:
+            return detector.flush()
+        utterance = detector.feed(chunk)
+        if utterance:
+            return utterance
+        if not detector.started:
+            waited += chunk_seconds
+            if timeout is not None and waited >= timeout:
+                return None
@@ -2,6 +2,9 @@ from flask import Flask, render_template, request, jsonify, session
 import os
 import sys
 import json
+import contextlib
+import functools
+import logging
 import threading
 import queue
 import time
@@ -9,6 +12,9 @@ from datetime import datetime
 import sqlite3
 import smtplib
 import re
+import csv
+import io
+import wave
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
@@ -17,7 +23,18 @@ load_dotenv()
 
 # Add parent directory to path to import the main assistant
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from enhanced_voice_assistant import EnhancedVoiceAssistant
+from enhanced_voice_assistant import (
+    EnhancedVoiceAssistant, Intent, IntentType, WORKER_PROCESSES, read_text_line, RATE_LIMIT_PER_CLIENT,
+    RATE_LIMIT_BURST, MAX_CONCURRENT_REQUESTS, MAX_QUEUED_REQUESTS, REQUEST_DEADLINE, OPENWEATHER_URL,
+)
+from admission import AdmissionController, ClientRateLimiter, Overloaded, deadline_scope
+from analytics import parse_time
+from circuit_breaker import check_upstream_status
+from custom_commands import MAX_MACRO_DEPTH
+from structured_logging import log_session
+import calculator
+from time_parser import parse_time_expression, describe_due
+from recurrence import parse_recurrence, RecurrenceError
 import uuid
 
 app = Flask(__name__)
@@ -25,9 +42,26 @@ app.secret_key = os.urandom(24)
 
 # Global assistant instance
 assistant = None
+# Worker processes that answer batch replays (see workers.py); None when WORKER_PROCESSES is 0
+worker_pool = None
+# Admission control for routes that do real work (see admission.py); None when turned off
+client_limiter = None
+request_admission = None
 conversation_queue = queue.Queue()
 is_listening = False
 
+# Size of each read from an uploaded audio stream
+AUDIO_CHUNK_BYTES = 32 * 1024
+
+# Upper bound on reminders accepted by one bulk import request
+MAX_BULK_REMINDERS = 50000
+
+# Upper bound on contacts accepted by one import request
+MAX_CONTACT_IMPORT = 50000
+
+# Upper bound on utterances replayed by one batch request
+MAX_BATCH_UTTERANCES = 10000
+
 # Global reminder storage and notification queue
 active_reminders = []  # List of {id, text, due_time, completed}
 reminder_notifications = queue.Queue()  # Queue for reminder alerts
@@ -39,16 +73,94 @@ def initialize_assistant():
         assistant = EnhancedVoiceAssistant()
         return True
     except Exception as e:
-        print(f"Error initializing assistant: {e}")
+        logging.error(f"Error initializing assistant: {e}")
         return False
 
-# Try to initialize assistant at import time so the web UI can use it
-try:
-    # initialize in a background thread to avoid blocking Flask startup
-    t = threading.Thread(target=initialize_assistant, daemon=True)
-    t.start()
-except Exception:
-    pass
+def start_workers():
+    """Start the worker process pool if WORKER_PROCESSES asks for one"""
+    global worker_pool
+    if WORKER_PROCESSES > 0:
+        from workers import WorkerPool
+        worker_pool = WorkerPool(WORKER_PROCESSES)
+        logging.info(f"Started {WORKER_PROCESSES} worker processes")
+
+def start_admission():
+    """Per-client rate limits and the bounded request queue, as configured"""
+    global client_limiter, request_admission
+    if RATE_LIMIT_PER_CLIENT > 0:
+        client_limiter = ClientRateLimiter(RATE_LIMIT_PER_CLIENT, RATE_LIMIT_BURST, metrics=assistant.metrics)
+    if MAX_CONCURRENT_REQUESTS > 0:
+        request_admission = AdmissionController('requests', MAX_CONCURRENT_REQUESTS, MAX_QUEUED_REQUESTS,
+                                                metrics=assistant.metrics)
+
+# Construction is cheap (subsystems come up lazily), so the assistant can serve
+# text intents immediately; heavier subsystems are warmed up in the background.
+# Spawned worker processes import this module as __mp_main__ and build their own.
+if __name__ != '__mp_main__' and initialize_assistant():
+    assistant.warm_up(['database', 'preferences', 'custom_commands', 'routines', 'contacts', 'analytics',
+                       'missed_utterances', 'recognizer'])
+    start_admission()
+    start_workers()
+
+@app.after_request
+def reload_workers(response):
+    """Workers keep their own copy of commands, routines and settings; have them re-read changes"""
+    if (worker_pool and request.method in ('POST', 'PUT', 'DELETE') and response.status_code < 400
+            and request.path.startswith(('/api/commands', '/api/routines', '/api/settings'))):
+        if request.path.startswith('/api/settings'):
+            assistant.preferences.flush()
+        worker_pool.reload()
+    return response
+
+def overloaded_response(error, status=503):
+    """A fast refusal telling the client when to come back"""
+    response = jsonify({'error': str(error), 'retry_after': round(error.retry_after, 3)})
+    response.status_code = status
+    response.headers['Retry-After'] = error.retry_after_header
+    return response
+
+def client_over_rate(bucket=''):
+    """A 429 response when this client has used up its rate in ``bucket``, otherwise None"""
+    if client_limiter:
+        wait = client_limiter.check(f"{request.remote_addr or 'unknown'} {bucket}".rstrip())
+        if wait:
+            return overloaded_response(Overloaded("Too many requests", wait), 429)
+    return None
+
+def rate_limited(view):
+    """Rate limit the client's writes without holding a request slot.
+
+    Each such endpoint has its own bucket per client, so a stream of partial
+    transcripts or edits never uses up the rate the next /api/text needs.
+    Reads (GET) of the same route are not limited.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method == 'GET':
+            return view(*args, **kwargs)
+        return client_over_rate(request.endpoint) or view(*args, **kwargs)
+    return wrapper
+
+def admission_controlled(view):
+    """Rate limit the client, then hold a request slot for the view within REQUEST_DEADLINE.
+
+    A client over its rate gets a 429; a request that could not be served in
+    time, here or by an upstream service, gets a 503. Both carry Retry-After.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        refused = client_over_rate()
+        if refused:
+            return refused
+        try:
+            with deadline_scope(time.monotonic() + REQUEST_DEADLINE):
+                if not request_admission:
+                    return view(*args, **kwargs)
+                with request_admission.admit():
+                    return view(*args, **kwargs)
+        except Overloaded as e:
+            return overloaded_response(e)
+    return wrapper
 
 @app.route('/')
 def index():
@@ -61,9 +173,77 @@ def get_status():
     return jsonify({
         'status': 'ready' if assistant else 'error',
         'is_listening': is_listening,
+        'subsystems': assistant.readiness() if assistant else {},
+        'services': {name: breaker.state for name, breaker in assistant.breakers.items()} if assistant else {},
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/api/readiness')
+def get_readiness():
+    """Report per-subsystem initialization state"""
+    if not assistant:
+        return jsonify({'ready': False, 'subsystems': {}}), 503
+    
+    ready = assistant.text_ready()
+    return jsonify({
+        'ready': ready,
+        'subsystems': assistant.readiness(),
+        'timestamp': datetime.now().isoformat()
+    }), 200 if ready else 503
+
+@app.route('/api/metrics')
+def get_metrics():
+    """Per-stage latency quantiles in Prometheus text format (or JSON with ?format=json)"""
+    if not assistant:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    
+    if request.args.get('format') == 'json':
+        snapshot = assistant.metrics.snapshot()
+        if assistant.recognition_cache is not None:
+            snapshot['recognition_cache'] = assistant.recognition_cache.stats()
+        snapshot['admission'] = {
+            'requests': request_admission.stats() if request_admission else None,
+            'upstreams': {name: gate.stats() for name, gate in assistant.upstreams.items()},
+        }
+        snapshot['breakers'] = {name: breaker.stats() for name, breaker in assistant.breakers.items()}
+        return jsonify(snapshot)
+    return app.response_class(assistant.metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/metrics/trace')
+def get_metrics_trace():
+    """Recent spans as Chrome trace JSON (open in chrome://tracing or Perfetto)"""
+    if not assistant:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    
+    return jsonify(assistant.metrics.export_trace())
+
+@app.route('/api/analytics')
+def get_analytics():
+    """Intent usage, fallback rate, confidence and handler latency between ?start and ?end (default: the last day).
+
+    Times are epoch seconds or ISO 8601. ?intent= narrows to one intent;
+    ?by=hour or ?by=day adds a time series.
+    """
+    if not assistant or not assistant.analytics:
+        return jsonify({'error': 'Analytics is not available'}), 500
+    try:
+        end = parse_time(request.args['end']) if 'end' in request.args else time.time()
+        start = parse_time(request.args['start']) if 'start' in request.args else end - 86400
+        if start >= end:
+            raise ValueError("start must be before end")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    intent = request.args.get('intent') or None
+    try:
+        result = assistant.analytics.summary(start, end, intent)
+        if 'by' in request.args:
+            result['series'] = assistant.analytics.series(start, end, request.args['by'], intent)
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/listen', methods=['POST'])
 def start_listening():
     """Start voice recognition"""
@@ -125,6 +305,7 @@ def stop_listening():
     return jsonify({'status': 'stopped'})
 
 @app.route('/api/text', methods=['POST'])
+@admission_controlled
 def process_text():
     """Process text input"""
     data = request.get_json()
@@ -137,147 +318,539 @@ def process_text():
         return jsonify({'error': 'Assistant not initialized'}), 500
     
     try:
-        # Process the text command
-        intent = assistant.process_natural_language(text)
-        response = process_intent_response(intent)
+        session_id = get_session_id(data)
+        # Voice input names its utterance so fetches started from partial transcripts can be used
+        utterance_id = str(data['utterance_id']) if data.get('utterance_id') else None
+        if utterance_id:
+            assistant.metrics.mark_end_of_speech()
+        with log_session(session_id), assistant.metrics.turn():
+            response = respond_to_text(text, session_id=session_id, utterance_id=utterance_id)
+        if utterance_id:
+            assistant.metrics.first_audio()
+        return jsonify({
+            'response': response,
+            'session_id': session_id,
+            'dialog': pending_dialog(session_id, data),
+            'timestamp': datetime.now().isoformat()
+        })
         
-        # Actually perform the actions
-        if intent.type.value == "time":
-            now = datetime.now()
-            response = f"The current time is {now.strftime('%I:%M %p')}"
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/partial', methods=['POST'])
+@rate_limited
+def process_partial():
+    """Take a partial transcript from a streaming recognizer and start the likely fetch early"""
+    data = request.get_json(silent=True) or {}
+    text = str(data.get('text', '')).strip()
+    utterance_id = data.get('utterance_id')
+    if not text or not utterance_id:
+        return jsonify({'error': "'text' and 'utterance_id' are required"}), 400
+    
+    if not assistant:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    
+    try:
+        started = bool(assistant.speculation) and assistant.speculation.partial(str(utterance_id), text, speculative_reply)
+        return jsonify({'speculating': started})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def speculative_reply(intent):
+    """Reply for an intent from a partial transcript (only side-effect free intents get here)"""
+    return perform_intent(intent, intent.raw_text)
+
+@app.route('/api/audio', methods=['POST'])
+@admission_controlled
+def process_audio():
+    """Recognize audio uploaded by the browser and respond to it.
+
+    Accepts either a WAV body (audio/wav) or raw little-endian PCM
+    (audio/l16 or application/octet-stream) described by the ``rate``,
+    ``width`` and ``channels`` query parameters. The body is read in chunks
+    and recognized segment by segment, so long uploads use constant memory.
+    """
+    if not assistant:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    
+    with assistant.metrics.turn():
+        return audio_turn()
+
+def audio_turn():
+    """Transcribe the uploaded audio and respond to it as one timed turn"""
+    # Each recognized window is a partial transcript the reply can start from
+    utterance_id = str(uuid.uuid4())
+    on_partial = None
+    if assistant.speculation:
+        on_partial = lambda partial: assistant.speculation.partial(utterance_id, partial, speculative_reply)
+    try:
+        if request.mimetype in ('audio/wav', 'audio/x-wav', 'audio/wave'):
+            text = assistant.transcribe_wav_stream(request.stream, on_partial=on_partial)
+        else:
+            sample_rate = request.args.get('rate', 16000, type=int)
+            sample_width = request.args.get('width', 2, type=int)
+            channels = request.args.get('channels', 1, type=int)
+            chunks = iter(lambda: request.stream.read(AUDIO_CHUNK_BYTES), b'')
+            text = assistant.transcribe_pcm_stream(chunks, sample_rate, sample_width, channels, on_partial)
+        assistant.metrics.mark_end_of_speech()
+    except (wave.Error, EOFError, ValueError) as e:
+        return jsonify({'error': f'Invalid audio: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    if text == "none":
+        if assistant.speculation:
+            assistant.speculation.finish(utterance_id)
+        if not assistant.service_available('google-speech'):
+            reply = 'Speech recognition isn\'t available right now. You can type your request instead.'
+        else:
+            reply = 'I didn\'t hear anything. Please try again.'
+        return jsonify({
+            'transcript': '',
+            'response': reply,
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    try:
+        session_id = get_session_id(request.args)
+        with log_session(session_id):
+            response = respond_to_text(text, session_id=session_id, utterance_id=utterance_id)
+        assistant.metrics.first_audio()
+        return jsonify({
+            'transcript': text,
+            'response': response,
+            'session_id': session_id,
+            'dialog': pending_dialog(session_id, request.args),
+            'timestamp': datetime.now().isoformat()
+        })
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def get_session_id(data=None):
+    """Dialog session for this client: an explicit ``session_id`` or the browser's cookie session"""
+    session_id = (data or {}).get('session_id')
+    if session_id:
+        return str(session_id)
+    return session.get('sid') or str(uuid.uuid4())
+
+def pending_dialog(session_id, data=None):
+    """Slot the session is being asked about, keeping the cookie only while a question is open.
+
+    Clients without a pending question carry no session cookie, so ordinary
+    requests don't pay for signing and verifying it.
+    """
+    slot = assistant.dialogs.pending_slot(session_id)
+    if not (data or {}).get('session_id'):
+        if slot:
+            session['sid'] = session_id
+        elif 'sid' in session:
+            session.pop('sid')
+    return slot
+
+def respond_to_text(text, depth=0, session_id=None, utterance_id=None):
+    """Run text through intent processing and the actions behind it, returning the reply.
+
+    ``utterance_id`` names the partial transcripts reported for this text; a
+    fetch started from them is used when it was for the same request.
+    """
+    try:
+        # An answer to a pending follow-up question fills the dialog instead of starting a new intent
+        if depth == 0:
+            reply = assistant.continue_dialog(text, session_id)
+            if reply is not None:
+                return reply
         
-        elif intent.type.value == "date":
-            now = datetime.now()
-            response = f"Today is {now.strftime('%A, %B %d, %Y')}"
+        def perform(intent, intent_text):
+            # Steps of a command or routine are part of the turn that ran it, not turns of their own
+            with assistant.recorded(intent) if depth == 0 else contextlib.nullcontext():
+                if utterance_id and assistant.speculation:
+                    reply = assistant.speculation.commit(utterance_id, intent)
+                    if reply is not None:
+                        return reply
+                return perform_intent(intent, intent_text, depth, session_id)
         
-        elif intent.type.value == "reminder":
-            # Extract reminder details from text
-            reminder_match = re.search(r'remind me to (.+)', text, re.IGNORECASE)
-            if reminder_match:
-                reminder_text = reminder_match.group(1)
-                # Try to extract time
-                time_match = re.search(r'in (\d+) (minute|minutes|hour|hours)', text, re.IGNORECASE)
-                if time_match:
-                    time_value = int(time_match.group(1))
-                    time_unit = time_match.group(2)
-                    if 'hour' in time_unit:
-                        time_value *= 60
-                    response = f"Reminder set: '{reminder_text}' in {time_value} minutes"
-                    # Schedule the reminder using the assistant's reminder monitor (in-memory)
-                    try:
-                        if not assistant:
-                            # Try to initialize synchronously as a fallback
-                            initialize_assistant()
-                        if assistant:
-                            due = time.time() + (time_value * 60)
-                            rid = str(uuid.uuid4())
-                            assistant.reminders.append((due, reminder_text, rid))
-                            logging_info = f"[web_interface] Scheduled reminder {rid} in {time_value} minutes: {reminder_text}"
-                            print(logging_info)
-                        else:
-                            response += " (Note: assistant not available to schedule reminder)"
-                    except Exception as e:
-                        print(f"Error scheduling reminder from web UI: {e}")
-                else:
-                    response = f"I'll remind you to {reminder_text}. How many minutes from now?"
+        # Process the text command; a compound request gets one reply per part
+        intents = assistant.parse_intents(text)
+        with assistant.metrics.span('handler'):
+            if len(intents) == 1:
+                return perform(intents[0], text)
+            replies = assistant.run_intents(intents, lambda intent: perform(intent, intent.raw_text))
+            return "\n".join(replies)
+    finally:
+        if utterance_id and assistant.speculation:
+            assistant.speculation.finish(utterance_id)
+
+def perform_intent(intent, text, depth=0, session_id=None):
+    """Carry out a recognized intent and return the reply text"""
+    response = process_intent_response(intent)
+    
+    if intent.type.value == "custom":
+        return custom_command_response(int(intent.entities.get('command_id', 0)), depth, session_id)
+    
+    if intent.type.value == "routine":
+        routine = assistant.routines.get(int(intent.entities.get('routine_id', 0))) if assistant.routines else None
+        if not routine:
+            return "I couldn't find that routine."
+        return assistant.run_routine(routine, 'phrase', routine_step_performer(depth, session_id))
+    
+    # Actually perform the actions
+    if intent.type.value == "time":
+        now = datetime.now()
+        response = f"The current time is {now.strftime('%I:%M %p')}"
+    
+    elif intent.type.value == "date":
+        now = datetime.now()
+        response = f"Today is {now.strftime('%A, %B %d, %Y')}"
+    
+    elif intent.type.value == "reminder" and intent.entities.get('action') == 'list':
+        response = assistant.reminders_summary()
+    
+    elif intent.type.value == "reminder":
+        # Extract reminder details from text
+        reminder_match = re.search(r'remind me to (.+)', text, re.IGNORECASE)
+        schedule_error = None
+        try:
+            recurring = parse_recurrence(reminder_match.group(1)) if reminder_match else None
+        except RecurrenceError as e:
+            recurring, schedule_error = None, e
+        if schedule_error:
+            response = f"{schedule_error}. Please try a different schedule."
+        elif recurring and recurring[1] and assistant:
+            rule, reminder_text = recurring
+            first_due = rule.next_after(time.time())
+            if first_due is None:
+                response = "That schedule never comes up. Please try a different one."
             else:
-                response = "What should I remind you about? Please say 'remind me to [task]'"
-        
-        elif intent.type.value == "search":
-            query = intent.entities.get('query', '')
-            if query:
-                import webbrowser
-                url = f"https://www.google.com/search?q={query}"
-                webbrowser.open(url)
-                response = f"I've opened a search for '{query}' in your browser."
-        
-        elif intent.type.value == "wiki":
-            topic = intent.entities.get('topic', '')
-            if topic:
-                try:
-                    import wikipedia
-                    result = wikipedia.summary(topic, sentences=2)
-                    response = f"According to Wikipedia: {result}"
-                except wikipedia.exceptions.DisambiguationError:
-                    response = f"There are multiple results for {topic}. Can you be more specific?"
-                except wikipedia.exceptions.PageError:
-                    response = f"Sorry, I couldn't find information about {topic} on Wikipedia."
-                except Exception as e:
-                    response = f"An error occurred while searching Wikipedia: {str(e)}"
-        
-        elif intent.type.value == "wiki":
-            topic = intent.entities.get('topic', '')
-            if topic:
+                assistant.schedule_reminder(first_due, reminder_text, rule)
+                response = f"Recurring reminder set: '{reminder_text}' {rule.description}"
+        elif reminder_match:
+            # Task and time both come from the one sentence, e.g. "remind me to stretch at 6:30 pm"
+            parsed = parse_time_expression(reminder_match.group(1))
+            reminder_text = parsed.remainder if parsed and parsed.remainder else reminder_match.group(1)
+            passed = assistant.past_due_reply(parsed.due) if parsed else None
+            if passed:
+                response = passed
+            elif parsed:
+                when = describe_due(parsed.due)
+                response = f"Reminder set: '{reminder_text}' {when}"
+                # Schedule the reminder using the assistant's reminder monitor (in-memory)
                 try:
-                    import wikipedia
-                    result = wikipedia.summary(topic, sentences=3)
-                    response = f"According to Wikipedia: {result}"
-                except wikipedia.exceptions.DisambiguationError:
-                    response = f"There are multiple results for {topic}. Can you be more specific?"
-                except wikipedia.exceptions.PageError:
-                    response = f"Sorry, I couldn't find information about {topic} on Wikipedia."
+                    if not assistant:
+                        # Try to initialize synchronously as a fallback
+                        initialize_assistant()
+                    if assistant:
+                        rid = assistant.schedule_reminder(parsed.due.timestamp(), reminder_text)
+                        logging.info(f"[web_interface] Scheduled reminder {rid} {when}: {reminder_text}")
+                    else:
+                        response += " (Note: assistant not available to schedule reminder)"
                 except Exception as e:
-                    response = f"An error occurred while searching Wikipedia: {str(e)}"
+                    logging.error(f"Error scheduling reminder from web UI: {e}")
             else:
-                response = "What would you like to know about?"
-        
-        elif intent.type.value == "weather":
-            city = intent.entities.get('city', '')
-            if city:
-                try:
-                    import requests
-                    api_key = os.getenv("OPENWEATHER_API_KEY", "2118f4d5069acc918a62465f175ae59f")
-                    if api_key:
-                        url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units=metric"
-                        response_weather = requests.get(url, timeout=10)
+                response = assistant.start_dialog('reminder', session_id, slots={'task': reminder_text})
+        else:
+            response = assistant.start_dialog('reminder', session_id)
+    
+    elif intent.type.value == "search":
+        query = intent.entities.get('query', '')
+        if query:
+            import webbrowser
+            url = f"https://www.google.com/search?q={query}"
+            webbrowser.open(url)
+            response = f"I've opened a search for '{query}' in your browser."
+    
+    elif intent.type.value == "wiki":
+        topic = intent.entities.get('topic', '')
+        if topic:
+            try:
+                import wikipedia
+                with assistant.upstream('wikipedia', (OSError, wikipedia.exceptions.HTTPTimeoutError)), \
+                        assistant.metrics.span('external_api', 'wikipedia'):
+                    result = wikipedia.summary(topic, sentences=2)
+                assistant.remember('wikipedia', topic, result)
+                response = f"According to Wikipedia: {result}"
+            except wikipedia.exceptions.DisambiguationError:
+                response = f"There are multiple results for {topic}. Can you be more specific?"
+            except wikipedia.exceptions.PageError:
+                response = f"Sorry, I couldn't find information about {topic} on Wikipedia."
+            except Overloaded:
+                raise
+            except Exception as e:
+                # Also CircuitOpen: Wikipedia has been failing, so it was not called
+                logging.warning(f"Wikipedia lookup failed: {e}")
+                response = assistant.wiki_fallback(topic)
+    
+    elif intent.type.value == "weather":
+        city = intent.entities.get('city', '') or assistant.preference('default_city')
+        if city:
+            try:
+                import requests
+                api_key = os.getenv("OPENWEATHER_API_KEY", "2118f4d5069acc918a62465f175ae59f")
+                if api_key:
+                    url = f"{OPENWEATHER_URL}?q={city}&appid={api_key}&units=metric"
+                    with assistant.upstream('openweathermap'), assistant.metrics.span('external_api', 'openweathermap'):
+                        response_weather = requests.get(url, timeout=assistant.upstream_timeout('openweathermap', 10))
+                        check_upstream_status(response_weather)
                         data = response_weather.json()
-                        
-                        if data["cod"] != "404":
-                            temp = data["main"]["temp"]
-                            description = data["weather"][0]["description"]
-                            humidity = data["main"]["humidity"]
-                            response = f"The weather in {city} is {description} with a temperature of {temp}°C and humidity of {humidity}%"
-                        else:
-                            response = f"Sorry, I couldn't find weather data for {city}"
+                    
+                    if data["cod"] != "404":
+                        temp = data["main"]["temp"]
+                        description = data["weather"][0]["description"]
+                        humidity = data["main"]["humidity"]
+                        response = f"The weather in {city} is {description} with a temperature of {temp}°C and humidity of {humidity}%"
+                        assistant.remember('openweathermap', city, response)
                     else:
-                        response = f"Weather service is not configured. Please add your OpenWeatherMap API key."
-                except Exception as e:
-                    response = f"I couldn't get the weather information: {str(e)}"
+                        response = f"Sorry, I couldn't find weather data for {city}"
+                else:
+                    response = f"Weather service is not configured. Please add your OpenWeatherMap API key."
+            except Overloaded:
+                raise
+            except Exception as e:
+                # Also CircuitOpen: the weather service has been failing, so it was not called
+                logging.warning(f"Weather lookup failed: {e}")
+                response = assistant.weather_fallback(city)
+        else:
+            response = assistant.start_dialog('weather', session_id)
+    
+    elif intent.type.value == "note":
+        response = assistant.note_reply(text, session_id)
+    
+    elif intent.type.value == "news":
+        response = assistant.spoken_reply(intent)
+    
+    elif intent.type.value == "calculate":
+        expression = intent.entities.get('expression', '')
+        try:
+            result = calculator.evaluate(expression)
+            response = f"The result is {calculator.format_result(result)}"
+        except calculator.CalculationError:
+            response = "I couldn't calculate that expression. Please try a simpler one."
+    
+    elif intent.type.value == "smart_home":
+        if assistant.smart_home:
+            response = assistant.smart_home_reply(intent.entities.get('action', ''), intent.entities.get('device', ''),
+                                                  session_id)
+    
+    elif intent.type.value == "email":
+        # Email functionality - parse and send
+        sender_email = os.getenv("SENDER_EMAIL", "")
+        sender_password = os.getenv("SENDER_APP_PASSWORD", "")
         
-        elif intent.type.value == "email":
-            # Email functionality - parse and send
-            sender_email = os.getenv("SENDER_EMAIL", "")
-            sender_password = os.getenv("SENDER_APP_PASSWORD", "")
+        if not sender_email or not sender_password:
+            response = "Email functionality is not configured. Please set your email credentials in the .env file."
+        else:
+            # Try to parse email details from the text
+            email_data = parse_email_from_text(text)
+            
+            # A spoken name instead of an address is looked up in the contacts index
+            if email_data.get('recipient_name') and assistant.contacts:
+                contact, _ = assistant.contacts.resolve(email_data['recipient_name'])
+                if contact:
+                    email_data['recipient'] = contact.email
             
-            if not sender_email or not sender_password:
-                response = "Email functionality is not configured. Please set your email credentials in the .env file."
+            if email_data.get('recipient') and email_data.get('subject') and email_data.get('body'):
+                # Send the email
+                try:
+                    send_email_smtp(sender_email, sender_password, email_data['recipient'], 
+                                   email_data['subject'], email_data['body'])
+                    response = f"Email sent successfully to {email_data['recipient']}!"
+                except Exception as e:
+                    response = f"Failed to send email: {str(e)}"
             else:
-                # Try to parse email details from the text
-                email_data = parse_email_from_text(text)
-                
-                if email_data and email_data.get('recipient') and email_data.get('subject') and email_data.get('body'):
-                    # Send the email
-                    try:
-                        send_email_smtp(sender_email, sender_password, email_data['recipient'], 
-                                       email_data['subject'], email_data['body'])
-                        response = f"Email sent successfully to {email_data['recipient']}!"
-                    except Exception as e:
-                        response = f"Failed to send email: {str(e)}"
-                else:
-                    response = "Please provide email in this format: 'Send email to name@example.com with subject YOUR_SUBJECT and message YOUR_MESSAGE'"
-        
-        elif intent.type.value == "reminder":
-            # Reminder functionality
-            response = "Reminder functionality is available. I can help you set reminders, but this requires additional setup."
-        
+                # Ask for whatever is missing; an uncertain name is confirmed first
+                response = assistant.start_dialog('email', session_id, answers={
+                    'recipient': email_data.get('recipient') or email_data.get('recipient_name'),
+                    'subject': email_data.get('subject'),
+                    'body': email_data.get('body'),
+                })
+    
+    elif intent.type.value == "reminder":
+        # Reminder functionality
+        response = "Reminder functionality is available. I can help you set reminders, but this requires additional setup."
+    
+    return response
+
+@app.route('/api/reminders/bulk', methods=['POST'])
+@admission_controlled
+def bulk_reminders():
+    """Import many reminders at once.
+
+    Body: {"reminders": [{"text": ..., "when": "tomorrow at 9" | "due": <epoch or ISO>,
+    "repeat": "every weekday at 8 am" | "cron: 0 9 * * 1-5"}, ...]}. Items that can't
+    be parsed are reported back by index; the rest are scheduled in one batch.
+    """
+    if not assistant:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    
+    data = request.get_json(silent=True) or {}
+    items = data.get('reminders')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Provide a non-empty "reminders" list'}), 400
+    if len(items) > MAX_BULK_REMINDERS:
+        return jsonify({'error': f'At most {MAX_BULK_REMINDERS} reminders per request'}), 413
+    
+    now = time.time()
+    batch = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            batch.append(parse_bulk_reminder(item, now))
+        except (RecurrenceError, ValueError, TypeError, KeyError, OverflowError, OSError) as e:
+            errors.append({'index': index, 'error': str(e)})
+    
+    reminder_ids = assistant.schedule_reminders(batch) if batch else []
+    return jsonify({
+        'scheduled': len(reminder_ids),
+        'ids': reminder_ids,
+        'errors': errors,
+        'timestamp': datetime.now().isoformat()
+    }), 201 if reminder_ids else 400
+
+@app.route('/api/batch', methods=['POST'])
+@admission_controlled
+def replay_batch():
+    """Answer many utterances in one request, as the CLI's --batch mode does.
+
+    Body: {"utterances": ["what time is it", {"text": ..., "id": ..., "session_id": ...}, ...]}.
+    Returns one record per utterance, in order. With worker processes the
+    utterances are answered in parallel and are independent unless they share
+    a ``session_id``; without them they are one conversation.
+    """
+    if not assistant:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    
+    data = request.get_json(silent=True) or {}
+    items = data.get('utterances')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Provide a non-empty "utterances" list'}), 400
+    if len(items) > MAX_BATCH_UTTERANCES:
+        return jsonify({'error': f'At most {MAX_BATCH_UTTERANCES} utterances per request'}), 413
+    
+    messages = [item if isinstance(item, dict) else read_text_line(str(item)) for item in items]
+    try:
+        start = time.perf_counter()
+        if worker_pool:
+            records = worker_pool.replay(messages, assistant.schedule_reminders)
+        else:
+            # A batch may well run past the request deadline; its upstream calls each get the default wait
+            with deadline_scope(None):
+                records = [assistant.answer_request(message) for message in messages]
         return jsonify({
-            'response': response,
+            'results': records,
+            'workers': worker_pool.processes if worker_pool else 0,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 3),
             'timestamp': datetime.now().isoformat()
         })
-        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def parse_bulk_reminder(item, now):
+    """Turn one bulk import entry into a (due, text, rule) tuple for the scheduler"""
+    text = str(item['text']).strip()
+    if not text:
+        raise ValueError('Reminder text is empty')
+    
+    rule = None
+    if item.get('repeat'):
+        recurring = parse_recurrence(str(item['repeat']))
+        if not recurring:
+            raise ValueError(f"Unrecognized repeat schedule: {item['repeat']}")
+        rule = recurring[0]
+    
+    if 'due' in item:
+        due = item['due']
+        due = float(due) if isinstance(due, (int, float)) else datetime.fromisoformat(due).timestamp()
+        # Out-of-range epochs raise OverflowError or OSError here rather than in the scheduler
+        datetime.fromtimestamp(due)
+    elif item.get('when'):
+        parsed = parse_time_expression(str(item['when']), default_unit='minutes')
+        if not parsed:
+            raise ValueError(f"Unrecognized time: {item['when']}")
+        due = parsed.due.timestamp()
+    elif rule:
+        due = rule.next_after(now)
+        if due is None:
+            raise ValueError(f"Repeat schedule never fires: {item['repeat']}")
+    else:
+        raise ValueError('Reminder needs "due", "when" or "repeat"')
+    return due, text, rule
+
+@app.route('/api/devices')
+def list_devices():
+    """Smart home devices with their last known (cached) state"""
+    if not assistant or not assistant.smart_home:
+        return jsonify({'error': 'Smart home is not configured'}), 500
+    
+    controller = assistant.smart_home
+    return jsonify({'devices': [
+        dict(device.to_dict(), state=controller.cached_state(device))
+        for device in controller.registry.devices.values()
+    ]})
+
+@app.route('/api/contacts')
+def list_contacts():
+    """List contacts, or rank them against a spoken name with ?q="""
+    if not assistant or not assistant.contacts:
+        return jsonify({'error': 'Contacts are not available'}), 500
+    
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', 20, type=int)
+    if query:
+        matches = assistant.contacts.search(query, limit)
+        return jsonify({'matches': [dict(contact.to_dict(), score=score) for contact, score in matches]})
+    return jsonify({
+        'count': len(assistant.contacts),
+        'contacts': [contact.to_dict() for contact in assistant.contacts.list(limit)]
+    })
+
+@app.route('/api/contacts/import', methods=['POST'])
+@admission_controlled
+def import_contacts():
+    """Insert or update contacts in bulk.
+
+    Accepts JSON ({"contacts": [{"name": ..., "email": ...}, ...]} or a
+    {"name": "email"} object) or CSV (text/csv) with name and email columns.
+    Existing contacts with the same name get the new address.
+    """
+    if not assistant or not assistant.contacts:
+        return jsonify({'error': 'Contacts are not available'}), 500
+    
+    try:
+        if request.mimetype == 'text/csv':
+            reader = csv.DictReader(io.StringIO(request.get_data(as_text=True)))
+            entries = [(row.get('name') or '', row.get('email') or '') for row in reader]
+        else:
+            data = request.get_json(silent=True)
+            items = data.get('contacts', data) if isinstance(data, dict) else data
+            if isinstance(items, dict):
+                entries = list(items.items())
+            elif isinstance(items, list):
+                entries = [(str(item.get('name', '')), str(item.get('email', '')))
+                           if isinstance(item, dict) else ('', '') for item in items]
+            else:
+                return jsonify({'error': 'Provide a "contacts" list, a name-to-email object or CSV'}), 400
+    except csv.Error as e:
+        return jsonify({'error': f'Invalid CSV: {str(e)}'}), 400
+    
+    if not entries:
+        return jsonify({'error': 'No contacts provided'}), 400
+    if len(entries) > MAX_CONTACT_IMPORT:
+        return jsonify({'error': f'At most {MAX_CONTACT_IMPORT} contacts per request'}), 413
+    
+    try:
+        imported, errors = assistant.contacts.import_contacts(entries, assistant.user_context.user_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({
+        'imported': imported,
+        'total': len(assistant.contacts),
+        'errors': [{'index': index, 'error': message} for index, message in errors],
+        'timestamp': datetime.now().isoformat()
+    }), 201 if imported else 400
+
 @app.route('/api/conversation')
 def get_conversation():
     """Get conversation history"""
@@ -291,17 +864,195 @@ def get_conversation():
 @app.route('/api/settings', methods=['GET', 'POST'])
 def settings():
     """Handle settings"""
+    if not assistant or not assistant.preferences:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Provide the settings to change as a JSON object'}), 400
+        try:
+            changed = assistant.preferences.update(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'status': 'updated', 'changed': changed, 'settings': assistant.preferences.all()})
+    
+    return jsonify({
+        'assistant_name': os.getenv('ASSISTANT_NAME', 'Siri'),
+        'text_fallback': os.getenv('TEXT_FALLBACK_ENABLED', 'true').lower() == 'true',
+        **assistant.preferences.all()
+    })
+
+def custom_command_response(command_id, depth=0, session_id=None):
+    """Perform a user-defined command and return its reply text"""
+    command = assistant.custom_commands.get(command_id) if assistant.custom_commands else None
+    if not command:
+        return "I couldn't find that command."
+    
+    if command.action == 'speak':
+        return command.parameters['text']
+    elif command.action == 'open_url':
+        import webbrowser
+        url = command.parameters['url']
+        webbrowser.open(url if url.startswith("http") else f"https://{url}")
+        return f"Opening {command.parameters.get('name', url)}"
+    elif command.action == 'macro':
+        if depth >= MAX_MACRO_DEPTH:
+            return "That command calls itself too many times."
+        responses = []
+        for step in command.parameters['steps']:
+            if isinstance(step, dict):
+                try:
+                    intent = Intent(IntentType(step['intent']), 1.0, step.get('entities', {}), '')
+                except (KeyError, ValueError):
+                    responses.append(f"Unknown intent in macro step: {step}")
+                    continue
+                responses.append(perform_intent(intent, '', depth + 1, session_id))
+            else:
+                responses.append(respond_to_text(step, depth + 1, session_id))
+        return "\n".join(responses)
+    return "I couldn't run that command."
+
+@app.route('/api/commands', methods=['GET', 'POST'])
+@rate_limited
+def custom_commands():
+    """List or create custom commands"""
+    if not assistant or not assistant.custom_commands:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    
     if request.method == 'GET':
+        return jsonify({'commands': [c.to_dict() for c in assistant.custom_commands.list()]})
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        command = assistant.custom_commands.create(
+            assistant.user_context.user_id if assistant.user_context else None,
+            data.get('trigger', ''),
+            data.get('action', ''),
+            data.get('parameters', {})
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(command.to_dict()), 201
+
+@app.route('/api/commands/<int:command_id>', methods=['GET', 'PUT', 'DELETE'])
+@rate_limited
+def custom_command(command_id):
+    """Read, update or delete one custom command"""
+    if not assistant or not assistant.custom_commands:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    
+    store = assistant.custom_commands
+    if request.method == 'GET':
+        command = store.get(command_id)
+    elif request.method == 'PUT':
+        data = request.get_json(silent=True) or {}
+        try:
+            command = store.update(command_id, data.get('trigger'), data.get('action'), data.get('parameters'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        if store.delete(command_id):
+            return jsonify({'status': 'deleted'})
+        command = None
+    
+    if command is None:
+        return jsonify({'error': 'Command not found'}), 404
+    return jsonify(command.to_dict())
+
+def routine_step_performer(depth=0, session_id=None):
+    """Reply function for routine steps run from the web app"""
+    return lambda intent: perform_intent(intent, intent.raw_text, depth + 1, session_id)
+
+def routine_response(routine):
+    result = routine.to_dict()
+    next_runs = assistant.routine_scheduler.next_runs() if assistant.routine_scheduler else {}
+    if routine.id in next_runs:
+        result['next_run'] = datetime.fromtimestamp(next_runs[routine.id]).isoformat()
+    return result
+
+@app.route('/api/routines', methods=['GET', 'POST'])
+@rate_limited
+def routines():
+    """List or create routines"""
+    if not assistant or not assistant.routines:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    
+    if request.method == 'GET':
+        return jsonify({'routines': [routine_response(r) for r in assistant.routines.list()]})
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        routine = assistant.routines.create(
+            assistant.user_context.user_id if assistant.user_context else None,
+            data.get('name', ''),
+            data.get('steps', []),
+            data.get('trigger', ''),
+            data.get('schedule', ''),
+            data.get('enabled', True)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(routine_response(routine)), 201
+
+@app.route('/api/routines/<int:routine_id>', methods=['GET', 'PUT', 'DELETE'])
+@rate_limited
+def routine(routine_id):
+    """Read, update or delete one routine"""
+    if not assistant or not assistant.routines:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    
+    store = assistant.routines
+    if request.method == 'GET':
+        result = store.get(routine_id)
+    elif request.method == 'PUT':
+        data = request.get_json(silent=True) or {}
+        try:
+            result = store.update(routine_id, data.get('name'), data.get('steps'), data.get('trigger'),
+                                  data.get('schedule'), data.get('enabled'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        if store.delete(routine_id):
+            return jsonify({'status': 'deleted'})
+        result = None
+    
+    if result is None:
+        return jsonify({'error': 'Routine not found'}), 404
+    return jsonify(routine_response(result))
+
+@app.route('/api/routines/<int:routine_id>/run', methods=['POST'])
+@admission_controlled
+def run_routine(routine_id):
+    """Run a routine now and return its combined reply and timing"""
+    if not assistant or not assistant.routines:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    
+    found = assistant.routines.get(routine_id)
+    if found is None:
+        return jsonify({'error': 'Routine not found'}), 404
+    try:
+        with assistant.metrics.turn():
+            response = assistant.run_routine(found, 'api', routine_step_performer())
         return jsonify({
-            'assistant_name': os.getenv('ASSISTANT_NAME', 'Siri'),
-            'wake_mode': os.getenv('WAKE_MODE_ENABLED', 'true').lower() == 'true',
-            'text_fallback': os.getenv('TEXT_FALLBACK_ENABLED', 'true').lower() == 'true'
+            'response': response,
+            'run': assistant.routines.runs(routine_id, limit=1)[0],
+            'timestamp': datetime.now().isoformat()
         })
-    
-    elif request.method == 'POST':
-        data = request.get_json()
-        # Update settings (in a real app, save to database)
-        return jsonify({'status': 'updated'})
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/routines/<int:routine_id>/runs')
+def routine_runs(routine_id):
+    """Recent runs of a routine with their end-to-end timing"""
+    if not assistant or not assistant.routines:
+        return jsonify({'error': 'Assistant not initialized'}), 500
+    if assistant.routines.get(routine_id) is None:
+        return jsonify({'error': 'Routine not found'}), 404
+    limit = min(request.args.get('limit', 20, type=int), 200)
+    return jsonify({'runs': assistant.routines.runs(routine_id, limit)})
 
 def parse_email_from_text(text):
     """Parse email details from natural language text"""
@@ -312,6 +1063,10 @@ def parse_email_from_text(text):
     email_match = re.search(email_pattern, text)
     if email_match:
         email_data['recipient'] = email_match.group(0)
+    else:
+        name_match = re.search(r'\bto\s+(.+?)\s+(?:with subject|subject|about)\b', text, re.IGNORECASE)
+        if name_match:
+            email_data['recipient_name'] = name_match.group(1).strip()
     
     # Try to extract subject
     subject_patterns = [
@@ -417,6 +1172,12 @@ Just ask me anything!"""
                 return f"I would {action} the {device}, but smart home integration needs to be configured."
             else:
                 return "Smart home control is not configured yet."
+        elif intent.type.value == "calculate":
+            expression = intent.entities.get('expression', '')
+            if expression:
+                return f"Calculating {expression}..."
+            else:
+                return "What would you like me to calculate?"
         elif intent.type.value == "exit":
             return "Goodbye! Have a great day!"
         else:
@@ -427,7 +1188,7 @@ Just ask me anything!"""
 
 if __name__ == '__main__':
     # Initialize assistant
-    if initialize_assistant():
+    if assistant or initialize_assistant():
         print("Voice assistant initialized successfully!")
         app.run(debug=True, host='0.0.0.0', port=5000)
     else:
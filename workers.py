@@ -0,0 +1,174 @@
+"""Answer batches of utterances in worker processes.
+
+In the front end everything shares one GIL. While a batch replay matches
+intents and evaluates expressions for thousands of utterances, the request
+threads and the reminder monitor have to wait. ``WorkerPool`` gives that
+work to separate processes instead. Each worker builds its own assistant
+once, with no audio, and keeps its matcher (patterns, custom commands and
+routines) warm between tasks. Requests travel in chunks: one trip to a
+worker costs several times what classifying a single utterance does, so
+single /api/text requests are still answered in the front end.
+
+State that the front end owns stays with the front end or in SQLite:
+
+* workers read custom commands, routines and settings from the database and
+  reload them after the front end calls ``reload``;
+* reminders set by a replayed utterance are handed back to the front end,
+  which schedules them for its monitor. Scheduled routines also run only in
+  the front end;
+* dialog sessions stay in the front end. In a replay, requests are
+  independent unless they share a ``session_id``; requests that do run in
+  order on one worker.
+"""
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import structured_logging
+from enhanced_voice_assistant import LOG_LEVEL, EnhancedVoiceAssistant
+from routines import RoutineStore
+
+# Most requests one replay task carries: bigger chunks cost less to send, smaller ones spread the load better
+REPLAY_CHUNK_SIZE = 32
+# Longest a starting worker waits for the others before reporting ready anyway
+STARTUP_TIMEOUT = 60.0
+
+
+class WorkerAssistant(EnhancedVoiceAssistant):
+    """The assistant as a worker runs it: no audio, no routine timers, reminders handed back"""
+
+    def __init__(self):
+        super().__init__()
+        self.disable_audio()
+        self.handed_back = []
+
+    def _load_routines(self):
+        # Only the front end runs scheduled routines
+        if not self.db_connection:
+            raise RuntimeError("Database is not available")
+        return RoutineStore(self.db_connection, self.db_lock)
+
+    def schedule_reminders(self, items):
+        self.handed_back.extend(items)
+        # The front end assigns the real ids when it schedules them
+        return [0] * len(items)
+
+
+# Set up in each worker process by _initialize
+_assistant: Optional[WorkerAssistant] = None
+_generation = None
+_loaded_generation = 0
+_started = None
+
+
+def _initialize(log_queue, generation, started):
+    global _assistant, _generation, _loaded_generation, _started
+    structured_logging.forward_logging(log_queue, LOG_LEVEL)
+    # Workers answer through return values; what handlers print must not mix into the parent's stdout
+    sys.stdout = sys.stderr
+    _generation = generation
+    _loaded_generation = generation.value
+    _started = started
+    _assistant = WorkerAssistant()
+    _assistant.warm_up(['database', 'custom_commands', 'routines'], background=False)
+    logging.info(f"Worker {os.getpid()} ready")
+
+
+def _matcher() -> WorkerAssistant:
+    """This process's assistant, reloading commands, routines and settings if the front end changed them"""
+    global _loaded_generation
+    generation = _generation.value
+    if generation != _loaded_generation:
+        for store in (_assistant.custom_commands, _assistant.routines, _assistant.preferences):
+            if store:
+                store.load()
+        _loaded_generation = generation
+    return _assistant
+
+
+def _ping() -> int:
+    # Each startup ping holds its worker until all have one, so every process has initialized
+    try:
+        _started.wait(STARTUP_TIMEOUT)
+    except threading.BrokenBarrierError:
+        pass
+    return os.getpid()
+
+
+def _replay(chunk):
+    """Answer groups of (index, request); returns [(index, record)] and the reminders to schedule"""
+    assistant = _matcher()
+    session_id = assistant.user_context.session_id
+    answered = []
+    for group in chunk:
+        # A follow-up question left open by one group must not catch the next group's first request
+        assistant.dialogs.cancel(session_id)
+        for index, message in group:
+            answered.append((index, assistant.answer_request(message)))
+    # Workers may be stopped at any time; their counts must not wait for the background writers
+    assistant.save_counts()
+    reminders, assistant.handed_back = assistant.handed_back, []
+    return answered, reminders
+
+
+class WorkerPool:
+    """``processes`` worker processes, each with its own warm intent matcher"""
+
+    def __init__(self, processes: int):
+        # Workers are spawned, not forked: forking a process with running threads can deadlock the child
+        context = multiprocessing.get_context('spawn')
+        self.processes = processes
+        self._log_queue = context.Queue()
+        self._log_listener = structured_logging.listen_for_workers(self._log_queue)
+        self._generation = context.Value('i', 0)
+        self.executor = ProcessPoolExecutor(processes, context, _initialize,
+                                            (self._log_queue, self._generation, context.Barrier(processes)))
+        # Start every worker now instead of on the first requests
+        self._started = [self.executor.submit(_ping) for _ in range(processes)]
+
+    def wait_ready(self, timeout: Optional[float] = None) -> List[int]:
+        """Block until every worker has initialized; returns their process ids"""
+        return [future.result(timeout) for future in self._started]
+
+    def reload(self):
+        """Have every worker re-read custom commands, routines and settings before its next task"""
+        with self._generation.get_lock():
+            self._generation.value += 1
+
+    def replay(self, messages: List[Dict], schedule: Optional[Callable[[List], object]] = None) -> List[Dict]:
+        """Answer text-mode requests (see read_text_line) on the workers, returning records in input order.
+
+        Reminders the requests set are passed to ``schedule`` (e.g. the front
+        end's ``schedule_reminders``); without it they are dropped.
+        """
+        groups: Dict[tuple, List] = {}
+        for index, message in enumerate(messages):
+            session_id = message.get('session_id')
+            key = ('session', str(session_id)) if session_id else ('request', index)
+            groups.setdefault(key, []).append((index, message))
+        limit = max(1, min(REPLAY_CHUNK_SIZE, -(-len(messages) // self.processes)))
+        chunks, chunk, size = [], [], 0
+        for group in groups.values():
+            chunk.append(group)
+            size += len(group)
+            if size >= limit:
+                chunks.append(chunk)
+                chunk, size = [], 0
+        if chunk:
+            chunks.append(chunk)
+
+        records: List[Optional[Dict]] = [None] * len(messages)
+        for answered, reminders in self.executor.map(_replay, chunks):
+            for index, record in answered:
+                records[index] = record
+            if reminders and schedule:
+                schedule(reminders)
+        return records
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self._log_listener.stop()